@@ -0,0 +1,168 @@
+"""ASGI entry point with async upstream I/O.
+
+The restroom search and reverse-geocode API routes run as coroutines sharing one pooled httpx client, so a single worker keeps hundreds of Mapbox and Refuge Restrooms requests in flight instead of blocking on each. They share the sync routes' caches. Every other request is handed to the Flask app unchanged.
+
+Selected by ASYNC_UPSTREAM=1 in the Procfile:
+
+    $ gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+"""
+
+import asyncio
+import hashlib
+import time
+from urllib.parse import parse_qsl
+import httpx
+import orjson
+from asgiref.wsgi import WsgiToAsgi
+from app import create_app
+import encoding
+import geocode
+import metrics
+import restrooms
+import upstream
+
+flask_app = create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+async def read_json(receive):
+    """Read and parse a JSON request body. Returns None if it isn't JSON, like Flask's get_json(silent=True)."""
+
+    body = b''
+    more = True
+    while more:
+        message = await receive()
+        body += message.get('body', b'')
+        more = message.get('more_body', False)
+
+    try:
+        return orjson.loads(body or b'null')
+    except orjson.JSONDecodeError:
+        return None
+
+
+def request_header(scope, name):
+    """Value of the request's name header, or '' if it wasn't sent."""
+
+    return dict(scope['headers']).get(name, b'').decode('latin-1')
+
+
+async def send_body(scope, send, status, body, headers=()):
+    """Send a JSON body, compressed if the client accepts it, with any extra (name, value) headers."""
+
+    body, content_encoding = encoding.encode(body, request_header(scope, b'accept-encoding'))
+
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), (b'vary', b'Accept-Encoding'), *headers]
+    if content_encoding:
+        headers.append((b'content-encoding', content_encoding.encode()))
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(scope, send, status, **data):
+    """Send data as a JSON response, like jsonify."""
+
+    await send_body(scope, send, status, encoding.dumps(data))
+
+
+async def send_cacheable_json(scope, send, cache_control, **data):
+    """Send data as a JSON response with an ETag, or an empty 304 if the request's If-None-Match already has it."""
+
+    body = encoding.dumps(data)
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+    # Weak, since the body may be sent compressed
+    headers = [(b'etag', f'W/{etag}'.encode()), (b'cache-control', cache_control.encode())]
+
+    if_none_match = request_header(scope, b'if-none-match')
+    if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    await send_body(scope, send, 200, body, headers)
+
+
+def search_local(search_args):
+    """Search the local mirror inside a Flask app context, for running in a worker thread."""
+
+    with flask_app.app_context():
+        return restrooms.search(**search_args)
+
+
+async def get_reverse_geocode(scope, receive, send):
+    """Show top result through mapbox using coordinates"""
+
+    try:
+        lon, lat = geocode.parse_coordinates(await read_json(receive))
+    except ValueError as e:
+        return await send_json(scope, send, 400, detail=str(e))
+
+    try:
+        result = await geocode.reverse_geocode_async(lon, lat)
+    except (geocode.RateLimited, httpx.HTTPError) as e:
+        print(repr(e))
+        result = None
+
+    # Return empty object if no results
+    if not result:
+        return await send_json(scope, send, 200, detail={})
+
+    await send_json(scope, send, 200, result=result)
+
+
+async def get_restrooms(scope, receive, send):
+    """Restrooms near lat/lon matching the filters, closest first. Send format=columns for encoding.to_columns format."""
+
+    try:
+        args = dict(parse_qsl(scope['query_string'].decode()))
+        search_args = restrooms.parse_args(args)
+        result_format = encoding.result_format(args)
+    except ValueError as e:
+        return await send_json(scope, send, 400, detail=str(e))
+
+    try:
+        if restrooms.SOURCE == 'local':
+            results = await asyncio.to_thread(search_local, search_args)
+        else:
+            results = await restrooms.search_async(**search_args)
+    except httpx.HTTPError as e:
+        print(repr(e))
+        return await send_json(scope, send, 502, restrooms=result_format([]))
+
+    await send_cacheable_json(scope, send, f"public, max-age={restrooms.CACHE_MAX_AGE}", restrooms=result_format(results))
+
+
+ROUTES = {
+    ('POST', '/api/reverse-geocode'): get_reverse_geocode,
+    ('GET', '/api/restrooms'): get_restrooms,
+}
+
+
+async def lifespan(receive, send):
+    """Close the shared upstream client on shutdown."""
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream.close_async_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = ROUTES.get((scope.get('method'), scope.get('path')))
+    if route:
+        # Timed under the same route labels as the Flask routes they stand in for
+        start = time.perf_counter()
+        try:
+            return await route(scope, receive, send)
+        finally:
+            metrics.request_latency.observe(time.perf_counter() - start, scope['path'], scope['method'])
+
+    await wsgi_app(scope, receive, send)
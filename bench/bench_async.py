@@ -0,0 +1,122 @@
+"""Load test: upstream-bound API throughput per worker, sync vs async upstream I/O.
+
+Starts the stub upstream (bench/stub_upstream.py), then for each mode runs the app with a single gunicorn worker pointed at the stub and fires a mix of /api/reverse-geocode and /api/restrooms requests at random, uncached coordinates.
+
+    $ python bench/bench_async.py [--requests 2000] [--concurrency 200] [--delay 0.1]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'sync': ['gunicorn', 'app:create_app()'],
+    'async': ['gunicorn', 'asgi:app', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def start(cmd, env, url):
+    """Start a server process and wait until it answers."""
+
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for _ in range(100):
+        try:
+            httpx.get(url, timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+
+    proc.kill()
+    raise RuntimeError(f"{' '.join(cmd)} did not start")
+
+
+async def drive(base_url, total, concurrency):
+    """Send total requests, concurrency at a time. Returns (seconds, latencies, errors)."""
+
+    rng = random.Random(0)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(client):
+        nonlocal errors
+        lat, lon = rng.uniform(25, 49), rng.uniform(-124, -67)
+
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if rng.random() < 0.5:
+                    resp = await client.post('/api/reverse-geocode', json={'lon': lon, 'lat': lat})
+                else:
+                    resp = await client.get('/api/restrooms', params={'lat': lat, 'lon': lon})
+                if resp.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client) for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return elapsed, sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.1, help="stub upstream latency in seconds")
+    parser.add_argument('--stub-port', type=int, default=9100)
+    parser.add_argument('--port', type=int, default=9101)
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.port}"
+
+    env = dict(os.environ,
+        STUB_DELAY=str(args.delay),
+        MAPBOX_URL=stub_url,
+        REFUGE_URL=f"{stub_url}/api",
+        MAPBOX_RATE_LIMIT='1000000',
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'),
+        MAPBOX_TOKEN=os.environ.get('MAPBOX_TOKEN', 'bench'),
+    )
+
+    stub = start(['uvicorn', '--app-dir', 'bench', 'stub_upstream:app', '--port', str(args.stub_port), '--log-level', 'warning'], env, stub_url)
+    report = {}
+
+    try:
+        for mode, cmd in MODES.items():
+            server = start(cmd + ['-w', '1', '-b', f"127.0.0.1:{args.port}", '--timeout', '300'], env, f"{app_url}/login")
+            try:
+                elapsed, latencies, errors = asyncio.run(drive(app_url, args.requests, args.concurrency))
+            finally:
+                server.terminate()
+                server.wait()
+
+            report[mode] = {
+                'requests_per_sec_per_worker': round(args.requests / elapsed, 1),
+                'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+                'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+                'errors': errors,
+            }
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print(json.dumps({'requests': args.requests, 'concurrency': args.concurrency, 'upstream_delay_s': args.delay, 'modes': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Micro-benchmark: restroom result size on the wire and serialization time, per encoding.
+
+    $ python bench/bench_encoding.py [--results 60] [--repeat 200]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import encoding
+from stub_upstream import restrooms_near
+
+WORDS = "clean key counter back door stairs left right second floor lobby ask staff code receipt customers only open late".split()
+
+
+def sample_results(count):
+    """Stub restroom listings with varied comments and directions, like real ones, ranked with distances."""
+
+    rng = random.Random(0)
+    results = restrooms_near(39.95, -75.16, count)
+
+    for result in results:
+        result['comment'] = " ".join(rng.choices(WORDS, k=rng.randrange(5, 40)))
+        result['directions'] = " ".join(rng.choices(WORDS, k=rng.randrange(3, 25)))
+        result['distance'] = rng.uniform(0, 3)
+
+    return results
+
+
+def flask_default(data):
+    """What jsonify sent before: the standard library with Flask's defaults."""
+
+    return json.dumps(data, sort_keys=True, ensure_ascii=True, separators=(",", ":")).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--results', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    results = sample_results(args.results)
+    rows = {'restrooms': results}
+    columns = {'restrooms': encoding.to_columns(results)}
+
+    assert json.loads(encoding.dumps(rows)) == json.loads(flask_default(rows)), "orjson and json output differ"
+
+    def best(fn, data):
+        return min(timeit.repeat(lambda: fn(data), number=1, repeat=args.repeat))
+
+    print(f"{args.results} restroom results")
+    print("serialization:")
+    print(f"  json (Flask default):  {best(flask_default, rows) * 1e6:8.1f} us")
+    print(f"  orjson:                {best(encoding.dumps, rows) * 1e6:8.1f} us")
+    print(f"  orjson, columns:       {best(lambda r: encoding.dumps({'restrooms': encoding.to_columns(r)}), results) * 1e6:8.1f} us")
+
+    print("bytes on the wire:")
+    for name, body in (("rows", flask_default(rows)), ("columns", encoding.dumps(columns))):
+        gzipped = gzip.compress(body, encoding.GZIP_LEVEL, mtime=0)
+        gzip_s = best(lambda b: gzip.compress(b, encoding.GZIP_LEVEL, mtime=0), body)
+        line = f"  {name + ':':9} {len(body):7} raw  {len(gzipped):6} gzip ({gzip_s * 1e6:.0f} us)"
+        if encoding.brotli:
+            compressed = encoding.brotli.compress(body, quality=encoding.BROTLI_QUALITY)
+            brotli_s = best(lambda b: encoding.brotli.compress(b, quality=encoding.BROTLI_QUALITY), body)
+            line += f"  {len(compressed):6} br ({brotli_s * 1e6:.0f} us)"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
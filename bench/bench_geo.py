@@ -0,0 +1,59 @@
+"""Micro-benchmark: vectorized geo.nearest against a pure-Python loop.
+
+    $ python bench/bench_geo.py [--points 100000] [--k 10] [--repeat 20]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import geo
+
+
+def python_nearest(lat, lon, lats, lons, k, mask):
+    """Baseline: scalar haversine per candidate, then sort."""
+
+    distances = [
+        (geo.haversine_mi(lat, lon, plat, plon), i)
+        for i, (plat, plon, ok) in enumerate(zip(lats, lons, mask)) if ok
+    ]
+    distances.sort()
+
+    return distances[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, default=100_000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(25, 49, args.points)
+    lons = rng.uniform(-124, -67, args.points)
+    mask = rng.random(args.points) < 0.5
+    lat, lon = 39.95, -75.16
+
+    idx, _ = geo.nearest(lat, lon, lats, lons, args.k, mask)
+    expected = [i for _, i in python_nearest(lat, lon, lats.tolist(), lons.tolist(), args.k, mask.tolist())]
+    assert idx.tolist() == expected, "vectorized and loop results differ"
+
+    numpy_s = min(timeit.repeat(lambda: geo.nearest(lat, lon, lats, lons, args.k, mask), number=1, repeat=args.repeat))
+    lists = lats.tolist(), lons.tolist(), mask.tolist()
+    python_s = min(timeit.repeat(lambda: python_nearest(lat, lon, *lists[:2], args.k, lists[2]), number=1, repeat=max(1, args.repeat // 10)))
+
+    queries = rng.uniform(25, 49, 32), rng.uniform(-124, -67, 32)
+    batch_s = min(timeit.repeat(lambda: geo.nearest(*queries, lats, lons, args.k, mask), number=1, repeat=max(1, args.repeat // 4)))
+
+    print(f"{args.points} candidates, k={args.k}")
+    print(f"  numpy, 1 query:     {numpy_s * 1000:8.2f} ms")
+    print(f"  numpy, 32 queries:  {batch_s * 1000:8.2f} ms ({batch_s / 32 * 1000:.2f} ms/query)")
+    print(f"  python loop:        {python_s * 1000:8.2f} ms ({python_s / numpy_s:.0f}x slower)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark: memory and serialization time of saved searches read as SavedSearchRows (SavedSearch.read) against ORM objects.
+
+Loads --rows saved searches both ways and reports the memory each holds, scaled to 100k rows, and the fastest of --repeat times to load them and to serialize them to JSON: the ORM objects through serialize() then encoding.dumps, as views did, and the rows straight through encoding.dumps.
+
+    $ python bench/bench_read_model.py [--rows 100000] [--repeat 3] [--no-seed]
+
+Uses DATABASE_URL, defaulting to postgresql:///flusher-bench; the database is dropped and re-seeded with --rows saved searches unless --no-seed is given.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', "postgresql:///flusher-bench")
+from load_test import seed_database
+from app import create_app
+from models import db, SavedSearch
+import encoding
+
+
+def held(load):
+    """Call load() and return (result, bytes it allocated and still holds)."""
+
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return result, size
+
+
+def timed(fn, repeat):
+    """Fastest of repeat calls to fn, in seconds."""
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def measure(load, serialize, repeat):
+    """Load rows one way, then time serializing them. Returns the report for that way."""
+
+    load_s = timed(lambda: (db.session.expunge_all(), load()), repeat)
+    db.session.expunge_all()
+    results, size = held(load)
+    count = len(results)
+    serialize_s = timed(lambda: serialize(results), repeat)
+    body = serialize(results)
+    db.session.expunge_all()
+
+    return {
+        'rows': count,
+        'mb_per_100k': round(size / count * 100_000 / 2**20, 1),
+        'load_s': round(load_s, 3),
+        'serialize_s': round(serialize_s, 4),
+        'serialize_rows_per_s': round(count / serialize_s),
+        'body_bytes': len(body),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-seed', action='store_true', help="reuse the database as seeded by an earlier run")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed_database(dict(os.environ, SECRET_KEY='bench'), max(1, args.rows // 100), args.rows)
+
+    with create_app(views=False).app_context():
+        limit = SavedSearch.id.in_(db.select(SavedSearch.id).order_by(SavedSearch.id).limit(args.rows).scalar_subquery())
+
+        orm = measure(
+            lambda: SavedSearch.query.filter(limit).order_by(SavedSearch.id).all(),
+            lambda searches: encoding.dumps([s.serialize() for s in searches]),
+            args.repeat)
+        rows = measure(
+            lambda: SavedSearch.read(limit),
+            encoding.dumps,
+            args.repeat)
+
+    print(json.dumps({
+        'orm': orm,
+        'read_model': rows,
+        'memory_ratio': round(orm['mb_per_100k'] / rows['mb_per_100k'], 1),
+        'serialize_speedup': round(orm['serialize_s'] / rows['serialize_s'], 1),
+        'load_speedup': round(orm['load_s'] / rows['load_s'], 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Startup benchmark: import and app creation time for a web worker, a background worker and a script, against a budget.
+
+Each runs in a fresh interpreter under python -X importtime, so nothing is shared between runs. Exits non-zero if the fastest run of any of them is over its budget, so it can gate CI; the slowest imports are listed to show where the time goes.
+
+    $ python bench/bench_startup.py [--repeat 5] [--top 8] [--web-budget 600] [--worker-budget 400] [--script-budget 300]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'web': "import app; app.create_app()",
+    'worker': "import app, jobs; app.create_app(views=False)",
+    'script': "import app; app.create_app(views=False)",
+}
+
+TIMED = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def run(code):
+    """Run code in a fresh interpreter. Returns (seconds, [(cumulative us, depth, module)] from -X importtime)."""
+
+    env = {'SECRET_KEY': 'bench', **os.environ}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', TIMED.format(code=code)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((int(cumulative), depth, name.strip()))
+
+    return float(proc.stdout.split()[-1]), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help="slowest imports to list per scenario")
+    parser.add_argument('--web-budget', type=float, default=600, help="milliseconds")
+    parser.add_argument('--worker-budget', type=float, default=400, help="milliseconds")
+    parser.add_argument('--script-budget', type=float, default=300, help="milliseconds")
+    args = parser.parse_args()
+
+    over = []
+    for name, code in SCENARIOS.items():
+        budget = getattr(args, f"{name}_budget")
+        seconds, imports = min((run(code) for _ in range(args.repeat)), key=lambda result: result[0])
+
+        print(f"{name + ':':8} {seconds * 1000:7.1f} ms  (budget {budget:.0f} ms)  {code}")
+        for cumulative, _, module in sorted((i for i in imports if i[1] <= 1), reverse=True)[:args.top]:
+            print(f"    {cumulative / 1000:7.1f} ms  {module}")
+
+        if seconds * 1000 > budget:
+            over.append(name)
+
+    if over:
+        sys.exit(f"over budget: {', '.join(over)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark: throughput, latency and memory per gunicorn worker class, under the production settings in gunicorn.conf.py.
+
+Seeds the bench database once like load_test.py, then for each worker class starts gunicorn with GUNICORN_WORKER_CLASS set and drives the same request mix at it. Reports load_test.py's overall numbers for each, plus the server's total proportional set size (PSS), which splits memory the preloaded workers share between them. Classes whose packages aren't installed (gevent needs gevent and psycogreen) are skipped.
+
+    $ python bench/bench_workers.py [--classes sync,gthread,gevent] [--workers N] [--threads 4] [--requests 3000]
+          [--concurrency 50] [--no-preload] [--output workers.json]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+from bench_async import start
+from load_test import DEFAULT_MIX, bench_env, drive, parse_mix, seed_database, seeded_users, summarize
+
+REQUIRES = {'gevent': ['gevent', 'psycogreen']}
+
+
+def pss_mb(pid):
+    """Proportional set size of pid and its children in MB, from /proc (Linux only). None if unavailable."""
+
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+
+        total = 0
+        for p in [pid, *children]:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                total += sum(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+    except OSError:
+        return None
+
+    return round(total / 1024, 1)
+
+
+def run(worker_class, args, env, users, weights):
+    """Serve with worker_class and drive the request mix at it. Returns its report."""
+
+    env = dict(env, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_THREADS=str(args.threads), GUNICORN_PRELOAD=str(not args.no_preload))
+    if args.workers:
+        env['WEB_CONCURRENCY'] = str(args.workers)
+
+    app_url = f"http://127.0.0.1:{args.port}"
+    server = start(['gunicorn', 'app:create_app()', '-b', f"127.0.0.1:{args.port}", '--timeout', '300'], env, f"{app_url}/login")
+    try:
+        elapsed, samples = asyncio.run(drive(app_url, users, weights, args.requests, args.concurrency))
+        memory = pss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return dict(summarize(elapsed, samples)['all'], pss_mb=memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--classes', default='sync,gthread,gevent')
+    parser.add_argument('--workers', type=int, help="processes per class, default from gunicorn.conf.py")
+    parser.add_argument('--threads', type=int, default=4, help="threads per gthread worker")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--searches', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--mix', type=parse_mix, default=f"{DEFAULT_MIX},restrooms=4,reverse_geocode=2")
+    parser.add_argument('--delay', type=float, default=0.05, help="stub upstream latency in seconds")
+    parser.add_argument('--no-preload', action='store_true')
+    parser.add_argument('--no-seed', action='store_true', help="reuse the database as seeded by an earlier run")
+    parser.add_argument('--stub-port', type=int, default=9100)
+    parser.add_argument('--port', type=int, default=9101)
+    parser.add_argument('--output', help="also write the report to this file")
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    env = bench_env(stub_url, args.delay)
+
+    if not args.no_seed:
+        seed_database(env, args.users, args.searches)
+    users = seeded_users(env['DATABASE_URL'], args.concurrency)
+
+    results = {}
+    stub = start(['uvicorn', '--app-dir', 'bench', 'stub_upstream:app', '--port', str(args.stub_port), '--log-level', 'warning'], env, stub_url)
+    try:
+        for worker_class in args.classes.split(','):
+            missing = [name for name in REQUIRES.get(worker_class, []) if importlib.util.find_spec(name) is None]
+            if missing:
+                results[worker_class] = {'skipped': f"not installed: {', '.join(missing)}"}
+                continue
+            results[worker_class] = run(worker_class, args, env, users, args.mix)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    report = json.dumps({
+        'cores': len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+        'workers': args.workers or 'default',
+        'threads': args.threads,
+        'preload': not args.no_preload,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'upstream_delay_s': args.delay,
+        'classes': results,
+    }, indent=2)
+
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Load test: throughput, latency percentiles and error rate per route.
+
+Seeds a database with --users users and --searches saved searches (seed.py, then generate.py), starts the stub upstream (bench/stub_upstream.py) and the app under gunicorn, then has --concurrency simulated users send --requests requests drawn from a weighted mix of routes. Prints a JSON report, so runs can be saved and compared over time.
+
+    $ python bench/load_test.py [--users 1000] [--searches 10000] [--requests 5000] [--concurrency 50]
+          [--mix signup=1,login=2,search_page=2,search=5,add=2,profile=3] [--workers 2] [--output run.json]
+
+Uses DATABASE_URL, defaulting to postgresql:///flusher-bench; the database is dropped and re-seeded unless --no-seed is given.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+import httpx
+from sqlalchemy import create_engine, text
+from bench_async import ROOT, start
+
+DEFAULT_MIX = 'signup=1,login=2,search_page=2,search=5,add=2,profile=3'
+PASSWORD = 'password'  # generate.GENERATED_PASSWORD
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def parse_mix(mix):
+    """Parse "route=weight,..." into {route: weight}."""
+
+    weights = {}
+    for part in mix.split(','):
+        route, weight = part.split('=')
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route {route!r}, expected one of {', '.join(ROUTES)}")
+        weights[route] = float(weight)
+    return weights
+
+
+def percentile(latencies, p):
+    """Nearest-rank percentile of sorted latencies."""
+
+    return latencies[max(0, math.ceil(len(latencies) * p / 100) - 1)]
+
+
+async def csrf_post(client, path, data):
+    """Fetch the form at path for its CSRF token, then submit it with data."""
+
+    page = await client.get(path)
+    match = CSRF_RE.search(page.text)
+    if match is None:
+        return page
+    return await client.post(path, data=dict(data, csrf_token=match.group(1)))
+
+
+class VirtualUser:
+    """A logged-in client and the seeded user and saved searches it owns"""
+
+    def __init__(self, client, user_id, username, search_ids):
+        self.client = client
+        self.user_id = user_id
+        self.username = username
+        self.search_ids = search_ids
+
+
+##################################################
+# Routes under test
+#
+# Each takes (base_url, virtual user, rng, counter) and returns True if the response was as expected.
+
+
+async def signup(base_url, vu, rng, counter):
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        n = next(counter)
+        resp = await csrf_post(client, '/signup', {'username': f"bench{n}", 'email': f"bench{n}@example.com", 'password': PASSWORD})
+        return resp.status_code == 302
+
+
+async def login(base_url, vu, rng, counter):
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        resp = await csrf_post(client, '/login', {'identifier': vu.username, 'password': PASSWORD})
+        return resp.status_code == 302 and resp.headers['location'].endswith('/')
+
+
+async def search_page(base_url, vu, rng, counter):
+    resp = await vu.client.get('/search')
+    return resp.status_code == 200
+
+
+async def search(base_url, vu, rng, counter):
+    if not vu.search_ids:
+        return True
+    resp = await vu.client.get(f"/search/{rng.choice(vu.search_ids)}")
+    return resp.is_success
+
+
+async def add(base_url, vu, rng, counter):
+    resp = await vu.client.post('/search/add', json={
+        'name': f"bench search {next(counter)}",
+        'query_string': "",
+        'lon': rng.uniform(-124, -67),
+        'lat': rng.uniform(25, 49),
+        'accessible': rng.random() < 0.5,
+        'unisex': rng.random() < 0.5,
+        'changing_table': False,
+    })
+    return resp.status_code == 201
+
+
+async def profile(base_url, vu, rng, counter):
+    resp = await vu.client.get(f"/users/{vu.user_id}")
+    return resp.status_code == 200
+
+
+async def restrooms(base_url, vu, rng, counter):
+    resp = await vu.client.get('/api/restrooms', params={'lat': rng.uniform(25, 49), 'lon': rng.uniform(-124, -67)})
+    return resp.status_code == 200
+
+
+async def reverse_geocode(base_url, vu, rng, counter):
+    resp = await vu.client.post('/api/reverse-geocode', json={'lat': rng.uniform(25, 49), 'lon': rng.uniform(-124, -67)})
+    return resp.status_code == 200
+
+
+ROUTES = {
+    'signup': signup,
+    'login': login,
+    'search_page': search_page,
+    'search': search,
+    'add': add,
+    'profile': profile,
+    'restrooms': restrooms,
+    'reverse_geocode': reverse_geocode,
+}
+
+
+##################################################
+# Driver
+
+
+def bench_env(stub_url, delay):
+    """Environment for the app and stub upstream: the bench database, and upstream APIs answered by the stub after delay seconds."""
+
+    return dict(os.environ,
+        DATABASE_URL=os.environ.get('DATABASE_URL', "postgresql:///flusher-bench"),
+        STUB_DELAY=str(delay),
+        MAPBOX_URL=stub_url,
+        REFUGE_URL=f"{stub_url}/api",
+        MAPBOX_RATE_LIMIT='1000000',
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'),
+        MAPBOX_TOKEN=os.environ.get('MAPBOX_TOKEN', 'bench'),
+    )
+
+
+def seed_database(env, users, searches):
+    """Recreate the bench database's tables with the demo data, users generated users and searches saved searches."""
+
+    subprocess.run([sys.executable, 'seed.py'], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([sys.executable, 'generate.py', '--users', str(users), '--searches', str(searches)], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def seeded_users(database_url, count):
+    """Pick count seeded users at random, with the ids of their saved searches."""
+
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        users = conn.execute(text("SELECT id, username FROM users WHERE username LIKE 'user%' ORDER BY random() LIMIT :n"), {'n': count}).all()
+        searches = defaultdict(list)
+        for id, user_id in conn.execute(text("SELECT id, user_id FROM saved_searches WHERE user_id = ANY(:ids)"), {'ids': [u.id for u in users]}):
+            searches[user_id].append(id)
+    engine.dispose()
+
+    if not users:
+        raise RuntimeError("no generated users found; run without --no-seed or seed with generate.py --users N")
+
+    return [(user.id, user.username, searches[user.id]) for user in users]
+
+
+async def drive(base_url, users, weights, total, concurrency, seed=0):
+    """Send total requests from concurrency virtual users. Returns (seconds, {route: [(latency, ok)]})."""
+
+    rng = random.Random(seed)
+    routes = list(weights)
+    plan = rng.choices(routes, weights=[weights[r] for r in routes], k=total)
+    counter = itertools.count(int(time.time()))
+    samples = defaultdict(list)
+
+    async def run(vu, jobs):
+        for route in jobs:
+            start = time.perf_counter()
+            try:
+                ok = await ROUTES[route](base_url, vu, rng, counter)
+            except httpx.HTTPError:
+                ok = False
+            samples[route].append((time.perf_counter() - start, ok))
+
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=120) for _ in range(concurrency)]
+    try:
+        vus = []
+        for client, (user_id, username, search_ids) in zip(clients, itertools.cycle(users)):
+            await csrf_post(client, '/login', {'identifier': username, 'password': PASSWORD})
+            vus.append(VirtualUser(client, user_id, username, search_ids))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run(vu, plan[i::concurrency]) for i, vu in enumerate(vus)))
+        elapsed = time.perf_counter() - start
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    return elapsed, samples
+
+
+def summarize(elapsed, samples):
+    """Per-route and overall throughput, latency percentiles in ms and error rate."""
+
+    def stats(results):
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(not ok for _, ok in results)
+        return {
+            'requests': len(results),
+            'requests_per_sec': round(len(results) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'error_rate': round(errors / len(results), 4),
+        }
+
+    report = {route: stats(results) for route, results in sorted(samples.items())}
+    report['all'] = stats([sample for results in samples.values() for sample in results])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--searches', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f"route weights, default {DEFAULT_MIX}; also restrooms, reverse_geocode")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers")
+    parser.add_argument('--delay', type=float, default=0.05, help="stub upstream latency in seconds")
+    parser.add_argument('--no-seed', action='store_true', help="reuse the database as seeded by an earlier run")
+    parser.add_argument('--stub-port', type=int, default=9100)
+    parser.add_argument('--port', type=int, default=9101)
+    parser.add_argument('--output', help="also write the report to this file")
+    args = parser.parse_args()
+
+    weights = args.mix
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.port}"
+    env = bench_env(stub_url, args.delay)
+
+    if not args.no_seed:
+        seed_database(env, args.users, args.searches)
+
+    users = seeded_users(env['DATABASE_URL'], args.concurrency)
+
+    stub = start(['uvicorn', '--app-dir', 'bench', 'stub_upstream:app', '--port', str(args.stub_port), '--log-level', 'warning'], env, stub_url)
+    try:
+        server = start(['gunicorn', 'app:create_app()', '-w', str(args.workers), '-b', f"127.0.0.1:{args.port}", '--timeout', '300'], env, f"{app_url}/login")
+        try:
+            elapsed, samples = asyncio.run(drive(app_url, users, weights, args.requests, args.concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    report = json.dumps({
+        'users': args.users,
+        'searches': args.searches,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'workers': args.workers,
+        'upstream_delay_s': args.delay,
+        'mix': weights,
+        'seconds': round(elapsed, 2),
+        'routes': summarize(elapsed, samples),
+    }, indent=2)
+
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Local stand-in for the Mapbox and Refuge Restrooms APIs, for load tests.
+
+Answers every request after STUB_DELAY seconds (default 0.1) without doing any real work, so the app's upstream I/O can be measured in isolation. Point the app at it with MAPBOX_URL=http://127.0.0.1:<port> and REFUGE_URL=http://127.0.0.1:<port>/api.
+
+    $ STUB_DELAY=0.1 uvicorn --app-dir bench stub_upstream:app --port 9100
+"""
+
+import asyncio
+import json
+import os
+import random
+from urllib.parse import parse_qsl
+
+DELAY = float(os.environ.get('STUB_DELAY', 0.1))
+
+
+def restrooms_near(lat, lon, count):
+    """Fake Refuge Restrooms listings scattered within a few miles of the point."""
+
+    rng = random.Random(f"{lat:.3f},{lon:.3f}")
+
+    return [{
+        'id': rng.randrange(1, 10**7),
+        'name': f"Stub restroom {i}",
+        'street': f"{i} Main St",
+        'city': "Philadelphia",
+        'state': "PA",
+        'country': "US",
+        'accessible': rng.random() < 0.5,
+        'unisex': rng.random() < 0.5,
+        'changing_table': rng.random() < 0.3,
+        'directions': "Ask at the counter for the key to the restroom in the back.",
+        'comment': "Clean, well lit and usually stocked.",
+        'latitude': lat + rng.uniform(-0.05, 0.05),
+        'longitude': lon + rng.uniform(-0.05, 0.05),
+        'upvote': rng.randrange(20),
+        'downvote': rng.randrange(5),
+        'created_at': "2022-01-01T00:00:00.000Z",
+        'updated_at': "2022-02-01T00:00:00.000Z",
+    } for i in range(count)]
+
+
+async def app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+
+    await asyncio.sleep(DELAY)
+
+    path = scope['path']
+    args = dict(parse_qsl(scope['query_string'].decode()))
+
+    if path.startswith('/geocoding/'):
+        data = {'features': [{'place_name': "1 Stub St, Philadelphia, Pennsylvania 19107, United States"}]}
+    elif path == '/api/v1/restrooms/by_location':
+        data = restrooms_near(float(args['lat']), float(args['lng']), int(args.get('per_page', 60)))
+    else:
+        data = []
+
+    body = json.dumps(data).encode()
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
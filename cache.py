@@ -0,0 +1,538 @@
+"""Caches, private to each process or shared between processes.
+
+make_cache picks the store from CACHE_URL:
+
+    local (default)                      TTLCache, in each process's memory
+    sqlite:///path/to/cache.db           SQLiteCache, a file shared by the processes on one host
+    redis://[:password@]host:6379/0      RedisCache, a Redis-protocol server shared by every host
+
+Every cache expires entries ttl seconds after they're set, counts hits and misses (shown on /metrics), and collapses concurrent misses for a key into one call to the loader. Shared caches also take a lock in the store, so only one process at a time loads a key. They keep values as JSON and prefix keys with the cache's name, so several caches can share one store. If a shared store can't be reached, lookups miss and values are loaded as if there were no cache.
+"""
+
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import orjson
+import metrics
+
+CACHE_URL = os.environ.get('CACHE_URL', 'local')
+LOCK_TIMEOUT = 10  # seconds another process waits on a shared load before loading the key itself
+LOCK_POLL = 0.05
+
+CACHES = {}
+
+_MISSING = object()
+
+
+class _Flight:
+    """A load in progress. Followers wait on it instead of calling the loader again."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Cache:
+    """Base for caches: counts hits and misses, and collapses concurrent misses for a key into one call to the loader.
+
+    Subclasses provide get(key, default) and set(key, value), and _load(key, loader) and _load_async(key, loader), which call the loader and cache its result. _get_async(key, default) is get, unless the store mustn't be used from the event loop.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}
+        self._async_pending = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        """Return cached value for key, calling loader() to fill it on a miss.
+
+        If another thread is already loading the same key, wait for its result rather than calling loader() again. Errors raised by the loader are passed on to every waiting caller and nothing is cached.
+        """
+
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            flight = self._pending.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._pending[key] = _Flight()
+
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.value = self._load(key, loader)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            flight.done.set()
+
+    async def _get_async(self, key, default=None):
+        return self.get(key, default)
+
+    async def get_or_load_async(self, key, loader):
+        """Like get_or_load, for a loader returning an awaitable.
+
+        Concurrent misses within the event loop share one await of the loader.
+        """
+
+        value = await self._get_async(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        future = self._async_pending.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._async_pending[key] = asyncio.get_running_loop().create_future()
+        # Mark a failure as retrieved even if nobody else was waiting on it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        try:
+            value = await self._load_async(key, loader)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._async_pending[key]
+
+
+class TTLCache(Cache):
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after being set.
+
+    Holds at most `maxsize` entries, evicting the least recently used first. `get_or_load` collapses concurrent misses for the same key into a single call to the loader.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        super().__init__(maxsize, ttl)
+        self.clock = clock
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key):
+        """Return live value for key or _MISSING. Caller must hold the lock."""
+
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+
+        expires, value = entry
+        if expires <= self.clock():
+            del self._data[key]
+            return _MISSING
+
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        """Return cached value for key, or default if missing or expired."""
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache value under key, evicting the least recently used entries if full."""
+
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def expire(self):
+        """Drop all expired entries. Returns the number removed."""
+
+        now = self.clock()
+        with self._lock:
+            stale = [key for key, (expires, _) in self._data.items() if expires <= now]
+            for key in stale:
+                del self._data[key]
+        return len(stale)
+
+    def _load(self, key, loader):
+        # A load that finished since our miss has already cached the value
+        with self._lock:
+            value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+
+        value = loader()
+        self.set(key, value)
+        return value
+
+    async def _load_async(self, key, loader):
+        value = await loader()
+        self.set(key, value)
+        return value
+
+
+##################################################
+# Shared caches
+
+
+class SharedCache(Cache):
+    """Base for caches kept in a store shared between processes.
+
+    Subclasses store bytes under string keys with _get(key), _set(key, data, ttl), _delete(key), and _add(key, data, ttl), which stores only if key is missing and returns whether it did. Errors in store_errors are treated as cache misses.
+    """
+
+    store_errors = ()
+
+    def __init__(self, name, maxsize=1024, ttl=300):
+        super().__init__(maxsize, ttl)
+        self.name = name
+        self.down = False
+
+    def _key(self, key):
+        return f"{self.name}:{key!r}"
+
+    def _try(self, method, *args, default=None):
+        """Call a store method, returning default if the store is unavailable. Logs once when the store goes down and once when it's back."""
+
+        try:
+            result = method(*args)
+        except self.store_errors as e:
+            if not self.down:
+                self.down = True
+                print(f"{self.name} cache unavailable, loading uncached: {e!r}")
+            return default
+
+        if self.down:
+            self.down = False
+            print(f"{self.name} cache available again")
+        return result
+
+    def _lookup(self, key):
+        """Return stored value for key or _MISSING, without counting a hit or miss."""
+
+        data = self._try(self._get, self._key(key))
+        return _MISSING if data is None else orjson.loads(data)
+
+    def get(self, key, default=None):
+        """Return cached value for key, or default if missing or expired."""
+
+        value = self._lookup(key)
+
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache value under key."""
+
+        self._try(self._set, self._key(key), orjson.dumps(value), self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self._try(self._delete, self._key(key))
+
+    def _load(self, key, loader):
+        """Call loader() holding the store's lock for key and cache its result. If another process holds the lock, wait for its result instead, for up to LOCK_TIMEOUT."""
+
+        lock = self._key(key) + ':lock'
+        deadline = time.monotonic() + LOCK_TIMEOUT
+
+        # An unavailable store can't be locked, so load as if uncached
+        locked = self._try(self._add, lock, b'1', LOCK_TIMEOUT, default=True)
+        while not locked and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            locked = self._try(self._add, lock, b'1', LOCK_TIMEOUT, default=True)
+
+        try:
+            value = loader()
+            self.set(key, value)
+            return value
+        finally:
+            if locked:
+                self._try(self._delete, lock)
+
+    async def _get_async(self, key, default=None):
+        # The store is used from worker threads, so the event loop never blocks on it
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def _load_async(self, key, loader):
+        """Async _load."""
+
+        lock = self._key(key) + ':lock'
+        deadline = time.monotonic() + LOCK_TIMEOUT
+
+        locked = await asyncio.to_thread(self._try, self._add, lock, b'1', LOCK_TIMEOUT, default=True)
+        while not locked and time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL)
+            value = await asyncio.to_thread(self._lookup, key)
+            if value is not _MISSING:
+                return value
+            locked = await asyncio.to_thread(self._try, self._add, lock, b'1', LOCK_TIMEOUT, default=True)
+
+        try:
+            value = await loader()
+            await asyncio.to_thread(self.set, key, value)
+            return value
+        finally:
+            if locked:
+                await asyncio.to_thread(self._try, self._delete, lock)
+
+
+class SQLiteCache(SharedCache):
+    """Cache in a SQLite file, shared by the processes on one host.
+
+    Each thread of each process opens its own connection. Every so often a set trims the cache to maxsize entries, dropping expired ones and then those closest to expiring.
+    """
+
+    store_errors = (sqlite3.Error,)
+
+    def __init__(self, path, name, maxsize=1024, ttl=300, clock=time.time):
+        super().__init__(name, maxsize, ttl)
+        self.path = path
+        self.clock = clock
+        self.evict_every = max(1, min(100, maxsize // 10))
+        self._sets = 0
+        self._local = threading.local()
+
+        self._connect().execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)")
+
+    def _connect(self):
+        """This thread's connection. Connections aren't carried across a fork."""
+
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+
+        return self._local.conn
+
+    def _bounds(self):
+        """Key range of this cache's entries: every key starts with "name:", and ";" sorts right after ":"."""
+
+        return (f"{self.name}:", f"{self.name};")
+
+    def __len__(self):
+        return self._connect().execute("SELECT count(*) FROM cache WHERE key >= ? AND key < ? AND expires > ?", (*self._bounds(), self.clock())).fetchone()[0]
+
+    def _get(self, key):
+        row = self._connect().execute("SELECT value FROM cache WHERE key = ? AND expires > ?", (key, self.clock())).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, data, ttl):
+        self._connect().execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, data, self.clock() + ttl))
+
+        with self._lock:
+            self._sets += 1
+            evict = self._sets % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def _add(self, key, data, ttl):
+        now = self.clock()
+        cursor = self._connect().execute(
+            "INSERT INTO cache VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires WHERE cache.expires <= ?",
+            (key, data, now + ttl, now))
+        return cursor.rowcount == 1
+
+    def _delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache WHERE key >= ? AND key < ?", self._bounds())
+
+    def expire(self):
+        """Drop all expired entries. Returns the number removed."""
+
+        return self._connect().execute("DELETE FROM cache WHERE key >= ? AND key < ? AND expires <= ?", (*self._bounds(), self.clock())).rowcount
+
+    def evict(self):
+        """Drop expired entries, then those closest to expiring until at most maxsize are left."""
+
+        self.expire()
+        self._connect().execute("""
+            DELETE FROM cache WHERE key IN (
+                SELECT key FROM cache WHERE key >= ?1 AND key < ?2 ORDER BY expires
+                LIMIT max(0, (SELECT count(*) FROM cache WHERE key >= ?1 AND key < ?2) - ?3))
+            """, (*self._bounds(), self.maxsize))
+
+
+class RedisError(Exception):
+    """An error reply from a Redis server."""
+
+
+class RedisClient:
+    """Minimal Redis protocol (RESP2) client, with a connection per thread."""
+
+    def __init__(self, url, timeout=2):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        """This thread's connection, as a buffered file. Connections aren't carried across a fork."""
+
+        if getattr(self._local, 'pid', None) != os.getpid() or self._local.conn is None:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+            self._local.conn, self._local.pid = sock.makefile('rwb'), os.getpid()
+
+            if self.password:
+                self.command('AUTH', self.password)
+            if self.db:
+                self.command('SELECT', self.db)
+
+        return self._local.conn
+
+    def command(self, *args):
+        """Send a command. Returns its reply as bytes, an int, a list, or None. Raises RedisError for an error reply, or OSError if the server can't be reached."""
+
+        conn = self._connect()
+        request = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            request.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+
+        try:
+            conn.write(b''.join(request))
+            conn.flush()
+            return self._reply(conn)
+        except OSError:
+            # Don't reuse a connection that may be half way through a reply
+            self._local.conn = None
+            raise
+
+    def _reply(self, conn):
+        line = conn.readline()
+        if not line:
+            raise ConnectionError("Redis server closed the connection")
+
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            return None if int(rest) == -1 else conn.read(int(rest) + 2)[:-2]
+        if kind == b'*':
+            return None if int(rest) == -1 else [self._reply(conn) for _ in range(int(rest))]
+
+        raise RedisError(f"unexpected reply {line!r}")
+
+
+class RedisCache(SharedCache):
+    """Cache in a Redis-protocol server, shared by every process on every host.
+
+    The server expires entries itself. Bound its size with the server's maxmemory and a volatile-lru maxmemory-policy; maxsize isn't enforced here.
+    """
+
+    store_errors = (OSError, RedisError)
+
+    def __init__(self, url, name, maxsize=1024, ttl=300):
+        super().__init__(name, maxsize, ttl)
+        self.client = RedisClient(url)
+
+    def _get(self, key):
+        return self.client.command('GET', key)
+
+    def _set(self, key, data, ttl):
+        self.client.command('SET', key, data, 'PX', int(ttl * 1000))
+
+    def _add(self, key, data, ttl):
+        return self.client.command('SET', key, data, 'PX', int(ttl * 1000), 'NX') is not None
+
+    def _delete(self, key):
+        self.client.command('DEL', key)
+
+    def clear(self):
+        cursor = b'0'
+        while True:
+            cursor, keys = self.client.command('SCAN', cursor, 'MATCH', f"{self.name}:*", 'COUNT', 1000)
+            if keys:
+                self.client.command('DEL', *keys)
+            if cursor == b'0':
+                return
+
+    def expire(self):
+        """Redis drops expired entries itself."""
+
+        return 0
+
+
+def make_cache(name, maxsize, ttl, url=None):
+    """Cache called name in the store url names, CACHE_URL by default (see the module docstring)."""
+
+    url = url or CACHE_URL
+
+    if url == 'local':
+        cache = TTLCache(maxsize, ttl)
+    elif url.startswith('sqlite:///'):
+        cache = SQLiteCache(url[len('sqlite:///'):], name, maxsize, ttl)
+    elif url.startswith('redis://'):
+        cache = RedisCache(url, name, maxsize, ttl)
+    else:
+        raise ValueError(f"CACHE_URL must be local, sqlite:///<path> or redis://<host>, not {url!r}")
+
+    CACHES[name] = cache
+    return cache
+
+
+def cache_metrics(lines):
+    """Hits and misses by cache, for /metrics."""
+
+    metrics.labeled_metric(lines, 'cache_hits_total', 'counter', "Cache lookups answered from the cache, in this process.", 'cache',
+        {name: cache.hits for name, cache in CACHES.items()})
+    metrics.labeled_metric(lines, 'cache_misses_total', 'counter', "Cache lookups that had to load the value, in this process.", 'cache',
+        {name: cache.misses for name, cache in CACHES.items()})
+
+
+metrics.COLLECTORS.append(cache_metrics)
@@ -0,0 +1,69 @@
+"""App configuration from environment variables"""
+
+import os
+from sqlalchemy.pool import NullPool
+from metrics import InstrumentedQueuePool
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def load_tokens():
+    """Copy SECRET_KEY and MAPBOX_TOKEN from a local tokens.py, if there is one, into the environment, where Heroku sets them."""
+
+    try:
+        import tokens
+    except ImportError:
+        return
+
+    for name in ('SECRET_KEY', 'MAPBOX_TOKEN'):
+        if hasattr(tokens, name):
+            os.environ[name] = getattr(tokens, name)
+
+
+def database_uri():
+    """Database URL from DATABASE_URL, fixing Heroku's postgres:// scheme"""
+
+    uri = os.environ.get('DATABASE_URL') or 'postgresql:///flusher'
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+
+    return uri
+
+
+def engine_options():
+    """SQLALCHEMY_ENGINE_OPTIONS from environment variables.
+
+    DB_POOL_SIZE            connections kept open per process (default 5)
+    DB_MAX_OVERFLOW         extra connections opened under load, then closed (default 5)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection before failing (default 10)
+    DB_POOL_RECYCLE         seconds before a connection is replaced, ahead of server/proxy idle timeouts (default 1800)
+    DB_POOL_PRE_PING        test connections on checkout, so ones dropped while idle are replaced transparently (default on)
+    DB_STATEMENT_TIMEOUT    server-side statement timeout in milliseconds (default none)
+    DB_PGBOUNCER            connect through PgBouncer in transaction mode: leave pooling to PgBouncer, and send no
+                            startup options it would reject (default off)
+
+    The whole app can hold at most processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections; keep that under the
+    database's connection limit. See the db_pool_* metrics on /metrics for checkout waits and overflow use.
+    """
+
+    if env_bool('DB_PGBOUNCER'):
+        return {'poolclass': NullPool}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True),
+    }
+
+    if os.environ.get('DB_STATEMENT_TIMEOUT'):
+        options['connect_args'] = {'options': f"-c statement_timeout={int(os.environ['DB_STATEMENT_TIMEOUT'])}"}
+
+    return options
@@ -0,0 +1,136 @@
+"""Compact, compressed JSON responses.
+
+jsonify serializes with orjson (see OrjsonProvider), several times faster than the standard library on restroom result lists. JSON responses (see COMPRESSIBLE) of at least COMPRESS_MIN_SIZE bytes (default 1024) are gzipped for clients that accept it, or Brotli-compressed if the brotli package is installed; smaller bodies aren't worth the CPU or the extra headers. Streamed responses, which include static files and exports, are sent as is; leave those to the proxy in front of the app. Restroom results can also be sent in columns (see to_columns), naming each field once instead of once per restroom.
+
+Compare the encodings with bench/bench_encoding.py.
+"""
+
+import gzip
+import os
+import orjson
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))  # 0-11; higher levels cost too much CPU per response
+
+# Not HTML: pages carry the CSRF token alongside echoed form input, and compressing both together leaks the token (BREACH).
+# Static files and exports (CSS, JavaScript, NDJSON, CSV, GeoJSON) are streamed, so compress() never sees their bodies.
+COMPRESSIBLE = {'application/json'}
+
+# Datetimes are passed to Flask's default, which sends them as HTTP dates like jsonify always has
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(obj):
+    """Serialize obj to compact JSON bytes."""
+
+    return orjson.dumps(obj, default=DefaultJSONProvider.default, option=OPTIONS)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider using orjson. Keys are sent in dict order rather than sorted.
+
+    Calls passing json module options, like the session serializer's object_hook, are left to Flask's default provider.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+##################################################
+# Compression
+
+
+def encode(body, accept_encoding):
+    """Compress body for a client that sent accept_encoding. Returns (body, content_encoding), with content_encoding None if body is sent as is."""
+
+    if len(body) < COMPRESS_MIN_SIZE:
+        return (body, None)
+
+    accepted = parse_accept_header(accept_encoding)
+
+    if brotli and accepted.quality('br'):
+        return (brotli.compress(body, quality=BROTLI_QUALITY), 'br')
+    if accepted.quality('gzip'):
+        return (gzip.compress(body, GZIP_LEVEL, mtime=0), 'gzip')
+
+    return (body, None)
+
+
+def compress(response):
+    """Compress response if it is worth it and the client accepts it."""
+
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    body, content_encoding = encode(response.get_data(), request.headers.get('Accept-Encoding', ''))
+    if content_encoding is None:
+        return response
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = content_encoding
+
+    # A strong ETag promises these exact bytes, so compressed responses only keep a weak one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_app(app):
+    """Serialize app's JSON with orjson and compress its responses."""
+
+    app.json = OrjsonProvider(app)
+    app.after_request(compress)
+
+
+##################################################
+# Result formats
+
+
+def to_columns(rows):
+    """Rows of dicts as {'columns': [keys], 'rows': [[values]]}, naming each key once. Keys missing from a row are None."""
+
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+
+    return {'columns': columns, 'rows': [[row.get(column) for column in columns] for row in rows]}
+
+
+FORMATS = {
+    'rows': list,
+    'columns': to_columns,
+}
+
+
+def result_format(args):
+    """The function shaping results for the format query arg, rows by default. Raises ValueError for unknown formats."""
+
+    name = args.get('format', 'rows')
+    if name not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+    return FORMATS[name]
@@ -0,0 +1,137 @@
+"""Streaming exports of saved searches, as NDJSON, CSV or GeoJSON.
+
+Rows are read through a server-side cursor EXPORT_BATCH_SIZE at a time (default 1000) and each batch is encoded and sent before the next is read, so an export holds one batch in memory however many rows it covers. Users download their account and saved searches from /users/<id>/export; operators export the whole saved_searches table, e.g. for analytics jobs, by running this module:
+
+    $ python export.py [--format ndjson|csv|geojson] [--user-id ID] [--output saved_searches.ndjson]
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+from operator import attrgetter
+import encoding
+from models import db, SavedSearch, SavedSearchRow
+
+BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+
+def batches(*criteria, batch_size=None):
+    """Yield lists of SavedSearchRows matching criteria, in id order, read batch_size at a time from a server-side cursor."""
+
+    batch_size = batch_size or BATCH_SIZE
+    stmt = (db.select(*SavedSearch.read_columns())
+        .where(*criteria)
+        .order_by(SavedSearch.id)
+        .execution_options(stream_results=True, max_row_buffer=batch_size))
+
+    for partition in db.session.execute(stmt).partitions(batch_size):
+        yield [SavedSearchRow(*row) for row in partition]
+
+
+##################################################
+# Formats
+#
+# Each takes an iterable of batches of rows and the exporting user's account details, or None, and yields the export in chunks of bytes, one per batch.
+
+
+def ndjson(batches, account=None):
+    """A JSON object per line: the account as {"user": {...}}, if given, then a saved search per line."""
+
+    if account is not None:
+        yield encoding.dumps({'user': account}) + b'\n'
+
+    for rows in batches:
+        yield b''.join(encoding.dumps(row) + b'\n' for row in rows)
+
+
+def to_csv(batches, account=None):
+    """A header row of field names, then a saved search per row. The account isn't included, since it has other columns."""
+
+    fields = attrgetter(*SavedSearchRow.__slots__)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SavedSearchRow.__slots__)
+
+    for rows in batches:
+        writer.writerows(fields(row) for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Nothing but the header if there were no rows
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def feature(row):
+    """GeoJSON Feature for a saved search, located at its search point if it has one."""
+
+    geometry = None if row.lon is None or row.lat is None else {'type': 'Point', 'coordinates': [row.lon, row.lat]}
+
+    return {'type': 'Feature', 'id': row.id, 'geometry': geometry, 'properties': row}
+
+
+def geojson(batches, account=None):
+    """A FeatureCollection with a Feature per saved search, and the account as its "user" member, if given."""
+
+    head = {'type': 'FeatureCollection'}
+    if account is not None:
+        head['user'] = account
+    yield encoding.dumps(head)[:-1] + b',"features":['
+
+    separator = b''
+    for rows in batches:
+        if rows:
+            yield separator + b','.join(encoding.dumps(feature(row)) for row in rows)
+            separator = b','
+
+    yield b']}'
+
+
+# name: (encoder, mimetype, file extension)
+FORMATS = {
+    'ndjson': (ndjson, 'application/x-ndjson', 'ndjson'),
+    'csv': (to_csv, 'text/csv', 'csv'),
+    'geojson': (geojson, 'application/geo+json', 'geojson'),
+}
+
+
+def export(name, *criteria, account=None, batch_size=None):
+    """Yield chunks of the saved searches matching criteria, in format name. Raises ValueError for unknown formats."""
+
+    if name not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+    encoder = FORMATS[name][0]
+
+    return encoder(batches(*criteria, batch_size=batch_size), account)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--user-id', type=int, help="only this user's saved searches")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--output', help="file to write, standard output by default")
+    args = parser.parse_args()
+
+    criteria = [] if args.user_id is None else [SavedSearch.user_id == args.user_id]
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+
+    try:
+        for chunk in export(args.format, *criteria, batch_size=args.batch_size):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+    # Close the server-side cursor's transaction
+    db.session.rollback()
+
+
+if __name__ == '__main__':
+    from app import create_app
+    create_app(views=False)
+    main()
@@ -0,0 +1,163 @@
+"""Generate production-size synthetic data for profiling queries and indexes.
+
+Streams users user1..userN (password GENERATED_PASSWORD) and saved searches clustered around US metro areas into Postgres with COPY, in chunks of --chunk rows, each committed on its own. Tables are created if missing but never dropped. Re-running with the same arguments resumes after the last committed chunk, producing the same rows an uninterrupted run would have.
+
+    $ python generate.py --users 100000 --searches 1000000 [--chunk 100000] [--seed 0]
+"""
+
+import argparse
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import geo
+import hashing
+from models import db, User, SavedSearch
+from app import create_app
+
+GENERATED_PASSWORD = 'password'
+EMAIL_DOMAIN = 'example.com'
+SEARCH_PREFIX = 'generated search'
+
+# (lat, lon, relative population) of US metro areas saved searches cluster around
+METROS = [
+    (40.71, -74.01, 19.8), (34.05, -118.24, 13.2), (41.88, -87.63, 9.5), (32.78, -96.80, 7.6),
+    (29.76, -95.37, 7.1), (38.91, -77.04, 6.3), (39.95, -75.17, 6.2), (25.76, -80.19, 6.1),
+    (33.75, -84.39, 6.1), (42.36, -71.06, 4.9), (33.45, -112.07, 4.8), (37.77, -122.42, 4.7),
+    (33.95, -117.40, 4.6), (42.33, -83.05, 4.4), (47.61, -122.33, 4.0), (44.98, -93.27, 3.7),
+    (32.72, -117.16, 3.3), (27.95, -82.46, 3.2), (39.74, -104.99, 3.0), (38.63, -90.20, 2.8),
+    (39.29, -76.61, 2.8), (35.23, -80.84, 2.7), (28.54, -81.38, 2.7), (29.42, -98.49, 2.6),
+    (45.52, -122.68, 2.5), (38.58, -121.49, 2.4), (40.44, -79.99, 2.4), (30.27, -97.74, 2.3),
+    (36.17, -115.14, 2.3), (39.10, -94.58, 2.2), (39.96, -83.00, 2.1), (39.77, -86.16, 2.1),
+    (41.50, -81.69, 2.1), (36.16, -86.78, 2.0), (35.78, -78.64, 1.4), (43.04, -87.91, 1.6),
+]
+SPREAD_MI = 8
+
+
+def hash_pool(count):
+    """count bcrypt hashes of GENERATED_PASSWORD, each with its own salt, made in parallel.
+
+    bcrypt releases the GIL, so threads hash on every core. They call bcrypt directly: hashing.hash_password would hand each hash on to hashing's own pool, leaving these threads only waiting. Users are given these in rotation rather than each paying for a hash.
+    """
+
+    def hash_one(_):
+        return hashing.bcrypt.generate_password_hash(GENERATED_PASSWORD, hashing.LOG_ROUNDS).decode('UTF-8')
+
+    with ThreadPoolExecutor(max_workers=hashing.WORKERS) as executor:
+        return list(executor.map(hash_one, range(count)))
+
+
+def clustered_points(rng, n):
+    """n (lats, lons) arrays normally distributed around METROS, in proportion to their populations."""
+
+    centers = np.array([(lat, lon) for lat, lon, _ in METROS])
+    weights = np.array([pop for _, _, pop in METROS])
+
+    metro = rng.choice(len(METROS), size=n, p=weights / weights.sum())
+    lats = centers[metro, 0] + rng.normal(0, SPREAD_MI / geo.MILES_PER_DEGREE, n)
+    lons = centers[metro, 1] + rng.normal(0, SPREAD_MI / geo.MILES_PER_DEGREE, n) / np.cos(np.radians(lats))
+
+    return lats.round(5), lons.round(5)
+
+
+def copy_rows(table, columns, lines):
+    """COPY tab-separated lines into table's columns and commit."""
+
+    buf = io.StringIO('\n'.join(lines) + '\n')
+    conn = db.engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def chunks(total, chunk_size, done):
+    """(start, stop) of each chunk of range(total) after the first done rows, on chunk_size boundaries."""
+
+    start = done
+    while start < total:
+        stop = min((start // chunk_size + 1) * chunk_size, total)
+        yield start, stop
+        start = stop
+
+
+def generated_users():
+    """Filter matching the users generate_users makes, and not real accounts that happen to start with "user"."""
+
+    return db.and_(User.username.op('~')('^user[0-9]+$'), User.email.like(f"%@{EMAIL_DOMAIN}"))
+
+
+def generate_users(total, chunk_size, hashes):
+    """COPY users user1..user{total} that don't exist yet."""
+
+    done = db.session.query(User).filter(generated_users()).count()
+    db.session.commit()
+
+    for start, stop in chunks(total, chunk_size, done):
+        copy_rows('users', ('username', 'email', 'password'), (
+            f"user{i}\tuser{i}@{EMAIL_DOMAIN}\t{hashes[i % len(hashes)]}"
+            for i in range(start + 1, stop + 1)
+        ))
+        yield stop
+
+
+def generate_searches(total, chunk_size, seed):
+    """COPY total saved searches spread at random across the generated users.
+
+    Each chunk's rows depend only on seed and the chunk's position, so a resumed run picks up exactly where it stopped.
+    """
+
+    user_ids = np.array([id for id, in db.session.query(User.id).filter(generated_users()).order_by(User.id)])
+    done = db.session.query(SavedSearch).filter(SavedSearch.name.like(f"{SEARCH_PREFIX}%")).count()
+    db.session.commit()
+
+    if not len(user_ids):
+        raise SystemExit("no generated users to own saved searches; pass --users")
+
+    for start, stop in chunks(total, chunk_size, done):
+        n = stop - start
+        rng = np.random.default_rng([seed, start])
+        lats, lons = clustered_points(rng, n)
+        owners = user_ids[rng.integers(0, len(user_ids), n)]
+        flags = np.where(rng.random((n, 3)) < (0.3, 0.3, 0.2), 't', 'f')
+
+        # Plain Python values format several times faster than NumPy scalars
+        copy_rows('saved_searches', ('user_id', 'name', 'query_string', 'lon', 'lat', 'accessible', 'unisex', 'changing_table'), (
+            f"{owner}\t{SEARCH_PREFIX} {i}\t\t{lon}\t{lat}\t{a}\t{u}\t{c}"
+            for i, owner, lon, lat, (a, u, c) in zip(range(start, stop), owners.tolist(), lons.tolist(), lats.tolist(), flags.tolist())
+        ))
+        yield stop
+
+
+def report(label, rows, started):
+    print(f"{rows} {label} ({time.perf_counter() - started:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=0)
+    parser.add_argument('--searches', type=int, default=0)
+    parser.add_argument('--chunk', type=int, default=100000, help="rows per COPY and commit")
+    parser.add_argument('--hashes', type=int, default=16, help="distinct password hashes to rotate through")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db.create_all()
+
+    if args.users:
+        started = time.perf_counter()
+        hashes = hash_pool(min(args.hashes, args.users))
+        for rows in generate_users(args.users, args.chunk, hashes):
+            report("users", rows, started)
+
+    if args.searches:
+        started = time.perf_counter()
+        for rows in generate_searches(args.searches, args.chunk, args.seed):
+            report("saved searches", rows, started)
+
+
+if __name__ == '__main__':
+    create_app(views=False)
+    main()
@@ -0,0 +1,76 @@
+"""Great-circle distance and nearest-neighbour ranking.
+
+The array functions work on whole candidate sets at once, so ranking 100k+ restrooms against one or many search points is a handful of NumPy operations rather than a Python loop.
+"""
+
+import math
+import numpy as np
+
+EARTH_RADIUS_MI = 3958.8
+MILES_PER_DEGREE = math.radians(1) * EARTH_RADIUS_MI
+
+
+def haversine_mi(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles between two points given in degrees."""
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_MI * math.asin(math.sqrt(a))
+
+
+def haversine(lat, lon, lats, lons):
+    """Great-circle distances in miles from query point(s) to candidate points, all in degrees.
+
+    With a scalar lat/lon, returns an array shaped like lats. With 1-d arrays of q query points, returns a (q, n) array with one row per query point.
+    """
+
+    lat = np.radians(np.asarray(lat, dtype=float))[..., np.newaxis]
+    lon = np.radians(np.asarray(lon, dtype=float))[..., np.newaxis]
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_MI * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def top_k(distances, k, mask=None):
+    """Indices of the k smallest distances, closest first, considering only candidates where mask is True.
+
+    distances may be 1-d, or 2-d with one row per query point, in which case a row of indices is returned per query point. Fewer than k indices are returned if fewer candidates match.
+    """
+
+    distances = np.asarray(distances)
+
+    if mask is not None:
+        candidates = np.flatnonzero(mask)
+        distances = distances[..., candidates]
+
+    k = min(k, distances.shape[-1])
+    if k == 0:
+        idx = np.empty(distances.shape[:-1] + (0,), dtype=np.intp)
+    else:
+        idx = np.argpartition(distances, k - 1, axis=-1)[..., :k]
+        order = np.argsort(np.take_along_axis(distances, idx, axis=-1), axis=-1)
+        idx = np.take_along_axis(idx, order, axis=-1)
+
+    return candidates[idx] if mask is not None else idx
+
+
+def nearest(lat, lon, lats, lons, k, mask=None):
+    """Rank candidates by distance from query point(s). Returns (indices, distances in miles) of the k closest, closest first.
+
+    Candidates excluded by mask are dropped before any distances are computed.
+    """
+
+    if mask is not None:
+        candidates = np.flatnonzero(mask)
+        lats = np.asarray(lats)[candidates]
+        lons = np.asarray(lons)[candidates]
+
+    distances = haversine(lat, lon, lats, lons)
+    idx = top_k(distances, k)
+    distances = np.take_along_axis(distances, idx, axis=-1)
+
+    return (candidates[idx] if mask is not None else idx), distances
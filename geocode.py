@@ -0,0 +1,92 @@
+"""Mapbox reverse geocoding, cached on rounded coordinates.
+
+Coordinates are rounded to GEOCODE_PRECISION decimal places (3 is about 100 m) before lookup, so repeat visits from roughly the same spot share one Mapbox call. Calls beyond MAPBOX_RATE_LIMIT per second per process are skipped rather than queued.
+"""
+
+import os
+import upstream
+from cache import make_cache
+
+MAPBOX_URL = os.environ.get('MAPBOX_URL', 'https://api.mapbox.com')
+PRECISION = int(os.environ.get('GEOCODE_PRECISION', 3))
+
+geocode_cache = make_cache(
+    'geocode',
+    maxsize=int(os.environ.get('GEOCODE_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('GEOCODE_CACHE_TTL', 86400)),
+)
+rate_limiter = upstream.RateLimiter(float(os.environ.get('MAPBOX_RATE_LIMIT', 10)))
+
+
+class RateLimited(Exception):
+    """Raised when a lookup is skipped to stay under the Mapbox rate limit."""
+
+
+def parse_coordinates(data):
+    """(lon, lat) from a reverse geocode request's JSON body. Raises ValueError if either is missing, not a number, or off the map."""
+
+    try:
+        lon, lat = float(data['lon']), float(data['lat'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("lon and lat are required") from e
+
+    # NaN fails the comparison too
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("lat must be between -90 and 90 and lon between -180 and 180")
+
+    return (lon, lat)
+
+
+def cache_key(lon, lat):
+    return (round(lon, PRECISION), round(lat, PRECISION))
+
+
+def place_name(data):
+    """Top place name in a Mapbox geocoding response, or None if there are no results."""
+
+    features = data.get('features') or []
+    if not features:
+        return None
+
+    return features[0].get('place_name')
+
+
+def fetch_place_name(lon, lat):
+    """Ask Mapbox for the place name at lon/lat."""
+
+    if not rate_limiter.acquire():
+        raise RateLimited()
+
+    resp = upstream.get('mapbox', f"{MAPBOX_URL}/geocoding/v5/mapbox.places/{lon},{lat}.json", params={'access_token': os.environ['MAPBOX_TOKEN']})
+    resp.raise_for_status()
+
+    return place_name(resp.json())
+
+
+async def fetch_place_name_async(lon, lat):
+    """Ask Mapbox for the place name at lon/lat, without blocking the event loop."""
+
+    if not rate_limiter.acquire():
+        raise RateLimited()
+
+    resp = await upstream.get_async('mapbox', f"{MAPBOX_URL}/geocoding/v5/mapbox.places/{lon},{lat}.json", params={'access_token': os.environ['MAPBOX_TOKEN']})
+    resp.raise_for_status()
+
+    return place_name(resp.json())
+
+
+def reverse_geocode(lon, lat):
+    """Return the place name at lon/lat, or None if Mapbox has none.
+
+    Raises RateLimited, or requests.RequestException if Mapbox can't be reached; neither outcome is cached.
+    """
+
+    lon, lat = cache_key(lon, lat)
+    return geocode_cache.get_or_load((lon, lat), lambda: fetch_place_name(lon, lat))
+
+
+async def reverse_geocode_async(lon, lat):
+    """Async reverse_geocode, sharing its cache. Raises httpx.HTTPError rather than requests.RequestException."""
+
+    lon, lat = cache_key(lon, lat)
+    return await geocode_cache.get_or_load_async((lon, lat), lambda: fetch_place_name_async(lon, lat))
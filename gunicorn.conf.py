@@ -0,0 +1,73 @@
+"""Production gunicorn settings, loaded automatically from the working directory.
+
+GUNICORN_WORKER_CLASS   sync, gthread (default) or gevent. gthread and gevent keep serving while requests wait on Mapbox and
+                        Refuge Restrooms; gevent needs `pip install gevent psycogreen`. The Procfile's ASYNC_UPSTREAM=1
+                        mode picks uvicorn on the command line, which overrides this.
+WEB_CONCURRENCY         worker processes (default 2 * cores + 1 for sync, cores + 1 otherwise)
+GUNICORN_THREADS        threads per gthread worker (default 4)
+GUNICORN_CONNECTIONS    concurrent requests per gevent worker (default 100)
+GUNICORN_KEEPALIVE      seconds gthread and gevent workers keep idle client connections open (default 75)
+GUNICORN_PRELOAD        load the app once in the master before forking, so workers start fast and share its memory
+                        (default on)
+
+Each worker holds its own database pool; keep workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) under the database's connection
+limit (see config.engine_options). Compare worker classes with bench/bench_workers.py.
+"""
+
+import gc
+import os
+from config import env_bool  # not `import config`: gunicorn would read it as its own config setting
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class not in ('sync', 'gthread', 'gevent'):
+    raise ValueError(f"GUNICORN_WORKER_CLASS must be sync, gthread or gevent, not {worker_class!r}")
+
+if worker_class == 'gevent':
+    # Patch before the app imports socket, ssl and psycopg2, so upstream calls and queries yield to other requests
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+def cores():
+    """CPUs this process may run on."""
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * cores() + 1 if worker_class == 'sync' else cores() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 100))
+# Outlast the idle timeout of the router or load balancer in front, so it never reuses a connection just as we close it
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 75))
+preload_app = env_bool('GUNICORN_PRELOAD', True)
+
+# Threads don't survive a fork, so with preload_app each worker starts its own in-process job worker instead of the master
+jobs_in_process = env_bool('JOBS_IN_PROCESS')
+if preload_app:
+    os.environ['JOBS_IN_PROCESS'] = '0'
+    # Keep the master's garbage collector from leaving freed holes in pages the workers share
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach, so collections in workers don't write to shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+    if preload_app:
+        from models import db
+
+        # Drop any connections inherited from the master without closing them, which would close them for the master too
+        db.engine.dispose(close=False)
+
+        if jobs_in_process:
+            import jobs
+            jobs.start_worker(db.get_app())
@@ -0,0 +1,61 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt releases the GIL while it hashes, so hashes run on a pool of BCRYPT_WORKERS threads (default: one per core) proceed in parallel instead of each pinning the request thread that asked for it. At most BCRYPT_QUEUE_LIMIT hashes may be running or waiting at once; past that HashingBusy is raised straight away so a login burst is turned away quickly rather than queueing until requests time out.
+
+The cost is set by BCRYPT_LOG_ROUNDS. Hashes made at a different cost are upgraded the next time their user logs in (see User.authenticate).
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask_bcrypt import Bcrypt
+
+LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 1))
+QUEUE_LIMIT = int(os.environ.get('BCRYPT_QUEUE_LIMIT', WORKERS * 4))
+
+bcrypt = Bcrypt()
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='bcrypt')
+_slots = threading.BoundedSemaphore(QUEUE_LIMIT)
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+def _run(fn, *args):
+    """Run fn(*args) on the pool and wait for its result, or raise HashingBusy if the queue is full."""
+
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+
+    future.add_done_callback(lambda f: _slots.release())
+    return future.result()
+
+
+def hash_password(password):
+    """Hash password at the configured cost. Raises ValueError if password is empty."""
+
+    return _run(bcrypt.generate_password_hash, password, LOG_ROUNDS).decode('UTF-8')
+
+
+def check_password(pw_hash, password):
+    """Does password match pw_hash?"""
+
+    return _run(bcrypt.check_password_hash, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """Was pw_hash made at a different cost than the configured one?"""
+
+    try:
+        return int(pw_hash.split('$')[2]) != LOG_ROUNDS
+    except (IndexError, ValueError):
+        return True
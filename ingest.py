@@ -0,0 +1,65 @@
+"""Mirror the Refuge Restrooms dataset into the restrooms table.
+
+Pages through the full listing and upserts each page, so it can be re-run to pick up new and updated restrooms. Serve searches from the mirror by setting RESTROOM_SOURCE=local.
+
+    $ python ingest.py [--per-page 100] [--max-pages N]
+"""
+
+import argparse
+import upstream
+from sqlalchemy.dialects.postgresql import insert
+from models import db, Restroom
+from app import create_app
+from restrooms import REFUGE_URL
+
+
+def fetch_pages(per_page, max_pages=None):
+    """Yield pages of listings from Refuge Restrooms until an empty page is returned."""
+
+    page = 1
+
+    while max_pages is None or page <= max_pages:
+        resp = upstream.get('refuge', f"{REFUGE_URL}/v1/restrooms", params={'page': page, 'per_page': per_page})
+        resp.raise_for_status()
+
+        listings = resp.json()
+        if not listings:
+            return
+
+        yield listings
+        page += 1
+
+
+def upsert(listings):
+    """Insert listings, updating any already mirrored."""
+
+    rows = [Restroom.row_from_api(listing) for listing in listings]
+
+    stmt = insert(Restroom.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Restroom.id],
+        set_={col: stmt.excluded[col] for col in rows[0] if col != 'id'},
+    )
+
+    db.session.execute(stmt)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--max-pages', type=int, default=None)
+    args = parser.parse_args()
+
+    db.create_all()
+
+    total = 0
+    for listings in fetch_pages(args.per_page, args.max_pages):
+        upsert(listings)
+        total += len(listings)
+        print(f"{total} restrooms mirrored")
+
+
+if __name__ == '__main__':
+    create_app(views=False)
+    main()
@@ -0,0 +1,233 @@
+"""Background jobs, queued in the jobs table.
+
+Workers (worker.py, or a thread in each web process with JOBS_IN_PROCESS=1) claim due jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any number of them, in any number of processes, share the queue without an external broker. A claimed job is leased for JOB_LEASE seconds (default 300) and deleted only once it succeeds. If its worker dies, the lease runs out and another worker runs it again, so every job runs at least once and handlers must be safe to repeat. Failed jobs are retried with exponential backoff; after JOB_MAX_ATTEMPTS (default 5) they are kept with run_at cleared for inspection.
+
+Periodic jobs queue their own next run when they finish. The restroom tile and geocode caches are per process unless CACHE_URL names a shared store (see cache.py), so with the default the jobs warming them only help the process they run in; run them in-process with JOBS_IN_PROCESS=1.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
+import geocode
+import metrics
+import restrooms
+import snapshots
+from models import db, Job, SavedSearch
+
+LEASE = int(os.environ.get('JOB_LEASE', 300))
+MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+RETRY_DELAY = 30  # seconds before the first retry, doubling after each failure
+MAX_RETRY_DELAY = 3600
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+PREWARM_LIMIT = int(os.environ.get('JOB_PREWARM_LIMIT', 200))
+
+HANDLERS = {}
+PERIODIC = {}  # kind: seconds between runs
+
+
+def handler(kind, every=None):
+    """Register the decorated function to run jobs of kind, called with the job's payload as keyword arguments. Pass every=seconds to run it periodically."""
+
+    def register(fn):
+        HANDLERS[kind] = fn
+        if every:
+            PERIODIC[kind] = every
+        return fn
+
+    return register
+
+
+##################################################
+# Queue
+
+
+def enqueue(kind, payload=None, run_at=None, key=None):
+    """Queue a job. Returns its id, or None if a job with the same key is already queued. Commit the session to publish it."""
+
+    stmt = (insert(Job.__table__)
+        .values(kind=kind, payload=payload or {}, key=key, run_at=run_at or datetime.utcnow(), created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=['key'])
+        .returning(Job.__table__.c.id))
+
+    return db.session.execute(stmt).scalar()
+
+
+def schedule_periodic():
+    """Queue each periodic job that isn't already queued, to run now."""
+
+    for kind in PERIODIC:
+        enqueue(kind, key=kind)
+    db.session.commit()
+
+
+def claim(limit=1):
+    """Lease up to limit due jobs, oldest first, skipping any another worker holds. Returns their rows."""
+
+    now = datetime.utcnow()
+    table = Job.__table__
+
+    due = (db.select(table.c.id)
+        .where(table.c.run_at <= now)
+        .where(db.or_(table.c.locked_until.is_(None), table.c.locked_until <= now))
+        .order_by(table.c.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True))
+
+    stmt = (table.update()
+        .where(table.c.id.in_(due.scalar_subquery()))
+        .values(locked_until=now + timedelta(seconds=LEASE), attempts=table.c.attempts + 1)
+        .returning(table.c.id, table.c.kind, table.c.payload, table.c.key, table.c.run_at, table.c.attempts))
+
+    jobs = db.session.execute(stmt).all()
+    db.session.commit()
+
+    return jobs
+
+
+def run(job):
+    """Run a claimed job. On success it is deleted, and a periodic job queues its next run; on failure it is retried later. Returns True if it succeeded."""
+
+    table = Job.__table__
+    metrics.job_wait.observe(max((datetime.utcnow() - job.run_at).total_seconds(), 0), job.kind)
+    start = time.perf_counter()
+
+    try:
+        HANDLERS[job.kind](**job.payload)
+    except Exception as e:
+        db.session.rollback()
+        print(f"job {job.id} ({job.kind}) failed: {e!r}")
+
+        # Periodic jobs keep retrying, so they are never lost
+        if job.attempts >= MAX_ATTEMPTS and job.kind not in PERIODIC:
+            run_at = None
+        else:
+            run_at = datetime.utcnow() + timedelta(seconds=min(RETRY_DELAY * 2 ** (job.attempts - 1), MAX_RETRY_DELAY))
+
+        db.session.execute(table.update()
+            .where(table.c.id == job.id)
+            .values(run_at=run_at, locked_until=None, last_error=repr(e)))
+        db.session.commit()
+
+        metrics.job_duration.observe(time.perf_counter() - start, job.kind, 'error')
+        return False
+
+    db.session.execute(table.delete().where(table.c.id == job.id))
+    if job.kind in PERIODIC:
+        enqueue(job.kind, job.payload, run_at=datetime.utcnow() + timedelta(seconds=PERIODIC[job.kind]), key=job.key)
+    db.session.commit()
+
+    metrics.job_duration.observe(time.perf_counter() - start, job.kind, 'ok')
+    return True
+
+
+def work(stop=None, batch=1):
+    """Claim and run jobs until stop (a threading.Event) is set, polling every POLL_INTERVAL seconds while the queue is empty.
+
+    Database errors, like a dropped connection, are logged and retried after POLL_INTERVAL rather than stopping the worker. A job interrupted by one is run again once its lease runs out.
+    """
+
+    stop = stop or threading.Event()
+    scheduled = False
+
+    while not stop.is_set():
+        try:
+            if not scheduled:
+                schedule_periodic()
+                scheduled = True
+
+            jobs = claim(batch)
+            if not jobs:
+                stop.wait(POLL_INTERVAL)
+            for job in jobs:
+                run(job)
+        except Exception as e:
+            print(f"jobs worker: {e!r}")
+            db.session.rollback()
+            stop.wait(POLL_INTERVAL)
+
+
+def start_worker(app):
+    """Run a worker on a daemon thread in this process. Returns the threading.Event that stops it."""
+
+    stop = threading.Event()
+
+    def target():
+        with app.app_context():
+            work(stop)
+
+    threading.Thread(target=target, name='jobs', daemon=True).start()
+    return stop
+
+
+##################################################
+# Jobs
+
+
+def saved_search_tiles(limit):
+    """The limit restroom tile cache keys, (tile, ada, unisex), covering the most saved searches."""
+
+    row = db.func.floor(SavedSearch.lat / restrooms.TILE_SIZE)
+    col = db.func.floor(SavedSearch.lon / restrooms.TILE_SIZE)
+
+    rows = (db.session.query(row, col, SavedSearch.accessible, SavedSearch.unisex)
+        .filter(SavedSearch.lat.isnot(None), SavedSearch.lon.isnot(None))
+        .group_by(row, col, SavedSearch.accessible, SavedSearch.unisex)
+        .order_by(db.func.count().desc())
+        .limit(limit)
+        .all())
+
+    return [((int(r), int(c)), accessible, unisex) for r, c, accessible, unisex in rows]
+
+
+@handler('refresh_tiles', every=int(os.environ.get('JOB_REFRESH_TILES_EVERY', 600)))
+def refresh_tiles(limit=PREWARM_LIMIT):
+    """Re-fetch the restroom tiles covering the most saved searches into the tile cache, before they expire."""
+
+    if restrooms.SOURCE == 'local':
+        return
+
+    keys = saved_search_tiles(limit)
+    db.session.commit()
+
+    for key in keys:
+        restrooms.tile_cache.set(key, restrooms.fetch_tile(*key))
+
+
+@handler('prewarm_geocode', every=int(os.environ.get('JOB_PREWARM_GEOCODE_EVERY', 3600)))
+def prewarm_geocode(limit=PREWARM_LIMIT):
+    """Look up place names for the most saved search locations not yet in the geocode cache, stopping at the Mapbox rate limit."""
+
+    lon = db.func.round(db.cast(SavedSearch.lon, db.Numeric), geocode.PRECISION)
+    lat = db.func.round(db.cast(SavedSearch.lat, db.Numeric), geocode.PRECISION)
+
+    points = (db.session.query(lon, lat)
+        .filter(SavedSearch.lat.isnot(None), SavedSearch.lon.isnot(None))
+        .group_by(lon, lat)
+        .order_by(db.func.count().desc())
+        .limit(limit)
+        .all())
+    db.session.commit()
+
+    for lon, lat in points:
+        try:
+            geocode.reverse_geocode(float(lon), float(lat))
+        except geocode.RateLimited:
+            # Leave the rest of the rate limit to users; the next run carries on
+            return
+
+
+@handler('expire_caches', every=int(os.environ.get('JOB_EXPIRE_CACHES_EVERY', 60)))
+def expire_caches():
+    """Drop expired entries from the caches, freeing their memory or disk space."""
+
+    restrooms.tile_cache.expire()
+    geocode.geocode_cache.expire()
+
+
+@handler('refresh_snapshots', every=int(os.environ.get('JOB_REFRESH_SNAPSHOTS_EVERY', 600)))
+def refresh_snapshots(limit=PREWARM_LIMIT):
+    """Refresh saved searches' stale result snapshots, see snapshots.py."""
+
+    snapshots.refresh_stale(limit)
@@ -0,0 +1,303 @@
+"""Process-wide performance metrics, served in Prometheus text format on /metrics.
+
+Records per-route request latency, SQL statements and database time per request, upstream API call latency, database pool usage, and background job latency. Every gunicorn worker keeps its own counters, so scrape each worker or compare them as a sample of the whole.
+"""
+
+import functools
+import threading
+import time
+from datetime import datetime
+from flask import g, has_app_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+from models import db, Job
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class Histogram:
+    """Prometheus histogram, with one set of buckets per combination of label values"""
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = ','.join(f'{label}="{value}"' for label, value in zip(self.labels, label_values))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{labels}}} {total}')
+                lines.append(f'{self.name}_count{{{labels}}} {count}')
+
+
+request_latency = Histogram('http_request_duration_seconds', "Time to handle a request.", ('route', 'method'))
+request_queries = Histogram('http_request_db_queries', "SQL statements run per request.", ('route', 'method'), COUNT_BUCKETS)
+request_db_time = Histogram('http_request_db_seconds', "Time spent in SQL statements per request.", ('route', 'method'))
+upstream_latency = Histogram('upstream_request_duration_seconds', "Time for a call to an upstream API.", ('service',))
+job_wait = Histogram('job_wait_seconds', "Time from a job falling due to a worker starting it.", ('kind',), JOB_BUCKETS)
+job_duration = Histogram('job_duration_seconds', "Time to run a job.", ('kind', 'outcome'), JOB_BUCKETS)
+
+HISTOGRAMS = (request_latency, request_queries, request_db_time, upstream_latency, job_wait, job_duration)
+# Functions appending further metrics to the lines render() returns
+COLLECTORS = []
+
+
+##################################################
+# Request and query instrumentation
+
+def init_app(app, engine):
+    """Time every request handled by app and every SQL statement run on engine."""
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+
+
+def finish_request(response):
+    if 'metrics_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(time.perf_counter() - g.metrics_start, route, request.method)
+        request_queries.observe(g.db_queries, route, request.method)
+        request_db_time.observe(g.db_seconds, route, request.method)
+
+    return response
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+    if has_app_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+def observe_upstream(service, elapsed):
+    upstream_latency.observe(elapsed, service)
+
+
+##################################################
+# Query budgets
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block runs more SQL, or slower SQL, than its budget allows."""
+
+
+class query_budget:
+    """Context manager and decorator failing when a block runs more than max_queries SQL statements, spends more than max_seconds in them in total, or runs any single statement slower than max_statement_seconds.
+
+        with query_budget(db.engine, max_queries=2):
+            client.get('/users/1')
+
+    Catches N+1 query regressions in tests; the statements run are listed in the error.
+    """
+
+    def __init__(self, engine, max_queries=None, max_seconds=None, max_statement_seconds=None):
+        self.engine = engine
+        self.max_queries = max_queries
+        self.max_seconds = max_seconds
+        self.max_statement_seconds = max_statement_seconds
+        self.statements = []
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+        if exc_type is None:
+            self.check()
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with query_budget(self.engine, self.max_queries, self.max_seconds, self.max_statement_seconds):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    @property
+    def seconds(self):
+        return sum(elapsed for _, elapsed in self.statements)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('budget_start', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, time.perf_counter() - conn.info['budget_start'].pop()))
+
+    def check(self):
+        """Raise QueryBudgetExceeded if the statements run so far are over budget."""
+
+        problems = []
+        if self.max_queries is not None and len(self.statements) > self.max_queries:
+            problems.append(f"{len(self.statements)} SQL statements, budget is {self.max_queries}")
+        if self.max_seconds is not None and self.seconds > self.max_seconds:
+            problems.append(f"{self.seconds:.3f}s in SQL, budget is {self.max_seconds}s")
+        if self.max_statement_seconds is not None:
+            slow = [elapsed for _, elapsed in self.statements if elapsed > self.max_statement_seconds]
+            if slow:
+                problems.append(f"{len(slow)} statements slower than {self.max_statement_seconds}s")
+
+        if problems:
+            listing = '\n'.join(f"  {elapsed * 1000:.1f}ms  {' '.join(statement.split())}" for statement, elapsed in self.statements)
+            raise QueryBudgetExceeded('; '.join(problems) + '\n' + listing)
+
+
+##################################################
+# Database pool
+
+
+class PoolStats:
+    """Counters for connection checkouts from the database pool"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, wait, overflowed):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            if overflowed:
+                self.overflow_checkouts += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited, whether it needed an overflow connection, and timeouts"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_timeout()
+            raise
+
+        pool_stats.record_checkout(time.perf_counter() - start, self.overflow() > 0)
+        return conn
+
+
+##################################################
+# Exposition
+
+def metric(lines, name, kind, help, value):
+    """Append one Prometheus metric, with its HELP and TYPE lines."""
+
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.append(f"{name} {value}")
+
+
+def labeled_metric(lines, name, kind, help, label, samples):
+    """Append one Prometheus metric with a sample per label value, from {label value: sample}."""
+
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+    for value, sample in sorted(samples.items()):
+        lines.append(f'{name}{{{label}="{value}"}} {sample}')
+
+
+def queue_metrics(lines):
+    """Queue depth by kind and the age of the oldest due job (see jobs.py), for /metrics.
+
+    Collected in every process serving /metrics, whether or not it runs jobs itself.
+    """
+
+    now = datetime.utcnow()
+    table = Job.__table__
+
+    ready = dict(db.session.execute(db.select(table.c.kind, db.func.count())
+        .where(table.c.run_at <= now)
+        .group_by(table.c.kind)).all())
+    dead = dict(db.session.execute(db.select(table.c.kind, db.func.count())
+        .where(table.c.run_at.is_(None))
+        .group_by(table.c.kind)).all())
+    oldest = db.session.execute(db.select(db.func.min(table.c.run_at))
+        .where(table.c.run_at <= now, db.or_(table.c.locked_until.is_(None), table.c.locked_until <= now))).scalar()
+    db.session.commit()
+
+    labeled_metric(lines, 'jobs_ready', 'gauge', "Jobs due to run, including those running.", 'kind', ready)
+    labeled_metric(lines, 'jobs_failed', 'gauge', "Jobs given up on after too many failures.", 'kind', dead)
+    metric(lines, 'jobs_oldest_waiting_seconds', 'gauge', "How long the longest-waiting unclaimed due job has waited.",
+        (now - oldest).total_seconds() if oldest else 0)
+
+
+COLLECTORS.append(queue_metrics)
+
+
+def render(engine):
+    """All metrics in Prometheus text exposition format"""
+
+    lines = []
+    pool = engine.pool
+
+    if isinstance(pool, QueuePool):
+        metric(lines, 'db_pool_size', 'gauge', "Connections the pool keeps open.", pool.size())
+        metric(lines, 'db_pool_checked_out', 'gauge', "Connections currently checked out of the pool.", pool.checkedout())
+        metric(lines, 'db_pool_overflow', 'gauge', "Connections currently open beyond the pool size.", max(pool.overflow(), 0))
+
+    metric(lines, 'db_pool_checkouts_total', 'counter', "Connections checked out of the pool.", pool_stats.checkouts)
+    metric(lines, 'db_pool_wait_seconds_total', 'counter', "Time spent waiting for a pooled connection.", pool_stats.wait_seconds)
+    metric(lines, 'db_pool_wait_seconds_max', 'gauge', "Longest wait for a pooled connection.", pool_stats.max_wait_seconds)
+    metric(lines, 'db_pool_overflow_checkouts_total', 'counter', "Checkouts served by an overflow connection.", pool_stats.overflow_checkouts)
+    metric(lines, 'db_pool_timeouts_total', 'counter', "Checkouts that gave up waiting for a connection.", pool_stats.timeouts)
+
+    for histogram in HISTOGRAMS:
+        histogram.render(lines)
+
+    for collector in COLLECTORS:
+        collector(lines)
+
+    return '\n'.join(lines) + '\n'
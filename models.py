@@ -1,9 +1,13 @@
 """SQLAlchemy models"""
 
-from flask_bcrypt import Bcrypt
+import math
+from dataclasses import dataclass, replace
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import load_only
+
+# geo (numpy) and hashing (bcrypt) are imported where they're used, so scripts that only read and write rows don't load them
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
@@ -36,7 +40,9 @@ class User(db.Model):
     def signup(cls, username, email, password):
         """Register user with hashed password. Returns user."""
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        import hashing
+
+        hashed_pwd = hashing.hash_password(password)
 
         user = User(
             username=username,
@@ -54,28 +60,59 @@ class User(db.Model):
         This is a class method (call it on the class, not an individual user.) It searches for a user whose password hash matches this password and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the user's hash was made at a different bcrypt cost than the configured one, it is replaced with a new hash; commit the session to save it. Raises hashing.HashingBusy if too many hashes are queued.
         """
 
-        user = cls.query.filter_by(username=identifier).first()
+        import hashing
+
+        # One indexed lookup on either column, loading only what login needs
+        users = (cls.query
+            .options(load_only(cls.id, cls.username, cls.password))
+            .filter(db.or_(cls.username == identifier, cls.email == identifier))
+            .limit(2)
+            .all())
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
-        
-        else:
-            user = cls.query.filter_by(email=identifier).first()
-            if user:
-                is_auth = bcrypt.check_password_hash(user.password, password)
-                if is_auth:
-                    return user
+        # A username match takes precedence over another user's email
+        users.sort(key=lambda user: user.username != identifier)
+
+        if users and users[0].check_password(password):
+            user = users[0]
+            if hashing.needs_rehash(user.password):
+                user.password = hashing.hash_password(password)
+            return user
 
         return False
 
+    def check_password(self, password):
+        """Does password match this user's hashed password?"""
+
+        import hashing
+
+        return hashing.check_password(self.password, password)
+
+GRID_SIZE = 0.05  # degrees, roughly 3.5 mi north-south
+GRID_COLS = 10000
+
+
+def grid_cell(lat, lon):
+    """Return id of the GRID_SIZE degree grid cell containing the point."""
+
+    return math.floor(lat / GRID_SIZE) * GRID_COLS + math.floor(lon / GRID_SIZE)
+
+
 class SavedSearch(db.Model):
     "Model for saved search"
 
     __tablename__ = "saved_searches"
+    __table_args__ = (
+        db.Index('ix_saved_searches_user_id_id', 'user_id', 'id'),
+        db.Index('ix_saved_searches_grid_cell', 'grid_cell'),
+    )
+
+    PAGE_SIZE = 25
+    EDITABLE_FIELDS = ('name', 'query_string', 'lon', 'lat', 'accessible', 'unisex', 'changing_table')
+    SERIALIZED_FIELDS = ('id', 'user_id') + EDITABLE_FIELDS
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
@@ -86,23 +123,344 @@ class SavedSearch(db.Model):
     accessible = db.Column(db.Boolean, nullable=False, default=False)
     unisex = db.Column(db.Boolean, nullable=False, default=False)
     changing_table = db.Column(db.Boolean, nullable=False, default=False)
+    # Same cells as grid_cell(), kept up to date by Postgres
+    grid_cell = db.Column(db.Integer, db.Computed(
+        f"floor(lat / {GRID_SIZE})::integer * {GRID_COLS} + floor(lon / {GRID_SIZE})::integer"))
+    # Set on every change, including snapshot refreshes; HTTP validators are built from it
+    updated_at = db.Column(db.DateTime, nullable=False,
+        server_default=db.text("(now() at time zone 'utc')"), onupdate=datetime.utcnow)
+    # Last restroom results for this search, see snapshots.py. Only loaded when asked for.
+    snapshot = db.deferred(db.Column(db.JSON, nullable=True))
+    snapshot_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         """Show info about saved search"""
 
-        return f"<SavedSearch - id: {self.id}, user_id: {self.user.id}, name: {self.name}>"
+        return f"<SavedSearch - id: {self.id}, user_id: {self.user_id}, name: {self.name}>"
+
+    @classmethod
+    def page_for_user(cls, user_id, after_id=None, limit=PAGE_SIZE):
+        """Return a page of (id, name, updated_at) rows of user's saved searches, in id order, starting after after_id.
+
+        Returns (rows, next_after), where next_after is the after_id for the following page, or None if this is the last page.
+        """
+
+        query = db.session.query(cls.id, cls.name, cls.updated_at).filter(cls.user_id == user_id)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+
+        # Fetch one extra row to find out whether there is another page
+        rows = query.order_by(cls.id).limit(limit + 1).all()
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1].id
+
+        return rows, None
+
+    @classmethod
+    def near(cls, lon, lat, radius, limit=None):
+        """Find saved searches within radius miles of the point, closest first. Returns list of (saved search, distance in miles).
+
+        The bounding box around the circle is looked up on the grid_cell index, one range of cells per grid row, and only the rows in it have their exact distance computed. The box doesn't wrap across the antimeridian.
+        """
+
+        import geo
+
+        dlat = radius / geo.MILES_PER_DEGREE
+        # Degrees of longitude shrink towards the poles; size the box for its widest-apart edge
+        dlon = min(180, dlat / max(math.cos(math.radians(min(90, abs(lat) + dlat))), 1e-9))
+
+        row0, row1 = math.floor((lat - dlat) / GRID_SIZE), math.floor((lat + dlat) / GRID_SIZE)
+        col0, col1 = math.floor((lon - dlon) / GRID_SIZE), math.floor((lon + dlon) / GRID_SIZE)
+
+        candidates = (cls.query
+            .filter(db.or_(*(
+                cls.grid_cell.between(row * GRID_COLS + col0, row * GRID_COLS + col1)
+                for row in range(row0, row1 + 1))))
+            .filter(cls.lat.between(lat - dlat, lat + dlat), cls.lon.between(lon - dlon, lon + dlon))
+            .all())
+
+        distances = geo.haversine(lat, lon, [s.lat for s in candidates], [s.lon for s in candidates])
+        idx = geo.top_k(distances, limit or len(candidates), mask=distances <= radius)
+
+        return [(candidates[i], float(distances[i])) for i in idx]
+
+    @classmethod
+    def clean(cls, data, partial=False):
+        """Validate saved search fields from json. Returns dict of column values.
+
+        Raises ValueError describing the first invalid field. Unless partial, name is required.
+        """
+
+        if not isinstance(data, dict):
+            raise ValueError("saved search must be an object")
+        if not partial and 'name' not in data:
+            raise ValueError("name is required")
+
+        values = {}
+        for field in cls.EDITABLE_FIELDS:
+            if field not in data:
+                continue
+            value = data[field]
+
+            if field == 'name':
+                valid = isinstance(value, str) and 0 < len(value) <= 100
+            elif field == 'query_string':
+                valid = value is None or isinstance(value, str)
+            elif field in ('lon', 'lat'):
+                # Out of range values would also overflow grid_cell; NaN fails the comparison
+                limit = 90 if field == 'lat' else 180
+                valid = value is None or (isinstance(value, (int, float)) and not isinstance(value, bool) and -limit <= value <= limit)
+            else:
+                valid = isinstance(value, bool)
+
+            if not valid:
+                raise ValueError(f"invalid {field}")
+            values[field] = value
+
+        return values
+
+    @classmethod
+    def insert_many(cls, user_id, rows):
+        """Insert rows of column values for user in one statement. Returns their SavedSearchRows, in order."""
+
+        if not rows:
+            return []
+
+        # A multi-row VALUES needs every column in every row
+        defaults = {'query_string': None, 'lon': None, 'lat': None, 'accessible': False, 'unisex': False, 'changing_table': False}
+
+        stmt = cls.__table__.insert().values([dict(defaults, **row, user_id=user_id) for row in rows]).returning(*cls.read_columns())
+
+        return [SavedSearchRow(*row) for row in db.session.execute(stmt)]
+
+    @classmethod
+    def fetch_many(cls, user_id, ids):
+        """Return {id: SavedSearchRow} for those of ids belonging to user."""
+
+        table = cls.__table__
+
+        return {row.id: row for row in cls.read(table.c.id.in_(ids), table.c.user_id == user_id)}
+
+    @classmethod
+    def update_many(cls, user_id, changes):
+        """Apply {id: column values} changes to user's saved searches with one executemany update.
+
+        Returns {id: SavedSearchRow} for the ids that were updated; ids not belonging to user are skipped.
+        """
+
+        table = cls.__table__
+        stmt = db.select(*cls.read_columns()).where(table.c.id.in_(changes), table.c.user_id == user_id).with_for_update()
+        updated = {row.id: replace(SavedSearchRow(*row), **changes[row.id]) for row in db.session.execute(stmt)}
+
+        if updated:
+            stmt = (table.update()
+                .where(table.c.id == db.bindparam('_id'))
+                .values({field: db.bindparam(field) for field in cls.EDITABLE_FIELDS}))
+            db.session.execute(stmt, [
+                dict({field: getattr(row, field) for field in cls.EDITABLE_FIELDS}, _id=id)
+                for id, row in updated.items()
+            ])
+
+        return updated
+
+    @classmethod
+    def delete_many(cls, user_id, ids):
+        """Delete those of ids belonging to user in one statement. Returns set of deleted ids."""
+
+        table = cls.__table__
+        stmt = table.delete().where(table.c.id.in_(ids), table.c.user_id == user_id).returning(table.c.id)
+
+        return {row.id for row in db.session.execute(stmt)}
+
+    @classmethod
+    def read_columns(cls):
+        """Columns of SERIALIZED_FIELDS, in order, for Core statements building SavedSearchRows."""
+
+        return [cls.__table__.c[field] for field in cls.SERIALIZED_FIELDS]
+
+    @classmethod
+    def read(cls, *criteria):
+        """Return SavedSearchRows matching criteria, in id order, e.g. SavedSearch.read(SavedSearch.user_id == 1).
+
+        Selects just the serialized columns with Core, so no ORM objects are built or tracked by the session.
+        """
+
+        stmt = db.select(*cls.read_columns()).where(*criteria).order_by(cls.__table__.c.id)
+
+        return [SavedSearchRow(*row) for row in db.session.execute(stmt)]
 
     def serialize(self):
         """Return data in json-friendly format"""
 
+        return {field: getattr(self, field) for field in self.SERIALIZED_FIELDS}
+
+
+@dataclass(slots=True)
+class SavedSearchRow:
+    """Saved search fields read with Core, for listing and exporting many saved searches (see SavedSearch.read).
+
+    Several times smaller than a SavedSearch and quicker to build. jsonify sends it straight from its slots, as the same object SavedSearch.serialize() gives.
+    """
+
+    id: int
+    user_id: int
+    name: str
+    query_string: str | None
+    lon: float | None
+    lat: float | None
+    accessible: bool
+    unisex: bool
+    changing_table: bool
+
+    def serialize(self):
+        """Return data in json-friendly format"""
+
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class Restroom(db.Model):
+    """Local mirror of a Refuge Restrooms listing"""
+
+    __tablename__ = "restrooms"
+    __table_args__ = (
+        db.Index('ix_restrooms_grid_cell_filters', 'grid_cell', 'accessible', 'unisex', 'changing_table'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.Text, nullable=False)
+    street = db.Column(db.Text)
+    city = db.Column(db.Text)
+    state = db.Column(db.Text)
+    country = db.Column(db.Text)
+    accessible = db.Column(db.Boolean, nullable=False, default=False)
+    unisex = db.Column(db.Boolean, nullable=False, default=False)
+    changing_table = db.Column(db.Boolean, nullable=False, default=False)
+    directions = db.Column(db.Text)
+    comment = db.Column(db.Text)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    upvote = db.Column(db.Integer, nullable=False, default=0)
+    downvote = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    grid_cell = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        """Show info about restroom"""
+
+        return f"<Restroom - id: {self.id}, name: {self.name}>"
+
+    @classmethod
+    def row_from_api(cls, data):
+        """Map a Refuge Restrooms API listing to a dict of column values."""
+
+        return {
+            'id': data['id'],
+            'name': data['name'],
+            'street': data.get('street'),
+            'city': data.get('city'),
+            'state': data.get('state'),
+            'country': data.get('country'),
+            'accessible': bool(data.get('accessible')),
+            'unisex': bool(data.get('unisex')),
+            'changing_table': bool(data.get('changing_table')),
+            'directions': data.get('directions'),
+            'comment': data.get('comment'),
+            'latitude': data['latitude'],
+            'longitude': data['longitude'],
+            'upvote': data.get('upvote') or 0,
+            'downvote': data.get('downvote') or 0,
+            'created_at': data.get('created_at'),
+            'updated_at': data.get('updated_at'),
+            'grid_cell': grid_cell(data['latitude'], data['longitude']),
+        }
+
+    @classmethod
+    def nearest(cls, lat, lon, k=10, accessible=False, unisex=False, changing_table=False, max_ring=8):
+        """Find the k restrooms closest to the point matching the filters. Returns list of (restroom, distance in miles).
+
+        Searches the square of grid cells around the point with one indexed query, widening the square only if it can't yet prove it holds the k closest matches.
+        """
+
+        import geo
+
+        row = math.floor(lat / GRID_SIZE)
+        col = math.floor(lon / GRID_SIZE)
+        ring = 1
+
+        while True:
+            cells = [
+                (row + dr) * GRID_COLS + col + dc
+                for dr in range(-ring, ring + 1)
+                for dc in range(-ring, ring + 1)
+            ]
+
+            query = cls.query.filter(cls.grid_cell.in_(cells))
+            if accessible:
+                query = query.filter(cls.accessible == True)
+            if unisex:
+                query = query.filter(cls.unisex == True)
+            if changing_table:
+                query = query.filter(cls.changing_table == True)
+
+            candidates = query.all()
+            idx, distances = geo.nearest(
+                lat, lon, [r.latitude for r in candidates], [r.longitude for r in candidates], k)
+            results = [(candidates[i], float(distance)) for i, distance in zip(idx, distances)]
+
+            # Anything outside the square is at least `reach` miles away
+            reach = ring * GRID_SIZE * geo.MILES_PER_DEGREE * math.cos(math.radians(min(89.9, abs(lat) + (ring + 1) * GRID_SIZE)))
+
+            if ring >= max_ring or (len(results) == k and results[-1][1] <= reach):
+                return results
+
+            ring *= 2
+
+    def serialize(self):
+        """Return data in the same json-friendly format as the Refuge Restrooms API"""
+
         return {
             'id': self.id,
-            'user_id': self.user_id,
             'name': self.name,
-            'query_string': self.query_string,
-            'lon': self.lon,
-            'lat': self.lat,
+            'street': self.street,
+            'city': self.city,
+            'state': self.state,
+            'country': self.country,
             'accessible': self.accessible,
             'unisex': self.unisex,
             'changing_table': self.changing_table,
-        }
\ No newline at end of file
+            'directions': self.directions,
+            'comment': self.comment,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'upvote': self.upvote,
+            'downvote': self.downvote,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class Job(db.Model):
+    """Queued background job, see jobs.py"""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        db.Index('ix_jobs_run_at', 'run_at'),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    kind = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    # At most one job per key is queued at a time
+    key = db.Column(db.Text, unique=True)
+    # When the job is next due; None once it has failed too often to retry
+    run_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        """Show info about job"""
+
+        return f"<Job - id: {self.id}, kind: {self.kind}, run_at: {self.run_at}>"
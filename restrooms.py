@@ -0,0 +1,158 @@
+"""Restroom search, served from the local mirror or from Refuge Restrooms.
+
+With RESTROOM_SOURCE=local, searches are answered from the Restroom table filled by ingest.py and never leave the database. Otherwise they go to the Refuge Restrooms API through a geo-tile cache: searches are snapped to a grid of tiles TILE_SIZE degrees wide. Every search falling in the same tile with the same filters is answered from one upstream request, made from the tile's center, then re-ranked by distance from the actual search point.
+"""
+
+import math
+import os
+import upstream
+from cache import make_cache
+import geo
+from models import Restroom
+
+REFUGE_URL = os.environ.get('REFUGE_URL', 'https://www.refugerestrooms.org/api')
+SOURCE = os.environ.get('RESTROOM_SOURCE', 'refuge')  # 'refuge' or 'local' (see ingest.py)
+TILE_SIZE = float(os.environ.get('RESTROOM_TILE_SIZE', 0.01))  # degrees, roughly 1 km
+PER_PAGE = 60
+# Seconds browsers and CDNs may reuse a search response without asking again
+CACHE_MAX_AGE = int(os.environ.get('RESTROOM_CACHE_MAX_AGE', 300))
+
+tile_cache = make_cache(
+    'tiles',
+    maxsize=int(os.environ.get('RESTROOM_CACHE_SIZE', 2048)),
+    ttl=int(os.environ.get('RESTROOM_CACHE_TTL', 900)),
+)
+
+
+def tile_for(lat, lon):
+    """Return (row, col) of the tile containing the point."""
+
+    return (math.floor(lat / TILE_SIZE), math.floor(lon / TILE_SIZE))
+
+
+def tile_params(tile, ada, unisex):
+    """by_location query parameters for the center of tile."""
+
+    row, col = tile
+
+    return {
+        'page': 1,
+        'per_page': PER_PAGE,
+        'offset': 0,
+        'lat': (row + 0.5) * TILE_SIZE,
+        'lng': (col + 0.5) * TILE_SIZE,
+        'ada': str(ada).lower(),
+        'unisex': str(unisex).lower(),
+    }
+
+
+def fetch_tile(tile, ada, unisex):
+    """Request restrooms nearest the center of tile from Refuge Restrooms."""
+
+    resp = upstream.get('refuge', f"{REFUGE_URL}/v1/restrooms/by_location", params=tile_params(tile, ada, unisex))
+    resp.raise_for_status()
+
+    return resp.json()
+
+
+async def fetch_tile_async(tile, ada, unisex):
+    """Request restrooms nearest the center of tile from Refuge Restrooms, without blocking the event loop."""
+
+    resp = await upstream.get_async('refuge', f"{REFUGE_URL}/v1/restrooms/by_location", params=tile_params(tile, ada, unisex))
+    resp.raise_for_status()
+
+    return resp.json()
+
+
+def rank(lat, lon, restrooms):
+    """Copies of restrooms with `distance` in miles from the point, closest first."""
+
+    if not restrooms:
+        return []
+
+    distances = geo.haversine(lat, lon, [r['latitude'] for r in restrooms], [r['longitude'] for r in restrooms])
+
+    return [dict(restrooms[i], distance=float(distances[i])) for i in distances.argsort()]
+
+
+def by_location(lat, lon, ada=False, unisex=False):
+    """Return restrooms near the point, closest first, with `distance` in miles from it.
+
+    Raises requests.RequestException if the tile isn't cached and Refuge Restrooms can't be reached.
+    """
+
+    tile = tile_for(lat, lon)
+    restrooms = tile_cache.get_or_load((tile, ada, unisex), lambda: fetch_tile(tile, ada, unisex))
+
+    return rank(lat, lon, restrooms)
+
+
+async def by_location_async(lat, lon, ada=False, unisex=False):
+    """Async by_location, sharing its cache. Raises httpx.HTTPError rather than requests.RequestException."""
+
+    tile = tile_for(lat, lon)
+    restrooms = await tile_cache.get_or_load_async((tile, ada, unisex), lambda: fetch_tile_async(tile, ada, unisex))
+
+    return rank(lat, lon, restrooms)
+
+
+def parse_args(args):
+    """Search keyword arguments from request query args. Raises ValueError if lat/lon are missing or off the map, or limit isn't a number.
+
+    limit is clamped to 1..PER_PAGE.
+    """
+
+    try:
+        lat, lon = float(args['lat']), float(args['lon'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("lat and lon are required") from e
+
+    # float() accepts 'nan' and 'inf', which can't be placed on a tile; NaN fails the comparison too
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("lat must be between -90 and 90 and lon between -180 and 180")
+
+    try:
+        limit = int(args.get('limit', 10))
+    except (TypeError, ValueError) as e:
+        raise ValueError("limit must be a whole number") from e
+
+    return {
+        'lat': lat,
+        'lon': lon,
+        'accessible': args.get('ada') == 'true',
+        'unisex': args.get('unisex') == 'true',
+        'changing_table': args.get('changing_table') == 'true',
+        'limit': max(1, min(limit, PER_PAGE)),
+    }
+
+
+def filter_results(results, changing_table, limit):
+    """changing_table can't be filtered upstream, so filter a tile's over-fetched results here."""
+
+    if changing_table:
+        results = [restroom for restroom in results if restroom['changing_table']]
+
+    return results[:limit]
+
+
+def search(lat, lon, accessible=False, unisex=False, changing_table=False, limit=10):
+    """Return up to limit restrooms matching the filters near the point, closest first, with `distance` in miles."""
+
+    if SOURCE == 'local':
+        return [
+            dict(restroom.serialize(), distance=distance)
+            for restroom, distance in Restroom.nearest(
+                lat, lon, k=limit, accessible=accessible, unisex=unisex, changing_table=changing_table)
+        ]
+
+    results = by_location(lat, lon, ada=accessible, unisex=unisex)
+
+    return filter_results(results, changing_table, limit)
+
+
+async def search_async(lat, lon, accessible=False, unisex=False, changing_table=False, limit=10):
+    """Async search of Refuge Restrooms. The local mirror is only searched synchronously, through search()."""
+
+    results = await by_location_async(lat, lon, ada=accessible, unisex=unisex)
+
+    return filter_results(results, changing_table, limit)
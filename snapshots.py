@@ -0,0 +1,147 @@
+"""Snapshots of saved searches' restroom results.
+
+Each saved search keeps a compact copy of the restrooms its last search found, so opening it can show results straight away. A snapshot goes stale SNAPSHOT_TTL seconds after it was taken (default 6 hours), or as soon as the search's location or filters change. Stale snapshots are refreshed when a user opens the search, in the background by the refresh_snapshots job (see jobs.py), or by running this module on a schedule:
+
+    $ python snapshots.py [--limit 500]
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta
+import requests
+from sqlalchemy.orm import undefer
+import restrooms
+from models import db, SavedSearch
+
+SNAPSHOT_TTL = int(os.environ.get('SNAPSHOT_TTL', 6 * 3600))
+SNAPSHOT_SIZE = 10
+
+# What the search page shows of each restroom
+FIELDS = (
+    'id', 'name', 'street', 'city', 'state', 'latitude', 'longitude', 'distance',
+    'accessible', 'unisex', 'changing_table', 'comment', 'directions',
+    'upvote', 'downvote', 'created_at', 'updated_at',
+)
+
+
+def snapshot_key(saved_search):
+    """The search parameters a snapshot depends on."""
+
+    return [saved_search.lat, saved_search.lon, saved_search.accessible, saved_search.unisex, saved_search.changing_table]
+
+
+def expires_at(saved_search):
+    """When saved search's snapshot expires, or None if there isn't one. Doesn't load the snapshot."""
+
+    if saved_search.snapshot_at is None:
+        return None
+
+    return saved_search.snapshot_at + timedelta(seconds=SNAPSHOT_TTL)
+
+
+def is_expired(saved_search, now=None):
+    """Was saved search's snapshot taken more than SNAPSHOT_TTL seconds ago? False if there isn't one. Doesn't load the snapshot."""
+
+    expires = expires_at(saved_search)
+
+    return expires is not None and expires <= (now or datetime.utcnow())
+
+
+def is_stale(saved_search, now=None):
+    """Is saved search's snapshot missing, expired, or taken for other parameters?"""
+
+    if saved_search.snapshot is None or saved_search.snapshot_at is None:
+        return True
+
+    return is_expired(saved_search, now) or saved_search.snapshot['key'] != snapshot_key(saved_search)
+
+
+def compact(results):
+    """Keep only the fields the search page shows."""
+
+    return [{field: result.get(field) for field in FIELDS} for result in results]
+
+
+def refresh(saved_search):
+    """Search again and store the results as saved search's snapshot. Returns True if they differ from the previous snapshot.
+
+    Commit the session to save it. Raises requests.RequestException if the restroom search fails.
+    """
+
+    results = compact(restrooms.search(
+        saved_search.lat, saved_search.lon,
+        accessible=saved_search.accessible,
+        unisex=saved_search.unisex,
+        changing_table=saved_search.changing_table,
+        limit=SNAPSHOT_SIZE,
+    ))
+
+    previous = saved_search.snapshot
+    saved_search.snapshot = {'key': snapshot_key(saved_search), 'restrooms': results}
+    saved_search.snapshot_at = datetime.utcnow()
+
+    return previous is None or previous['restrooms'] != results
+
+
+def serialize(saved_search):
+    """Snapshot in json-friendly format, or None if there isn't one."""
+
+    if saved_search.snapshot is None:
+        return None
+
+    return {
+        'restrooms': saved_search.snapshot['restrooms'],
+        'taken_at': saved_search.snapshot_at.isoformat(),
+        'stale': is_stale(saved_search),
+    }
+
+
+def refresh_stale(limit=500):
+    """Refresh up to limit saved searches whose snapshots are missing or oldest past SNAPSHOT_TTL, committing each. Returns the number refreshed.
+
+    Searches whose location or filters changed since their snapshot are refreshed when next opened.
+    """
+
+    cutoff = datetime.utcnow() - timedelta(seconds=SNAPSHOT_TTL)
+    stale = (SavedSearch.query
+        .options(undefer(SavedSearch.snapshot))
+        .filter(SavedSearch.lat.isnot(None), SavedSearch.lon.isnot(None))
+        .filter(db.or_(SavedSearch.snapshot_at.is_(None), SavedSearch.snapshot_at <= cutoff))
+        .order_by(SavedSearch.snapshot_at.asc().nullsfirst())
+        .limit(limit)
+        .all())
+
+    # Committing would otherwise expire the searches still to refresh, reloading each one
+    session = db.session()
+    expire_on_commit, session.expire_on_commit = session.expire_on_commit, False
+
+    refreshed = 0
+    try:
+        for saved_search in stale:
+            try:
+                refresh(saved_search)
+            except requests.RequestException as e:
+                print(f"saved search {saved_search.id}: {e}")
+                db.session.rollback()
+                continue
+
+            db.session.commit()
+            refreshed += 1
+    finally:
+        session.expire_on_commit = expire_on_commit
+
+    return refreshed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--limit', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{refresh_stale(args.limit)} snapshots refreshed")
+
+
+if __name__ == '__main__':
+    from app import create_app
+    create_app(views=False)
+    main()
@@ -1,4 +1,4 @@
-const BASE_URL = "https://www.refugerestrooms.org/api"
+const BASE_URL = "/api"
 const SCREEN_BREAKPOINT = 767;
 
 // Search input
@@ -6,10 +6,10 @@ let CURRENT_LON;
 let CURRENT_LAT;
 let USE_LOCATION;
 let GEOCODER;
+let LOADING_SAVED_SEARCH = false;
 const $geocoderDiv = $('#geocoder');
 const $searchButton = $('#search-button');
 const $saveSearchButton = $('#save-search-button');
-const $retrieveSearch = $('.retrieve-search');
 
 // Search filters
 const $isAccessible = $('#accessible');
@@ -65,6 +65,37 @@ const handleSearch = async () => {
 };
 
 
+const handleGeocoderResult = () => {
+    // Filling in a saved search's location shouldn't search again
+    if (LOADING_SAVED_SEARCH){
+        LOADING_SAVED_SEARCH = false;
+        return;
+    }
+    handleSearch();
+};
+
+
+const handleGeocoderResults = (results) => {
+    // A query with no matches never emits 'result', so stop waiting for the saved search's one
+    if (!results.features || !results.features.length){
+        LOADING_SAVED_SEARCH = false;
+    }
+};
+
+
+const createGeocoder = () => {
+    return new MapboxGeocoder({
+        accessToken: mapboxgl.accessToken,
+        mapboxgl: mapboxgl,
+        zoom: 12,
+    })
+    .on('result', handleGeocoderResult)
+    .on('results', handleGeocoderResults)
+    .on('error', () => { LOADING_SAVED_SEARCH = false; })
+    .on('clear', () => { LOADING_SAVED_SEARCH = false; });
+};
+
+
 const getCoordinates = () => {
     let coords = {
         lon: CURRENT_LON,
@@ -98,35 +129,15 @@ const adjustMapDisplay = (lon, lat) => {
 
 const getResults = async (lon, lat) => {
 
-    // add 50 extra results, in case changing table is checked (can't be filtered through API)
-    const per_page = NUM_RESULTS + 50; 
-
     resp = axios
-        .get(`${BASE_URL}/v1/restrooms/by_location?page=1&per_page=${per_page}&offset=0&lng=${lon}&lat=${lat}&ada=${$isAccessible.is(':checked')}&unisex=${$isUnisex.is(':checked')}`)
+        .get(`${BASE_URL}/restrooms?lon=${lon}&lat=${lat}&limit=${NUM_RESULTS}&ada=${$isAccessible.is(':checked')}&unisex=${$isUnisex.is(':checked')}&changing_table=${$hasChangingTable.is(':checked')}&format=columns`)
         .then(async (resp) => {
-            let restrooms = resp.data;
+            let restrooms = fromColumns(resp.data.restrooms);
     
             if (!restrooms){
                 console.log('no restrooms found')
                 return}
-            for (let i = 0; i < restrooms.length; i++){
-                const restroom = restrooms[i];
-                
-                // filter for changing table (can't be filtered through API)
-                if ($hasChangingTable.is(':checked') && !restroom.changing_table){
-                    continue;
-                }
-                
-                restroom.number = RESTROOM_RESULTS.size + 1;
-                RESTROOM_RESULTS.set(restroom.id, restroom);
-        
-                addMapMarker(restroom);
-                addResultToDOM(restroom);
-        
-                if (RESTROOM_RESULTS.size === NUM_RESULTS){
-                    break;
-                }
-            }
+            showResults(restrooms);
         
             return restrooms
         })
@@ -135,6 +146,28 @@ const getResults = async (lon, lat) => {
         });
 };
 
+
+const fromColumns = ({columns, rows}) => {
+    // results sent with each field named once, back to one object per restroom
+    return rows.map((row) => Object.fromEntries(columns.map((column, i) => [column, row[i]])));
+};
+
+
+const showResults = (restrooms) => {
+    // replace any results shown with these
+    $resultsList.empty();
+    RESTROOM_RESULTS.clear();
+    clearMapMarkers();
+
+    for (const restroom of restrooms){
+        restroom.number = RESTROOM_RESULTS.size + 1;
+        RESTROOM_RESULTS.set(restroom.id, restroom);
+
+        addMapMarker(restroom);
+        addResultToDOM(restroom);
+    }
+};
+
 /////////////////////////////////////////////////
 // Map Functions
 
@@ -151,13 +184,7 @@ const showMap = async(lon, lat) => {
     const nav = new mapboxgl.NavigationControl();
     MAP.addControl(nav, 'top-right');
   
-    GEOCODER = new MapboxGeocoder({
-      accessToken: mapboxgl.accessToken,
-      mapboxgl: mapboxgl,
-      zoom: 12,
-    }).on('result', () => {
-        handleSearch();
-    });
+    GEOCODER = createGeocoder();
   
     document.getElementById('geocoder').appendChild(GEOCODER.onAdd(MAP));
   
@@ -179,13 +206,7 @@ const refreshMap = (lon, lat) => {
 
     MAP.center = [lon, lat];
 
-    GEOCODER = new MapboxGeocoder({
-        accessToken: mapboxgl.accessToken,
-        mapboxgl: mapboxgl,
-        zoom: 12,
-    }).on('result', () => {
-        handleSearch();
-    });
+    GEOCODER = createGeocoder();
 
     document.getElementById('geocoder').appendChild(GEOCODER.onAdd(MAP));
 
@@ -375,7 +396,7 @@ const handleSaveSearch = async() => {
     handleSearch();
 }
 
-$retrieveSearch.on('click', async(evt) => {
+$(document).on('click', '.retrieve-search', async(evt) => {
 
     // Listen for click on list of saved searches, get id of target
     const search_id = $(evt.target).attr('data-search-id');
@@ -391,7 +412,7 @@ const loadSavedSearch = async(search_id) => {
     
     const resp = await axios.get(`/search/${search_id}`);
 
-    const savedSearch = resp.data.saved_search;
+    const { saved_search: savedSearch, snapshot } = resp.data;
 
     const {
         query_string,
@@ -406,15 +427,86 @@ const loadSavedSearch = async(search_id) => {
     $isUnisex.prop('checked', unisex);
     $hasChangingTable.prop('checked', changing_table);
     
-    await getResults(lon, lat);
     await showMap(lon, lat);
-    GEOCODER.inputString = query_string;
-    GEOCODER.query(query_string);
+    adjustMapDisplay(lon, lat);
+
+    // Show the results saved with the search straight away, then fetch new ones only if they may have changed
+    if (snapshot){
+        showResults(snapshot.restrooms);
+    }
+    if (!snapshot || snapshot.stale){
+        await refreshSavedResults(search_id);
+    }
+
+    // An empty query emits no result to skip
+    if (query_string){
+        LOADING_SAVED_SEARCH = true;
+        GEOCODER.inputString = query_string;
+        GEOCODER.query(query_string);
+    }
 
     sessionStorage.removeItem('savedSearch');
 }
 
 
+const refreshSavedResults = async(search_id) => {
+
+    try {
+        const resp = await axios.get(`/search/${search_id}/results`);
+        if (resp.data.changed){
+            showResults(resp.data.snapshot.restrooms);
+        }
+    } catch (err) {
+        console.log(err);
+    }
+};
+
+
+$('#load-more-searches').on('click', async(evt) => {
+
+    // Fetch the next page of saved searches on the profile page and append it to the list
+    const $loadMore = $(evt.target);
+    const user_id = $('#searches-list').attr('data-user-id');
+    const after = $loadMore.attr('data-next-after');
+
+    const resp = await axios.get(`/users/${user_id}/searches?after=${after}`);
+    const { searches, next_after } = resp.data;
+
+    for (const search of searches){
+        addSavedSearchToDOM(search);
+    }
+
+    if (next_after){
+        $loadMore.attr('data-next-after', next_after);
+    } else {
+        $loadMore.remove();
+    }
+});
+
+
+const addSavedSearchToDOM = (search) => {
+    const { id, name } = search;
+
+    const $item = $(`
+    <div class="list-group-item d-flex align-items-center justify-content-between">
+        <span class="retrieve-search" data-search-id="${id}"></span>
+        <div>
+            <a href="/search/${id}/edit" id="saved-search-edit" class="text-dark">
+                <i title="Edit Saved Search" class="fa-solid fa-pencil"></i>
+            </a>
+            <a method="POST" href="/search/${id}/delete"  id="saved-search-delete" class="text-dark">
+                <i title="Delete Saved Search" class="fa-solid fa-x"></i>
+            </a>
+        </div>
+    </div>
+    `);
+
+    // set name as text, since it is user input
+    $item.find('.retrieve-search').text(name);
+    $('#searches-list').append($item);
+};
+
+
 const showSavedCheck = () => {
     // save search button becomes saved check
     ($saveSearchButton).attr("data-original-text", $($saveSearchButton).html());
@@ -0,0 +1,61 @@
+"""App factory tests"""
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CreateAppTestCase(TestCase):
+    """Test create_app, each in a fresh interpreter so this process's app is left alone"""
+
+    def python(self, code, **env):
+        """Run code with env set in place of SECRET_KEY. Returns the process, with its output as text."""
+
+        env = {**{k: v for k, v in os.environ.items() if k != 'SECRET_KEY'}, 'DATABASE_URL': "postgresql:///flusher-test", **env}
+        return subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True)
+
+    def test_without_views(self):
+        """Does an app without views skip the routes and the modules only they need?"""
+
+        proc = self.python(
+            "import sys, app\n"
+            "app.create_app(views=False)\n"
+            "print(sorted({m.split('.')[0] for m in sys.modules} & {'views', 'forms', 'wtforms', 'bcrypt', 'numpy', 'requests', 'httpx'}))"
+        )
+
+        self.assertEqual(proc.stdout.strip(), "[]", proc.stderr)
+
+    def test_settings(self):
+        """Do settings passed in override the environment, and is the app built with its routes?"""
+
+        proc = self.python(
+            "from app import create_app\n"
+            "app = create_app({'TESTING': True, 'SECRET_KEY': 'from settings'})\n"
+            "print(app.config['TESTING'], app.config['SECRET_KEY'], 'views.root' in app.view_functions)",
+            SECRET_KEY="from env",
+        )
+
+        self.assertEqual(proc.stdout.strip(), "True from settings True", proc.stderr)
+
+    def test_secret_key_required(self):
+        """Is serving requests without a SECRET_KEY refused, but running scripts allowed?"""
+
+        self.assertIn("RuntimeError: SECRET_KEY", self.python("from app import create_app; create_app()").stderr)
+        self.assertEqual(self.python("from app import create_app; create_app(views=False)").returncode, 0)
+
+    def test_queue_metrics_without_jobs(self):
+        """Does /metrics report the job queue even when this process doesn't run jobs?"""
+
+        proc = self.python(
+            "import sys\n"
+            "from app import create_app\n"
+            "app = create_app({'SECRET_KEY': 'test'})\n"
+            "text = app.test_client().get('/metrics').get_data(as_text=True)\n"
+            "print('# TYPE jobs_ready gauge' in text, 'jobs_oldest_waiting_seconds' in text, 'jobs' in sys.modules)",
+            JOBS_IN_PROCESS='0',
+        )
+
+        self.assertEqual(proc.stdout.strip(), "True True False", proc.stderr)
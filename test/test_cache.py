@@ -0,0 +1,418 @@
+"""Cache tests"""
+
+import asyncio
+import fnmatch
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from cache import TTLCache, SQLiteCache, RedisCache, make_cache
+from upstream import RateLimiter
+import geocode
+import restrooms
+
+
+class FakeClock:
+    """Clock the tests can move forward by hand"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTestCase(TestCase):
+    """Test TTLCache"""
+
+    def setUp(self):
+        """Create cache with a controllable clock"""
+
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=self.clock)
+
+##################################################
+# Basic cache Tests
+
+    def test_get_set(self):
+        """Does a cached value come back, and a missing one return the default?"""
+
+        self.cache.set('a', 1)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_ttl(self):
+        """Do entries expire after their ttl?"""
+
+        self.cache.set('a', 1)
+        self.clock.now = 9
+        self.assertEqual(self.cache.get('a'), 1)
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted when the cache is full?"""
+
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_expire(self):
+        """Does expire() drop only stale entries?"""
+
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=20)
+        self.clock.now = 15
+
+        self.assertEqual(self.cache.expire(), 1)
+        self.assertEqual(self.cache.get('b'), 2)
+
+
+##################################################
+# get_or_load Tests
+
+    def test_get_or_load_caches(self):
+        """Is the loader called only on a miss?"""
+
+        calls = []
+        loader = lambda: calls.append(1) or 'value'
+
+        self.assertEqual(self.cache.get_or_load('a', loader), 'value')
+        self.assertEqual(self.cache.get_or_load('a', loader), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def test_get_or_load_collapses_concurrent_misses(self):
+        """Do concurrent misses for one key share a single loader call?"""
+
+        calls = []
+        release = threading.Event()
+
+        def loader():
+            calls.append(1)
+            release.wait()
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_load('a', loader))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 5)
+
+    def test_get_or_load_error(self):
+        """Are loader errors raised and not cached?"""
+
+        def loader():
+            raise ValueError("upstream down")
+
+        with self.assertRaises(ValueError):
+            self.cache.get_or_load('a', loader)
+
+        self.assertEqual(self.cache.get_or_load('a', lambda: 'value'), 'value')
+
+    def test_get_or_load_async_collapses_concurrent_misses(self):
+        """Do concurrent async misses for one key share a single loader await?"""
+
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        async def load_many():
+            return await asyncio.gather(*(self.cache.get_or_load_async('a', loader) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(load_many()), ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.get('a'), 'value')
+
+
+class SQLiteCacheTestCase(TestCase):
+    """Test SQLiteCache, in a file opened as two processes would open it"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.db')
+        self.clock = FakeClock()
+        self.cache = SQLiteCache(self.path, 'test', maxsize=2, ttl=10, clock=self.clock)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_shared_between_instances(self):
+        """Is a value set through one instance seen by another, but not by a cache with another name?"""
+
+        self.cache.set('a', {'place': "Philadelphia, PA"})
+
+        self.assertEqual(SQLiteCache(self.path, 'test', clock=self.clock).get('a'), {'place': "Philadelphia, PA"})
+        self.assertIsNone(SQLiteCache(self.path, 'other', clock=self.clock).get('a'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))
+
+    def test_ttl(self):
+        """Do entries expire after their ttl, and can expired ones be dropped?"""
+
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=30)
+        self.clock.now = 10
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self.cache.expire(), 1)
+
+    def test_eviction(self):
+        """Are entries closest to expiring evicted beyond maxsize?"""
+
+        self.cache.set('a', 1, ttl=30)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3, ttl=20)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_get_or_load_locks_across_instances(self):
+        """Does a miss wait for another process already loading the key, rather than loading it again?"""
+
+        other = SQLiteCache(self.path, 'test', ttl=10, clock=self.clock)
+        calls = []
+        release = threading.Event()
+
+        def loader():
+            calls.append(1)
+            release.wait()
+            return 'value'
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.cache.get_or_load('a', loader)))
+        thread.start()
+        time.sleep(0.05)
+        threading.Timer(0.1, release.set).start()
+
+        self.assertEqual(other.get_or_load('a', loader), 'value')
+        thread.join()
+        self.assertEqual(results, ['value'])
+        self.assertEqual(len(calls), 1)
+
+
+    def test_get_or_load_async_collapses_concurrent_misses(self):
+        """Do concurrent async misses share one loader await, and is the result stored for other instances?"""
+
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        async def load_many():
+            return await asyncio.gather(*(self.cache.get_or_load_async('a', loader) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(load_many()), ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(SQLiteCache(self.path, 'test', clock=self.clock).get('a'), 'value')
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    """Just enough of a Redis server for RedisCache: GET, SET with PX and NX, DEL and SCAN, without expiry"""
+
+    def handle(self):
+        data = self.server.data
+
+        while line := self.rfile.readline():
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+
+            command, args = args[0].upper(), args[1:]
+            if command == b'GET':
+                value = data.get(args[0])
+                reply = b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+            elif command == b'SET':
+                if b'NX' in args and args[0] in data:
+                    reply = b'$-1\r\n'
+                else:
+                    data[args[0]] = args[1]
+                    reply = b'+OK\r\n'
+            elif command == b'DEL':
+                reply = b':%d\r\n' % sum(data.pop(key, None) is not None for key in args)
+            elif command == b'SCAN':
+                keys = [key for key in data if fnmatch.fnmatchcase(key, args[2])]
+                reply = b'*2\r\n$1\r\n0\r\n*%d\r\n' % len(keys) + b''.join(b'$%d\r\n%s\r\n' % (len(key), key) for key in keys)
+            else:
+                reply = b'-ERR unknown command\r\n'
+
+            self.wfile.write(reply)
+
+
+class RedisCacheTestCase(TestCase):
+    """Test RedisCache against a stand-in server"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RESPHandler)
+        cls.server.daemon_threads = True
+        cls.server.data = {}
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"redis://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.data.clear()
+        self.cache = make_cache('test', maxsize=2, ttl=10, url=self.url)
+
+    def test_get_set_delete(self):
+        """Are values stored under the cache's name with a ttl, and counted as hits and misses?"""
+
+        self.cache.set('a', [1, 2])
+
+        self.assertEqual(self.cache.get('a'), [1, 2])
+        self.assertEqual(self.server.data, {b"test:'a'": b'[1,2]'})
+        self.cache.delete('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_clear(self):
+        """Does clear drop only this cache's entries?"""
+
+        self.cache.set('a', 1)
+        make_cache('other', maxsize=2, ttl=10, url=self.url).set('a', 2)
+        self.cache.clear()
+
+        self.assertEqual(list(self.server.data), [b"other:'a'"])
+
+    def test_get_or_load_releases_lock(self):
+        """Is the load lock taken and released around the loader?"""
+
+        def loader():
+            self.assertIn(b"test:'a':lock", self.server.data)
+            return 'value'
+
+        self.assertEqual(self.cache.get_or_load('a', loader), 'value')
+        self.assertEqual(list(self.server.data), [b"test:'a'"])
+
+    def test_server_down(self):
+        """Does an unreachable server just mean every lookup loads, logged once until it's back?"""
+
+        cache = RedisCache('redis://127.0.0.1:1', 'test')
+
+        with patch('builtins.print') as log:
+            self.assertEqual(cache.get_or_load('a', lambda: 'value'), 'value')
+            self.assertEqual(cache.get_or_load('a', lambda: 'again'), 'again')
+            self.assertEqual(log.call_count, 1)
+
+            cache.client.port = self.server.server_address[1]
+            self.assertEqual(cache.get_or_load('a', lambda: 'back'), 'back')
+            self.assertEqual(cache.get('a'), 'back')
+
+        self.assertEqual(log.call_count, 2)
+        self.assertIn("available again", log.call_args.args[0])
+
+    def test_unknown_store(self):
+        """Is an unknown CACHE_URL refused?"""
+
+        with self.assertRaises(ValueError):
+            make_cache('test', maxsize=2, ttl=10, url='memcached://localhost')
+
+
+class RestroomTileCacheTestCase(TestCase):
+    """Test restroom searches through the geo-tile cache"""
+
+    def setUp(self):
+        restrooms.tile_cache.clear()
+
+    def test_same_tile_single_upstream_call(self):
+        """Do nearby searches with the same filters share one upstream request, each ranked by its own distance?"""
+
+        tile_results = [
+            {'id': 1, 'latitude': 39.9545, 'longitude': -75.1651},
+            {'id': 2, 'latitude': 39.9541, 'longitude': -75.1659},
+        ]
+
+        with patch('restrooms.fetch_tile', return_value=tile_results) as fetch_tile:
+            east = restrooms.by_location(39.9543, -75.1650)
+            west = restrooms.by_location(39.9542, -75.1658)
+            restrooms.by_location(39.9542, -75.1658, ada=True)
+
+        self.assertEqual(fetch_tile.call_count, 2)
+        self.assertEqual([r['id'] for r in east], [1, 2])
+        self.assertEqual([r['id'] for r in west], [2, 1])
+        self.assertNotIn('distance', tile_results[0])
+
+
+class SearchArgsTestCase(TestCase):
+    """Test parsing restroom search query args"""
+
+    def test_limit(self):
+        """Is limit clamped to 1..PER_PAGE, and a non-number refused?"""
+
+        limit = lambda value: restrooms.parse_args({'lat': '39.95', 'lon': '-75.16', 'limit': value})['limit']
+
+        self.assertEqual([limit('5'), limit('0'), limit('-5'), limit('1000')], [5, 1, 1, restrooms.PER_PAGE])
+        with self.assertRaisesRegex(ValueError, "limit"):
+            limit('abc')
+
+    def test_coordinates(self):
+        """Are coordinates off the map or not finite refused?"""
+
+        for lat, lon in (('nan', '2'), ('39.95', 'inf'), ('91', '0'), ('0', '-180.5')):
+            with self.assertRaisesRegex(ValueError, "lat must be"):
+                restrooms.parse_args({'lat': lat, 'lon': lon})
+
+
+class GeocodeCacheTestCase(TestCase):
+    """Test reverse geocoding through the rounded-coordinate cache"""
+
+    def setUp(self):
+        geocode.geocode_cache.clear()
+
+    def test_nearby_points_share_lookup(self):
+        """Do points within the rounding precision share one Mapbox call?"""
+
+        with patch('geocode.fetch_place_name', return_value="Philadelphia, PA") as fetch:
+            self.assertEqual(geocode.reverse_geocode(-75.16571, 39.95432), "Philadelphia, PA")
+            self.assertEqual(geocode.reverse_geocode(-75.16551, 39.95409), "Philadelphia, PA")
+            geocode.reverse_geocode(-75.17, 39.95)
+
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_no_results_cached(self):
+        """Is an empty Mapbox answer cached too?"""
+
+        with patch('geocode.fetch_place_name', return_value=None) as fetch:
+            self.assertIsNone(geocode.reverse_geocode(0, 0))
+            self.assertIsNone(geocode.reverse_geocode(0, 0))
+
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_rate_limiter(self):
+        """Does the limiter allow a burst, then refill at its rate?"""
+
+        clock = FakeClock()
+        limiter = RateLimiter(2, burst=2, clock=clock)
+
+        self.assertEqual([limiter.acquire() for _ in range(3)], [True, True, False])
+        clock.now = 0.5
+        self.assertEqual([limiter.acquire() for _ in range(2)], [True, False])
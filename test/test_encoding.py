@@ -0,0 +1,99 @@
+"""Response encoding tests"""
+
+import gzip
+import json
+import os
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+from flask import jsonify
+
+os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
+
+from app import app
+import encoding
+app.config['TESTING'] = True
+
+RESULTS = [{'id': i, 'name': f"Restroom {i}", 'comment': "Ask at the counter for the key. " * 5, 'distance': i / 10} for i in range(20)]
+
+
+class EncodingTestCase(TestCase):
+    """Test the JSON provider, compression and result formats"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_provider(self):
+        """Does jsonify send the same JSON as before, with datetimes as HTTP dates?"""
+
+        data = {'when': datetime(2022, 1, 2, 3, 4, 5), 'name': "café", 'n': [1, 2.5, None]}
+
+        with app.test_request_context():
+            body = jsonify(data).get_data()
+
+        self.assertEqual(json.loads(body), {'when': "Sun, 02 Jan 2022 03:04:05 GMT", 'name': "café", 'n': [1, 2.5, None]})
+
+    def test_to_columns(self):
+        """Is each key sent once, with missing values as None?"""
+
+        self.assertEqual(encoding.to_columns([{'a': 1, 'b': 2}, {'b': 3, 'c': 4}]),
+            {'columns': ['a', 'b', 'c'], 'rows': [[1, 2, None], [None, 3, 4]]})
+        self.assertEqual(encoding.to_columns([]), {'columns': [], 'rows': []})
+
+    def test_compressed(self):
+        """Are large responses gzipped for clients that accept it, keeping a weak ETag that still matches?"""
+
+        with patch('restrooms.search', return_value=RESULTS):
+            resp = self.client.get('/api/restrooms?lat=39.95&lon=-75.16', headers={'Accept-Encoding': "gzip, deflate"})
+            again = self.client.get('/api/restrooms?lat=39.95&lon=-75.16', headers={'Accept-Encoding': "gzip", 'If-None-Match': resp.headers['ETag']})
+            plain = self.client.get('/api/restrooms?lat=39.95&lon=-75.16')
+
+        self.assertEqual(resp.headers['Content-Encoding'], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers['Vary'])
+        self.assertTrue(resp.headers['ETag'].startswith('W/"'))
+        self.assertEqual(json.loads(gzip.decompress(resp.get_data())), {'restrooms': RESULTS})
+        self.assertEqual(again.status_code, 304)
+
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.json, {'restrooms': RESULTS})
+
+    def test_small_not_compressed(self):
+        """Are responses under COMPRESS_MIN_SIZE sent as is?"""
+
+        with patch('restrooms.search', return_value=RESULTS[:1]):
+            resp = self.client.get('/api/restrooms?lat=39.95&lon=-75.16', headers={'Accept-Encoding': "gzip"})
+
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.json, {'restrooms': RESULTS[:1]})
+
+    def test_html_not_compressed(self):
+        """Are HTML pages, which carry the CSRF token next to echoed form input, sent uncompressed?"""
+
+        resp = self.client.post('/signup', data={'username': "x" * 2000, 'email': "bad"}, headers={'Accept-Encoding': "gzip"})
+
+        self.assertEqual(resp.mimetype, 'text/html')
+        self.assertGreater(len(resp.get_data()), encoding.COMPRESS_MIN_SIZE)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn("x" * 2000, resp.get_data(as_text=True))
+
+    def test_static_not_compressed(self):
+        """Are static files, which are streamed, sent as is even to clients accepting gzip?"""
+
+        resp = self.client.get('/static/app.js', headers={'Accept-Encoding': "gzip"})
+        resp.close()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertNotIn('application/javascript', encoding.COMPRESSIBLE)
+
+    def test_columns_format(self):
+        """Are restroom results sent in columns when asked, and unknown formats refused?"""
+
+        with patch('restrooms.search', return_value=RESULTS):
+            resp = self.client.get('/api/restrooms?lat=39.95&lon=-75.16&format=columns')
+            bad = self.client.get('/api/restrooms?lat=39.95&lon=-75.16&format=xml')
+
+        restrooms = resp.json['restrooms']
+        self.assertEqual(restrooms['columns'], ['id', 'name', 'comment', 'distance'])
+        self.assertEqual([dict(zip(restrooms['columns'], row)) for row in restrooms['rows']], RESULTS)
+        self.assertEqual(bad.status_code, 400)
@@ -0,0 +1,125 @@
+"""Export tests"""
+
+import csv
+import io
+import json
+import os
+from unittest import TestCase
+from models import db, User, SavedSearch, SavedSearchRow
+
+os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
+
+from app import app
+from views import CURR_USER_KEY, user_cache
+import export
+
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.create_all()
+
+
+class ExportFormatTestCase(TestCase):
+    """Test the export formats on batches of rows"""
+
+    def setUp(self):
+        self.batches = [
+            [SavedSearchRow(1, 7, "Home", None, -75.16, 39.95, True, False, False)],
+            [SavedSearchRow(2, 7, "Work, downtown", "q=work", None, None, False, True, False)],
+        ]
+
+    def test_ndjson(self):
+        """Is the account followed by a saved search per line?"""
+
+        lines = b''.join(export.ndjson(self.batches, {'id': 7})).decode().splitlines()
+
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'user': {'id': 7}},
+            self.batches[0][0].serialize(),
+            self.batches[1][0].serialize(),
+        ])
+
+    def test_csv(self):
+        """Is there a header row, then a row per saved search, quoted where needed?"""
+
+        rows = list(csv.reader(io.StringIO(b''.join(export.to_csv(self.batches)).decode())))
+
+        self.assertEqual(rows[0], list(SavedSearch.SERIALIZED_FIELDS))
+        self.assertEqual(rows[2], ['2', '7', "Work, downtown", "q=work", '', '', 'False', 'True', 'False'])
+        self.assertEqual(b''.join(export.to_csv([])).decode().strip(), ','.join(SavedSearch.SERIALIZED_FIELDS))
+
+    def test_geojson(self):
+        """Is there a Feature per saved search, with no geometry where there's no location?"""
+
+        collection = json.loads(b''.join(export.geojson(self.batches, {'id': 7})))
+
+        self.assertEqual(collection['user'], {'id': 7})
+        self.assertEqual([f['geometry'] for f in collection['features']], [{'type': 'Point', 'coordinates': [-75.16, 39.95]}, None])
+        self.assertEqual(collection['features'][1]['properties']['name'], "Work, downtown")
+        self.assertEqual(json.loads(b''.join(export.geojson([[], []]))), {'type': 'FeatureCollection', 'features': []})
+
+
+class ExportViewTestCase(TestCase):
+    """Test streaming a user's export"""
+
+    def setUp(self):
+        user_cache.clear()
+        SavedSearch.query.delete()
+        User.query.delete()
+
+        user = User.signup("exportuser", "export@test.com", "password")
+        other = User.signup("otheruser", "other@test.com", "password")
+        db.session.commit()
+        self.user_id = user.id
+
+        db.session.add_all([SavedSearch(name=f"search {i}", user_id=user.id, lon=-75.16, lat=39.95) for i in range(5)])
+        db.session.add(SavedSearch(name="not mine", user_id=other.id))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get(self, query=''):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            return c.get(f'/users/{self.user_id}/export{query}')
+
+    def test_batches(self):
+        """Are rows read in batches of batch_size?"""
+
+        with app.test_request_context():
+            sizes = [len(rows) for rows in export.batches(SavedSearch.user_id == self.user_id, batch_size=2)]
+            db.session.rollback()
+
+        self.assertEqual(sizes, [2, 2, 1])
+
+    def test_export_ndjson(self):
+        """Is the user's account and only their saved searches streamed as an attachment?"""
+
+        resp = self.get()
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        self.assertIn('attachment', resp.headers['Content-Disposition'])
+        self.assertEqual(lines[0], {'user': {'id': self.user_id, 'username': "exportuser", 'email': "export@test.com"}})
+        self.assertEqual([line['name'] for line in lines[1:]], [f"search {i}" for i in range(5)])
+
+    def test_export_geojson(self):
+        """Is a GeoJSON export a FeatureCollection of the user's saved searches?"""
+
+        resp = self.get('?format=geojson')
+
+        self.assertEqual(resp.mimetype, 'application/geo+json')
+        self.assertEqual(len(json.loads(resp.get_data())['features']), 5)
+
+    def test_export_errors(self):
+        """Are unknown formats and other users' exports refused?"""
+
+        self.assertEqual(self.get('?format=xml').status_code, 400)
+        self.assertEqual(app.test_client().get(f'/users/{self.user_id}/export').status_code, 403)
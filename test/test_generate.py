@@ -0,0 +1,87 @@
+"""Synthetic data generator tests"""
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+import numpy as np
+from models import db, User, SavedSearch
+
+os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
+
+from app import app
+import generate
+import hashing
+app.config['TESTING'] = True
+
+db.create_all()
+
+
+class GenerateTestCase(TestCase):
+    """Test generate.py"""
+
+    def setUp(self):
+        SavedSearch.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_chunks_resume(self):
+        """Does a resumed run continue from the rows already done, on chunk boundaries?"""
+
+        self.assertEqual(list(generate.chunks(25, 10, 0)), [(0, 10), (10, 20), (20, 25)])
+        self.assertEqual(list(generate.chunks(25, 10, 20)), [(20, 25)])
+        self.assertEqual(list(generate.chunks(25, 10, 25)), [])
+        self.assertEqual(list(generate.chunks(45, 10, 25)), [(25, 30), (30, 40), (40, 45)])
+
+    def test_hash_pool(self):
+        """Are the hashes distinct and valid, made without going through hashing's own pool?"""
+
+        with patch('hashing.LOG_ROUNDS', 4), patch('hashing.hash_password', side_effect=AssertionError("nested pool")):
+            hashes = generate.hash_pool(3)
+
+        self.assertEqual(len(set(hashes)), 3)
+        self.assertTrue(all(hashing.bcrypt.check_password_hash(h, generate.GENERATED_PASSWORD) for h in hashes))
+
+    def test_resume_ignores_real_users(self):
+        """Do real accounts that happen to start with "user" leave the resume point alone?"""
+
+        db.session.add_all([
+            User(username="username1", email="someone@test.com", password="x"),
+            User(username="user7", email="user7@test.com", password="x"),
+        ])
+        db.session.commit()
+
+        self.assertEqual(list(generate.generate_users(3, 10, ["$2b$12$notarealhash"])), [3])
+        self.assertEqual(User.query.filter(generate.generated_users()).count(), 3)
+
+    def test_clustered_points(self):
+        """Are points generated near the metro areas?"""
+
+        lats, lons = generate.clustered_points(np.random.default_rng(0), 1000)
+
+        self.assertTrue(((lats > 24) & (lats < 50)).all())
+        self.assertTrue(((lons > -125) & (lons < -70)).all())
+
+    def test_generate_and_resume(self):
+        """Are users and saved searches copied in, without duplicates when re-run?"""
+
+        hashes = ["$2b$12$notarealhash"]
+
+        list(generate.generate_users(5, 2, hashes))
+        list(generate.generate_searches(12, 5, seed=0))
+        first = [(s.user_id, s.lat, s.lon) for s in SavedSearch.query.order_by(SavedSearch.id)]
+
+        self.assertEqual(list(generate.generate_users(5, 2, hashes)), [])
+        self.assertEqual(list(generate.generate_searches(12, 5, seed=0)), [])
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(len(first), 12)
+        self.assertEqual(User.query.filter_by(username='user5').one().email, "user5@example.com")
+
+        SavedSearch.query.filter(SavedSearch.name.in_([f"{generate.SEARCH_PREFIX} {i}" for i in range(10, 12)])).delete(synchronize_session=False)
+        db.session.commit()
+        self.assertEqual(list(generate.generate_searches(12, 5, seed=0)), [12])
+
+        again = [(s.user_id, s.lat, s.lon) for s in SavedSearch.query.order_by(SavedSearch.id)]
+        self.assertEqual(again, first)
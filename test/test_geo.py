@@ -0,0 +1,59 @@
+"""Geo distance and ranking tests"""
+
+from unittest import TestCase
+import numpy as np
+import geo
+
+# Philadelphia, New York, Pittsburgh
+LATS = np.array([39.9526, 40.7128, 40.4406])
+LONS = np.array([-75.1652, -74.0060, -79.9959])
+
+
+class GeoTestCase(TestCase):
+    """Test vectorized distance and top-k ranking"""
+
+##################################################
+# Distance Tests
+
+    def test_haversine_matches_scalar(self):
+        """Does the vectorized distance match the scalar one?"""
+
+        distances = geo.haversine(39.9526, -75.1652, LATS, LONS)
+
+        self.assertEqual(distances.shape, (3,))
+        for distance, lat, lon in zip(distances, LATS, LONS):
+            self.assertAlmostEqual(distance, geo.haversine_mi(39.9526, -75.1652, lat, lon))
+        self.assertAlmostEqual(distances[1], 80.6, places=0)
+
+    def test_haversine_many_queries(self):
+        """Do several query points give one row of distances each?"""
+
+        distances = geo.haversine(LATS, LONS, LATS, LONS)
+
+        self.assertEqual(distances.shape, (3, 3))
+        np.testing.assert_allclose(np.diag(distances), 0, atol=1e-9)
+        np.testing.assert_allclose(distances, distances.T)
+
+
+##################################################
+# Ranking Tests
+
+    def test_top_k(self):
+        """Are the k smallest returned closest first, respecting the mask?"""
+
+        distances = np.array([5.0, 1.0, 3.0, 2.0, 4.0])
+
+        self.assertEqual(geo.top_k(distances, 3).tolist(), [1, 3, 2])
+        self.assertEqual(geo.top_k(distances, 3, mask=distances != 1.0).tolist(), [3, 2, 4])
+        self.assertEqual(geo.top_k(distances, 10, mask=distances > 4).tolist(), [0])
+
+    def test_nearest(self):
+        """Does nearest rank candidates from each query point, skipping masked ones?"""
+
+        idx, distances = geo.nearest(40.0, -75.0, LATS, LONS, 2, mask=[False, True, True])
+
+        self.assertEqual(idx.tolist(), [1, 2])
+        self.assertTrue(distances[0] < distances[1])
+
+        idx, _ = geo.nearest([40.7, 40.4], [-74.0, -80.0], LATS, LONS, 1)
+        self.assertEqual(idx.tolist(), [[1], [2]])
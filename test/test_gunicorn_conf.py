@@ -0,0 +1,39 @@
+"""gunicorn settings tests"""
+
+import json
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = """
+import json, runpy
+conf = runpy.run_path('gunicorn.conf.py')
+print(json.dumps({name: conf[name] for name in ('worker_class', 'workers', 'threads', 'preload_app')}))
+"""
+
+
+class GunicornConfTestCase(TestCase):
+    """Test gunicorn.conf.py, loaded in a fresh interpreter since it changes the environment and garbage collector"""
+
+    def settings(self, **env):
+        env = {**{k: v for k, v in os.environ.items() if not k.startswith(('GUNICORN_', 'WEB_CONCURRENCY'))}, **env}
+        return subprocess.run([sys.executable, '-c', SETTINGS], cwd=ROOT, env=env, capture_output=True, text=True)
+
+    def test_workers_from_cores(self):
+        """Are workers and threads derived from the cores and worker class, unless set?"""
+
+        cores = len(os.sched_getaffinity(0))
+
+        self.assertEqual(json.loads(self.settings().stdout),
+            {'worker_class': 'gthread', 'workers': cores + 1, 'threads': 4, 'preload_app': True})
+        self.assertEqual(json.loads(self.settings(GUNICORN_WORKER_CLASS='sync').stdout),
+            {'worker_class': 'sync', 'workers': 2 * cores + 1, 'threads': 1, 'preload_app': True})
+        self.assertEqual(json.loads(self.settings(WEB_CONCURRENCY='3', GUNICORN_PRELOAD='0').stdout)['workers'], 3)
+
+    def test_unknown_worker_class(self):
+        """Is an unknown worker class refused?"""
+
+        self.assertIn("GUNICORN_WORKER_CLASS must be", self.settings(GUNICORN_WORKER_CLASS='eventlet').stderr)
@@ -0,0 +1,198 @@
+"""Background job tests"""
+
+import os
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import exc
+from models import db, User, SavedSearch, Job
+
+os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
+
+from app import app
+import geocode
+import jobs
+import restrooms
+app.config['TESTING'] = True
+
+db.create_all()
+
+
+class JobQueueTestCase(TestCase):
+    """Test the jobs queue"""
+
+    def setUp(self):
+        Job.query.delete()
+        db.session.commit()
+
+        self.calls = []
+        jobs.HANDLERS['test'] = lambda **payload: self.calls.append(payload)
+
+    def tearDown(self):
+        db.session.rollback()
+        jobs.HANDLERS.pop('test', None)
+        jobs.HANDLERS.pop('failing', None)
+        jobs.PERIODIC.pop('test', None)
+
+    def test_run(self):
+        """Is a due job claimed, run with its payload, then deleted?"""
+
+        jobs.enqueue('test', {'n': 1})
+        jobs.enqueue('test', {'n': 2}, run_at=datetime.utcnow() + timedelta(hours=1))
+        db.session.commit()
+
+        claimed = jobs.claim(10)
+
+        self.assertEqual(len(claimed), 1)
+        self.assertTrue(jobs.run(claimed[0]))
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_key(self):
+        """Is only one job queued per key?"""
+
+        self.assertIsNotNone(jobs.enqueue('test', key='once'))
+        self.assertIsNone(jobs.enqueue('test', key='once'))
+        db.session.commit()
+
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_skip_locked(self):
+        """Are jobs another worker holds skipped, and leased jobs not claimed twice?"""
+
+        first = jobs.enqueue('test', {'n': 1}, run_at=datetime.utcnow() - timedelta(seconds=1))
+        jobs.enqueue('test', {'n': 2})
+        db.session.commit()
+
+        with db.engine.connect() as conn:
+            with conn.begin():
+                conn.execute(db.text("SELECT id FROM jobs WHERE id = :id FOR UPDATE"), {'id': first})
+
+                claimed = jobs.claim(10)
+                self.assertEqual([job.payload for job in claimed], [{'n': 2}])
+
+        self.assertEqual([job.id for job in jobs.claim(10)], [first])
+        self.assertEqual(jobs.claim(10), [])
+
+    def test_expired_lease(self):
+        """Is a job whose worker went away claimed again once its lease runs out?"""
+
+        jobs.enqueue('test')
+        db.session.commit()
+        jobs.claim()
+
+        Job.query.update({'locked_until': datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+
+        claimed = jobs.claim()
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].attempts, 2)
+
+    def test_retry(self):
+        """Is a failed job retried later, and given up on after too many attempts?"""
+
+        def fail():
+            raise ValueError("upstream down")
+        jobs.HANDLERS['failing'] = fail
+
+        jobs.enqueue('failing')
+        db.session.commit()
+
+        self.assertFalse(jobs.run(jobs.claim()[0]))
+        job = Job.query.one()
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIn("upstream down", job.last_error)
+
+        Job.query.update({'run_at': datetime.utcnow(), 'attempts': jobs.MAX_ATTEMPTS - 1})
+        db.session.commit()
+        jobs.run(jobs.claim()[0])
+
+        self.assertIsNone(Job.query.one().run_at)
+        self.assertEqual(jobs.claim(), [])
+
+    def test_periodic(self):
+        """Does a periodic job queue its next run when it finishes?"""
+
+        jobs.PERIODIC['test'] = 60
+        jobs.enqueue('test', key='test')
+        db.session.commit()
+
+        jobs.run(jobs.claim()[0])
+
+        job = Job.query.one()
+        self.assertEqual(job.key, 'test')
+        self.assertGreater(job.run_at, datetime.utcnow() + timedelta(seconds=50))
+
+    def test_worker_survives_database_errors(self):
+        """Does the worker log a database error and carry on, rather than dying?"""
+
+        stop = threading.Event()
+        calls = []
+
+        def claim(limit):
+            calls.append(limit)
+            if len(calls) == 1:
+                raise exc.OperationalError("SELECT 1", {}, Exception("server closed the connection"))
+            stop.set()
+            return []
+
+        with patch('jobs.claim', side_effect=claim), patch('jobs.POLL_INTERVAL', 0), patch('builtins.print') as log:
+            jobs.work(stop)
+
+        self.assertEqual(len(calls), 2)
+        self.assertIn("server closed the connection", log.call_args[0][0])
+
+    def test_queue_metrics(self):
+        """Are queue depth and waiting time shown on /metrics?"""
+
+        jobs.enqueue('test', run_at=datetime.utcnow() - timedelta(seconds=30))
+        db.session.commit()
+
+        text = app.test_client().get('/metrics').get_data(as_text=True)
+
+        self.assertIn('jobs_ready{kind="test"} 1', text)
+        self.assertIn("jobs_oldest_waiting_seconds 3", text)
+
+
+class WarmingJobsTestCase(TestCase):
+    """Test the cache warming jobs"""
+
+    def setUp(self):
+        SavedSearch.query.delete()
+        User.query.delete()
+
+        user = User(id=123, username="jobsuser", email="jobs@test.com", password="x")
+        db.session.add(user)
+        db.session.add_all([
+            SavedSearch(user_id=123, name="a", lon=-75.1652, lat=39.9526),
+            SavedSearch(user_id=123, name="b", lon=-75.1651, lat=39.9527),
+            SavedSearch(user_id=123, name="c", lon=-75.1652, lat=39.9526, unisex=True),
+            SavedSearch(user_id=123, name="no location"),
+        ])
+        db.session.commit()
+
+        restrooms.tile_cache.clear()
+        geocode.geocode_cache.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_refresh_tiles(self):
+        """Is each saved-search tile and filter combination fetched once into the tile cache?"""
+
+        with patch('restrooms.fetch_tile', return_value=[]) as fetch_tile:
+            jobs.refresh_tiles()
+
+        tile = restrooms.tile_for(39.9526, -75.1652)
+        self.assertEqual(sorted(call.args for call in fetch_tile.call_args_list), [(tile, False, False), (tile, False, True)])
+        self.assertEqual(restrooms.tile_cache.get((tile, False, True)), [])
+
+    def test_prewarm_geocode(self):
+        """Are place names looked up once per rounded saved search location?"""
+
+        with patch('geocode.fetch_place_name', return_value="Philadelphia, PA") as fetch:
+            jobs.prewarm_geocode()
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(geocode.geocode_cache.get(geocode.cache_key(-75.1652, 39.9526)), "Philadelphia, PA")
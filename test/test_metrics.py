@@ -0,0 +1,216 @@
+"""Metrics and configuration tests"""
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy.pool import NullPool
+from models import db, User, SavedSearch
+
+os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
+
+from app import app
+from views import CURR_USER_KEY
+import config
+import metrics
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.create_all()
+
+
+def sample(text, name):
+    """Value of the named sample in Prometheus text, or 0 if absent"""
+
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.split()[-1])
+    return 0
+
+
+class EngineOptionsTestCase(TestCase):
+    """Test database engine configuration"""
+
+    def test_defaults(self):
+        """Is a pre-pinged, instrumented queue pool used by default?"""
+
+        with patch.dict(os.environ, {}, clear=True):
+            options = config.engine_options()
+
+        self.assertIs(options['poolclass'], metrics.InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 5)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertNotIn('connect_args', options)
+
+    def test_env(self):
+        """Are pool settings read from the environment?"""
+
+        env = {'DB_POOL_SIZE': '2', 'DB_MAX_OVERFLOW': '0', 'DB_POOL_PRE_PING': 'off', 'DB_STATEMENT_TIMEOUT': '5000'}
+        with patch.dict(os.environ, env, clear=True):
+            options = config.engine_options()
+
+        self.assertEqual((options['pool_size'], options['max_overflow']), (2, 0))
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': "-c statement_timeout=5000"})
+
+    def test_pgbouncer(self):
+        """Is pooling left to PgBouncer?"""
+
+        with patch.dict(os.environ, {'DB_PGBOUNCER': '1', 'DB_STATEMENT_TIMEOUT': '5000'}, clear=True):
+            self.assertEqual(config.engine_options(), {'poolclass': NullPool})
+
+    def test_database_uri(self):
+        """Is Heroku's postgres:// scheme fixed?"""
+
+        with patch.dict(os.environ, {'DATABASE_URL': "postgres://u:p@host/db"}):
+            self.assertEqual(config.database_uri(), "postgresql://u:p@host/db")
+
+
+class MetricsViewTestCase(TestCase):
+    """Test /metrics"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_pool_metrics(self):
+        """Are pool checkouts counted and shown?"""
+
+        before = metrics.pool_stats.checkouts
+        db.session.execute(db.text("SELECT 1"))
+        db.session.commit()
+
+        html = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertGreater(metrics.pool_stats.checkouts, before)
+        self.assertIn("# TYPE db_pool_checked_out gauge", html)
+        self.assertIn("db_pool_checkouts_total", html)
+
+    def test_metrics_token(self):
+        """Is a bearer token required when METRICS_TOKEN is set?"""
+
+        with patch.dict(os.environ, {'METRICS_TOKEN': "secret"}):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            resp = self.client.get('/metrics', headers={'Authorization': "Bearer secret"})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_request_metrics(self):
+        """Are latency, SQL statements and database time recorded per route?"""
+
+        SavedSearch.query.delete()
+        User.query.delete()
+        user = User.signup("metricsuser", "metrics@test.com", "password")
+        db.session.commit()
+        user_id = user.id
+
+        route = 'route="/users/<int:user_id>",method="GET"'
+        count = f'http_request_duration_seconds_count{{{route}}}'
+        queries = f'http_request_db_queries_bucket{{{route},le="+Inf"}}'
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            before = c.get('/metrics').get_data(as_text=True)
+            c.get(f'/users/{user_id}')
+            c.get(f'/users/{user_id}')
+            after = c.get('/metrics').get_data(as_text=True)
+
+        self.assertEqual(sample(after, count) - sample(before, count), 2)
+        self.assertEqual(sample(after, queries) - sample(before, queries), 2)
+        self.assertIn(f'http_request_db_seconds_sum{{{route}}}', after)
+
+    def test_async_request_metrics(self):
+        """Are the async API routes timed under the same labels as the sync ones?"""
+
+        import asyncio
+        import asgi
+
+        count = 'http_request_duration_seconds_count{route="/api/restrooms",method="GET"}'
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/restrooms', 'query_string': b'', 'headers': []}
+
+        async def send(message):
+            pass
+
+        before = self.client.get('/metrics').get_data(as_text=True)
+        asyncio.run(asgi.app(scope, None, send))
+        after = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertEqual(sample(after, count) - sample(before, count), 1)
+
+    def test_upstream_metrics(self):
+        """Are upstream calls timed per service?"""
+
+        with patch('upstream.session.get', return_value=None):
+            import upstream
+            upstream.get('mapbox', "https://api.mapbox.com/")
+
+        html = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertIn('upstream_request_duration_seconds_count{service="mapbox"}', html)
+
+
+class HistogramTestCase(TestCase):
+    """Test Histogram"""
+
+    def test_cumulative_buckets(self):
+        """Are bucket counts cumulative, with sum and count per label set?"""
+
+        histogram = metrics.Histogram('test_seconds', "Test.", ('route',), buckets=(0.1, 1))
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.5, '/a')
+        histogram.observe(5, '/a')
+
+        lines = []
+        histogram.render(lines)
+
+        self.assertEqual(lines[2:], [
+            'test_seconds_bucket{route="/a",le="0.1"} 1',
+            'test_seconds_bucket{route="/a",le="1"} 2',
+            'test_seconds_bucket{route="/a",le="+Inf"} 3',
+            'test_seconds_sum{route="/a"} 5.55',
+            'test_seconds_count{route="/a"} 3',
+        ])
+
+
+class QueryBudgetTestCase(TestCase):
+    """Test query_budget"""
+
+    def test_within_budget(self):
+        """Are statements recorded without raising when under budget?"""
+
+        with metrics.query_budget(db.engine, max_queries=2) as budget:
+            db.session.execute(db.text("SELECT 1"))
+            db.session.commit()
+
+        self.assertEqual(len(budget.statements), 1)
+
+    def test_over_budget(self):
+        """Is QueryBudgetExceeded raised, listing the statements run?"""
+
+        with self.assertRaises(metrics.QueryBudgetExceeded) as cm:
+            with metrics.query_budget(db.engine, max_queries=1):
+                db.session.execute(db.text("SELECT 1"))
+                db.session.execute(db.text("SELECT 2"))
+                db.session.commit()
+
+        self.assertIn("2 SQL statements, budget is 1", str(cm.exception))
+        self.assertIn("SELECT 2", str(cm.exception))
+
+    def test_slow_statement(self):
+        """Are statements over the per-statement time budget reported?"""
+
+        with self.assertRaises(metrics.QueryBudgetExceeded) as cm:
+            with metrics.query_budget(db.engine, max_statement_seconds=0.01):
+                db.session.execute(db.text("SELECT pg_sleep(0.05)"))
+                db.session.commit()
+
+        self.assertIn("1 statements slower than 0.01s", str(cm.exception))
+
+    def test_decorator(self):
+        """Does the decorator form check each call?"""
+
+        @metrics.query_budget(db.engine, max_queries=0)
+        def lookup():
+            return User.query.count()
+
+        with self.assertRaises(metrics.QueryBudgetExceeded):
+            lookup()
@@ -0,0 +1,94 @@
+"""Restroom model tests"""
+
+import os
+from unittest import TestCase
+from models import db, Restroom, grid_cell
+
+os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
+
+from app import app
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.create_all()
+
+
+def listing(id, lat, lon, **filters):
+    """Refuge Restrooms style listing"""
+
+    return dict({
+        'id': id,
+        'name': f"Restroom {id}",
+        'street': "1 Main St",
+        'city': "Philadelphia",
+        'state': "PA",
+        'latitude': lat,
+        'longitude': lon,
+        'created_at': "2022-01-01T00:00:00.000Z",
+        'updated_at': "2022-02-01T00:00:00.000Z",
+    }, **filters)
+
+
+class RestroomModelTestCase(TestCase):
+    """Test Restroom model"""
+
+    def setUp(self):
+        """Add sample restrooms around Philadelphia"""
+
+        Restroom.query.delete()
+
+        listings = [
+            listing(1, 39.9545, -75.1650, accessible=True),
+            listing(2, 39.9600, -75.1700, unisex=True, changing_table=True),
+            listing(3, 39.9000, -75.2000, accessible=True, unisex=True),
+            listing(4, 40.2000, -75.1000, changing_table=True),
+        ]
+        db.session.execute(Restroom.__table__.insert(), [Restroom.row_from_api(l) for l in listings])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+##################################################
+# Basic model Tests
+
+    def test_row_from_api(self):
+        """Does a Refuge Restrooms listing map to columns, including its grid cell?"""
+
+        row = Restroom.row_from_api(listing(5, 39.95, -75.16))
+
+        self.assertEqual(row['grid_cell'], grid_cell(39.95, -75.16))
+        self.assertFalse(row['changing_table'])
+
+    def test_serialize(self):
+        """Does serialize match the shape of the Refuge Restrooms API?"""
+
+        data = Restroom.query.get(1).serialize()
+
+        self.assertEqual(data['name'], "Restroom 1")
+        self.assertTrue(data['accessible'])
+        self.assertEqual(data['created_at'][:10], "2022-01-01")
+
+
+##################################################
+# Nearest neighbour Tests
+
+    def test_nearest_order(self):
+        """Are the nearby restrooms returned closest first with distances?"""
+
+        results = Restroom.nearest(39.9543, -75.1650, k=3)
+
+        self.assertEqual([r.id for r, _ in results], [1, 2, 3])
+        self.assertLess(results[0][1], 0.1)
+
+    def test_nearest_filters(self):
+        """Are the accessible, unisex and changing table filters applied?"""
+
+        self.assertEqual([r.id for r, _ in Restroom.nearest(39.9543, -75.1650, accessible=True)], [1, 3])
+        self.assertEqual([r.id for r, _ in Restroom.nearest(39.9543, -75.1650, unisex=True, changing_table=True)], [2])
+
+    def test_nearest_widens_search(self):
+        """Is the search widened when too few restrooms are close by, and bounded by max_ring?"""
+
+        self.assertEqual([r.id for r, _ in Restroom.nearest(39.9543, -75.1650, changing_table=True)], [2, 4])
+        self.assertEqual([r.id for r, _ in Restroom.nearest(39.9543, -75.1650, changing_table=True, max_ring=2)], [2])
@@ -3,10 +3,12 @@
 import os
 from unittest import TestCase
 from sqlalchemy import exc
-from models import db, User, SavedSearch
+from models import db, User, SavedSearch, SavedSearchRow, grid_cell
 
 os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
 
+from metrics import query_budget
+import encoding
 from app import app
 app.config['TESTING'] = True
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
@@ -64,6 +66,12 @@ class SavedSearchModelTestCase(TestCase):
         self.assertEqual("<SavedSearch - id: 222, user_id: 111, name: testSavedSearch>", repr(self.s1))
         self.assertNotEqual("<SavedSearch - id: 999, user_id: 788, name: wronganswerbuddy>", repr(self.s1))
 
+    def test_savedsearch_model_repr_queries(self):
+        """Does repr only refresh the saved search, without loading its user?"""
+
+        with query_budget(db.engine, max_queries=1):
+            repr(self.s1)
+
 
 ##################################################
 # Serialize Tests    
@@ -94,4 +102,89 @@ class SavedSearchModelTestCase(TestCase):
             'accessible': False,
             'unisex': False,
             'changing_table': True,
-        }, SavedSearch.serialize(self.s1))
\ No newline at end of file
+        }, SavedSearch.serialize(self.s1))
+
+    def test_read(self):
+        """Does SavedSearch.read return rows serializing like SavedSearch.serialize, without building ORM objects?"""
+
+        expected = self.s1.serialize()
+        db.session.expunge_all()
+
+        with query_budget(db.engine, max_queries=1):
+            rows = SavedSearch.read(SavedSearch.user_id == 111)
+
+        self.assertEqual(rows, [SavedSearchRow(222, 111, "testSavedSearch", "search-string", 75.245, 35.475, True, True, False)])
+        self.assertEqual(rows[0].serialize(), expected)
+        self.assertEqual(encoding.dumps(rows[0]), encoding.dumps(expected))
+        self.assertEqual(len(db.session.identity_map), 0)
+        self.assertEqual(SavedSearch.read(SavedSearch.user_id == 999), [])
+
+    def test_clean_coordinates(self):
+        """Are coordinates off the map or not finite refused?"""
+
+        self.assertEqual(SavedSearch.clean({'name': "edge", 'lat': -90, 'lon': 180}), {'name': "edge", 'lat': -90, 'lon': 180})
+
+        for field, value in (('lat', 1e300), ('lat', 90.5), ('lon', -181), ('lon', float('nan')), ('lat', float('inf')), ('lon', True)):
+            with self.assertRaisesRegex(ValueError, f"invalid {field}"):
+                SavedSearch.clean({'name': "bad", field: value})
+
+
+##################################################
+# Pagination Tests
+
+    def test_page_for_user(self):
+        """Are saved searches paged in id order, with next_after pointing at the following page?"""
+
+        for i in range(1, 6):
+            db.session.add(SavedSearch(id=222 + i, user_id=111, name=f"search{i}"))
+        db.session.commit()
+
+        rows, next_after = SavedSearch.page_for_user(111, limit=4)
+        self.assertEqual([row.id for row in rows], [222, 223, 224, 225])
+        self.assertEqual(rows[0].name, "testSavedSearch")
+        self.assertEqual(next_after, 225)
+
+        rows, next_after = SavedSearch.page_for_user(111, after_id=next_after, limit=4)
+        self.assertEqual([row.id for row in rows], [226, 227])
+        self.assertIsNone(next_after)
+
+    def test_page_for_user_other_user(self):
+        """Are only the given user's saved searches listed?"""
+
+        rows, next_after = SavedSearch.page_for_user(999)
+
+        self.assertEqual(rows, [])
+        self.assertIsNone(next_after)
+
+##################################################
+# Near Tests
+
+    def test_near(self):
+        """Are saved searches within the radius returned closest first, with their distances?"""
+
+        db.session.add_all([
+            SavedSearch(id=301, user_id=111, name="city hall", lon=-75.1636, lat=39.9526),
+            SavedSearch(id=302, user_id=111, name="3 mi north", lon=-75.1636, lat=39.9960),
+            SavedSearch(id=303, user_id=111, name="20 mi west", lon=-75.5400, lat=39.9526),
+            SavedSearch(id=304, user_id=111, name="no location"),
+        ])
+        db.session.commit()
+
+        with query_budget(db.engine, max_queries=1):
+            results = SavedSearch.near(-75.1650, 39.9530, 5)
+
+        self.assertEqual([s.id for s, _ in results], [301, 302])
+        self.assertLess(results[0][1], 0.1)
+        self.assertAlmostEqual(results[1][1], 3, delta=0.1)
+
+        self.assertEqual([s.id for s, _ in SavedSearch.near(-75.1650, 39.9530, 50, limit=2)], [301, 302])
+        self.assertEqual(len(SavedSearch.near(-75.1650, 39.9530, 50)), 3)
+
+    def test_grid_cell(self):
+        """Does the database compute the same grid cell as grid_cell()?"""
+
+        db.session.add(SavedSearch(id=305, user_id=111, name="cell", lon=-75.1636, lat=39.9526))
+        db.session.commit()
+
+        self.assertEqual(SavedSearch.query.get(305).grid_cell, grid_cell(39.9526, -75.1636))
+        self.assertEqual(SavedSearch.query.get(222).grid_cell, grid_cell(35.475, 75.245))
@@ -0,0 +1,427 @@
+"""SavedSearch view tests."""
+
+
+import asyncio
+import os
+import re
+import time
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+import httpx
+import orjson
+from sqlalchemy import event
+from models import db, User, SavedSearch
+
+os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
+
+from metrics import query_budget
+from app import app
+from views import CURR_USER_KEY, user_cache
+import snapshots
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.create_all()
+
+class SavedSearchViewTestCase(TestCase):
+    """Test saved search views"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        user_cache.clear()
+        SavedSearch.query.delete()
+        User.query.delete()
+
+        u1 = User.signup(
+            email="test1@test.com",
+            username="testuser1",
+            password="password",
+        )
+        u1.id = 123
+
+        u2 = User.signup(
+            email="test2@test.com",
+            username="testuser2",
+            password="password",
+        )
+        u2.id = 456
+
+        s1 = SavedSearch(id=11, user_id=123, name="home", lon=-75.16, lat=39.95)
+        s2 = SavedSearch(id=22, user_id=456, name="not yours")
+
+        db.session.add_all([s1, s2])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        db.session.rollback()
+
+    def login(self, c, user_id=123):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+
+##################################################
+# Batch Tests
+
+    def test_batch_add(self):
+        """Are valid saved searches created in order, with invalid ones reported per item?"""
+
+        with self.client as c:
+            self.login(c)
+
+            items = [
+                {"name": "work", "query_string": "Market St", "lon": -75.15, "lat": 39.95, "accessible": True},
+                {"query_string": "no name"},
+                {"name": "gym", "unisex": True},
+                {"name": "far away", "lon": 2, "lat": 1e300},
+            ]
+            with query_budget(db.engine, max_queries=2):
+                resp = c.post('/search/batch/add', json={"saved_searches": items})
+            results = resp.json['results']
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([r['status'] for r in results], [201, 400, 201, 400])
+            self.assertEqual(results[3]['error'], "invalid lat")
+            self.assertEqual(results[0]['saved_search']['name'], "work")
+            self.assertTrue(results[0]['saved_search']['accessible'])
+            self.assertEqual(results[1]['error'], "name is required")
+            self.assertTrue(results[2]['saved_search']['unisex'])
+            self.assertEqual(SavedSearch.query.filter_by(user_id=123).count(), 3)
+
+    def test_batch_fetch(self):
+        """Are only the user's own saved searches returned?"""
+
+        with self.client as c:
+            self.login(c)
+
+            with query_budget(db.engine, max_queries=2):
+                results = c.get('/search/batch?ids=11,22,99').json['results']
+
+            self.assertEqual([r['status'] for r in results], [200, 404, 404])
+            self.assertEqual(results[0]['saved_search']['name'], "home")
+
+    def test_batch_edit(self):
+        """Are changes applied to the user's own saved searches only?"""
+
+        with self.client as c:
+            self.login(c)
+
+            items = [{"id": 11, "name": "new home", "changing_table": True}, {"id": 22, "name": "mine now"}, {"id": 11, "lat": "north"}, {"id": True, "name": "x"}]
+            with query_budget(db.engine, max_queries=3):
+                results = c.post('/search/batch/edit', json={"saved_searches": items}).json['results']
+
+            self.assertEqual([r['status'] for r in results], [200, 404, 400, 400])
+            self.assertEqual(results[3]['error'], "id is required")
+            self.assertEqual(results[0]['saved_search']['name'], "new home")
+            self.assertEqual(results[0]['saved_search']['lon'], -75.16)
+
+            self.assertEqual(SavedSearch.query.get(11).name, "new home")
+            self.assertTrue(SavedSearch.query.get(11).changing_table)
+            self.assertEqual(SavedSearch.query.get(22).name, "not yours")
+
+    def test_batch_delete(self):
+        """Are only the user's own saved searches deleted?"""
+
+        with self.client as c:
+            self.login(c)
+
+            with query_budget(db.engine, max_queries=2):
+                results = c.post('/search/batch/delete', json={"ids": [11, 22]}).json['results']
+
+            self.assertEqual(results, [{'status': 200, 'id': 11}, {'status': 404, 'id': 22}])
+            self.assertIsNone(SavedSearch.query.get(11))
+            self.assertEqual(c.post('/search/batch/delete', json={"ids": [True]}).status_code, 400)
+            self.assertIsNotNone(SavedSearch.query.get(22))
+
+    def test_batch_requires_login(self):
+        """Are batch requests without a user refused?"""
+
+        with self.client as c:
+            with query_budget(db.engine, max_queries=0):
+                resp = c.post('/search/batch/delete', json={"ids": [11]})
+
+            self.assertEqual(resp.status_code, 401)
+            self.assertIsNotNone(SavedSearch.query.get(11))
+
+    def test_batch_body_not_object(self):
+        """Are JSON bodies that aren't objects refused rather than erroring?"""
+
+        with self.client as c:
+            self.login(c)
+
+            for path in ('/search/batch/add', '/search/batch/edit', '/search/batch/delete'):
+                for body in ([1, 2], "ids", 7):
+                    resp = c.post(path, json=body)
+                    self.assertEqual(resp.status_code, 400)
+                    self.assertEqual(resp.json['detail'], "request body must be a JSON object")
+
+            self.assertIsNotNone(SavedSearch.query.get(11))
+
+    def test_batch_sync_500(self):
+        """Can 500 saved searches be created, fetched, edited and deleted in well under a second each?"""
+
+        with self.client as c:
+            self.login(c)
+            items = [{"name": f"search {i}", "lon": -75 + i / 1000, "lat": 40.0} for i in range(500)]
+
+            start = time.perf_counter()
+            with query_budget(db.engine, max_queries=2):
+                results = c.post('/search/batch/add', json={"saved_searches": items}).json['results']
+            ids = [r['saved_search']['id'] for r in results]
+            with query_budget(db.engine, max_queries=1):
+                c.get(f"/search/batch?ids={','.join(map(str, ids))}")
+            with query_budget(db.engine, max_queries=2):
+                c.post('/search/batch/edit', json={"saved_searches": [{"id": id, "unisex": True} for id in ids]})
+            with query_budget(db.engine, max_queries=1):
+                results = c.post('/search/batch/delete', json={"ids": ids}).json['results']
+            elapsed = time.perf_counter() - start
+
+            self.assertTrue(all(r['status'] == 200 for r in results))
+            self.assertLess(elapsed, 2)
+
+
+##################################################
+# Snapshot Tests
+
+    RESULTS = [{'id': 1, 'name': "City Hall", 'distance': 0.1, 'latitude': 39.95, 'longitude': -75.16, 'country': "US"}]
+
+    def test_results_refreshed_when_stale(self):
+        """Is a missing snapshot taken on request, then served from the saved search without another upstream search?"""
+
+        with self.client as c:
+            self.login(c)
+
+            self.assertIsNone(c.get('/search/11').json['snapshot'])
+
+            with patch('restrooms.search', return_value=self.RESULTS) as search:
+                resp = c.get('/search/11/results')
+                again = c.get('/search/11/results')
+
+            self.assertEqual(search.call_count, 1)
+            self.assertTrue(resp.json['changed'])
+            self.assertEqual(resp.json['snapshot']['restrooms'][0]['name'], "City Hall")
+            self.assertNotIn('country', resp.json['snapshot']['restrooms'][0])
+            self.assertEqual(again.json, {'changed': False})
+
+            snapshot = c.get('/search/11').json['snapshot']
+            self.assertFalse(snapshot['stale'])
+            self.assertEqual(snapshot['restrooms'], resp.json['snapshot']['restrooms'])
+
+    def test_results_stale_after_edit(self):
+        """Does changing a saved search's filters make its snapshot stale?"""
+
+        with self.client as c:
+            self.login(c)
+
+            with patch('restrooms.search', return_value=self.RESULTS):
+                c.get('/search/11/results')
+            c.post('/search/batch/edit', json={"saved_searches": [{"id": 11, "unisex": True}]})
+
+            self.assertTrue(c.get('/search/11').json['snapshot']['stale'])
+
+            with patch('restrooms.search', return_value=self.RESULTS) as search:
+                self.assertEqual(c.get('/search/11/results').json, {'changed': False})
+
+            self.assertTrue(search.call_args.kwargs['unisex'])
+
+    def test_results_other_user(self):
+        """Are other users' saved search results refused?"""
+
+        with self.client as c:
+            self.login(c)
+
+            with patch('restrooms.search', return_value=self.RESULTS) as search:
+                resp = c.get('/search/22/results')
+
+            self.assertEqual(resp.status_code, 403)
+            search.assert_not_called()
+
+    def test_refresh_stale(self):
+        """Are missing and expired snapshots refreshed in the background, skipping searches without a location?"""
+
+        with patch('restrooms.search', return_value=self.RESULTS) as search:
+            self.assertEqual(snapshots.refresh_stale(), 1)
+            self.assertEqual(snapshots.refresh_stale(), 0)
+
+            SavedSearch.query.get(11).snapshot_at -= timedelta(seconds=snapshots.SNAPSHOT_TTL)
+            db.session.commit()
+            self.assertEqual(snapshots.refresh_stale(), 1)
+
+        self.assertEqual(search.call_count, 2)
+
+    def test_refresh_stale_queries(self):
+        """Are stale searches loaded with their snapshots in one query, then each saved with one update?"""
+
+        db.session.add_all([SavedSearch(user_id=123, name=f"search {i}", lon=-75.16, lat=39.95) for i in range(3)])
+        db.session.commit()
+        db.session.expunge_all()
+
+        with patch('restrooms.search', return_value=self.RESULTS):
+            with query_budget(db.engine, max_queries=5):
+                self.assertEqual(snapshots.refresh_stale(), 4)
+
+
+##################################################
+# HTTP Caching Tests
+
+    def test_search_conditional_get(self):
+        """Is an unchanged saved search answered 304, and a changed one sent again with a new ETag?"""
+
+        with self.client as c:
+            self.login(c)
+
+            resp = c.get('/search/11')
+            etag = resp.headers['ETag']
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+
+            statements = []
+            record = lambda conn, cursor, statement, *args: statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                unchanged = c.get('/search/11', headers={'If-None-Match': etag})
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            since = c.get('/search/11', headers={'If-Modified-Since': resp.headers['Last-Modified']})
+
+            self.assertEqual(unchanged.status_code, 304)
+            # Answering 304 doesn't load the snapshot
+            self.assertFalse(any(re.search(r'saved_searches\.snapshot\b(?!_at)', statement) for statement in statements), statements)
+            self.assertEqual(unchanged.get_data(), b"")
+            self.assertEqual(since.status_code, 304)
+
+            c.post('/search/batch/edit', json={"saved_searches": [{"id": 11, "name": "new home"}]})
+            changed = c.get('/search/11', headers={'If-None-Match': etag})
+
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed.headers['ETag'], etag)
+            self.assertEqual(changed.json['saved_search']['name'], "new home")
+
+    def test_search_modified_when_snapshot_expires(self):
+        """Does an expiring snapshot move Last-Modified, so If-Modified-Since alone gets the stale flag?"""
+
+        with self.client as c:
+            self.login(c)
+
+            with patch('restrooms.search', return_value=self.RESULTS):
+                c.get('/search/11/results')
+            db.session.execute(db.update(SavedSearch).where(SavedSearch.id == 11).values(
+                snapshot_at=SavedSearch.snapshot_at - timedelta(hours=2),
+                updated_at=SavedSearch.updated_at - timedelta(hours=2)))
+            db.session.commit()
+
+            with patch('snapshots.SNAPSHOT_TTL', 3 * 3600):
+                fresh = c.get('/search/11')
+            with patch('snapshots.SNAPSHOT_TTL', 3600):
+                expired = c.get('/search/11', headers={'If-Modified-Since': fresh.headers['Last-Modified']})
+                again = c.get('/search/11', headers={'If-Modified-Since': expired.headers['Last-Modified']})
+
+            self.assertFalse(fresh.json['snapshot']['stale'])
+            self.assertEqual(expired.status_code, 200)
+            self.assertTrue(expired.json['snapshot']['stale'])
+            self.assertEqual(again.status_code, 304)
+
+    def test_user_searches_conditional_get(self):
+        """Is an unchanged page of saved searches answered 304 until one is added?"""
+
+        with self.client as c:
+            self.login(c)
+
+            etag = c.get('/users/123/searches').headers['ETag']
+            self.assertEqual(c.get('/users/123/searches', headers={'If-None-Match': etag}).status_code, 304)
+
+            c.post('/search/batch/add', json={"saved_searches": [{"name": "work"}]})
+            resp = c.get('/users/123/searches', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(resp.json['searches']), 2)
+
+    def test_restrooms_conditional_get(self):
+        """Are restroom results publicly cacheable, and answered 304 when unchanged?"""
+
+        with patch('restrooms.search', return_value=self.RESULTS):
+            resp = self.client.get('/api/restrooms?lat=39.95&lon=-75.16')
+            again = self.client.get('/api/restrooms?lat=39.95&lon=-75.16', headers={'If-None-Match': resp.headers['ETag']})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("public, max-age=", resp.headers['Cache-Control'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_restrooms_bad_coordinates(self):
+        """Are coordinates that aren't finite or are off the map refused, by the sync and async routes?"""
+
+        import asgi
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        for query in ('lat=nan&lon=2', 'lat=39.95&lon=inf', 'lat=95&lon=2'):
+            self.assertEqual(self.client.get(f'/api/restrooms?{query}').status_code, 400)
+            asyncio.run(asgi.get_restrooms({'type': 'http', 'query_string': query.encode(), 'headers': []}, None, send))
+            self.assertEqual(sent[-2]['status'], 400)
+
+    def test_reverse_geocode_bad_body(self):
+        """Are bodies that aren't JSON, or lack numeric lon and lat, refused by the sync and async routes?"""
+
+        import asgi
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        for body in (b'{"lon": ', b'{"lat": 39.95}', b'[1, 2]', b'{"lon": "east", "lat": 39.95}', b'{"lon": -75.16, "lat": 95}'):
+            resp = self.client.post('/api/reverse-geocode', data=body, content_type='application/json')
+            self.assertEqual(resp.status_code, 400)
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            asyncio.run(asgi.get_reverse_geocode({'type': 'http', 'headers': []}, receive, send))
+            self.assertEqual(sent[-2]['status'], 400)
+            self.assertEqual(orjson.loads(sent[-1]['body']), resp.json)
+
+    def test_async_routes(self):
+        """Do the async routes answer from a stubbed upstream like the sync routes do?"""
+
+        import asgi
+        import geocode
+        import restrooms
+
+        geocode.geocode_cache.clear()
+        restrooms.tile_cache.clear()
+
+        upstream = {
+            'mapbox': {'features': [{'place_name': "Philadelphia, PA"}]},
+            'refuge': [{**self.RESULTS[0], 'changing_table': False}],
+        }
+
+        async def get_async(service, url, **kwargs):
+            return httpx.Response(200, json=upstream[service], request=httpx.Request('GET', url))
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'{"lon": -75.16, "lat": 39.95}', 'more_body': False}
+
+        with patch('upstream.get_async', get_async), patch('restrooms.SOURCE', 'refuge'), patch.object(geocode.rate_limiter, 'acquire', return_value=True):
+            asyncio.run(asgi.get_reverse_geocode({'type': 'http', 'headers': []}, receive, send))
+            self.assertEqual(sent[-2]['status'], 200)
+            self.assertEqual(orjson.loads(sent[-1]['body']), {'result': "Philadelphia, PA"})
+
+            asyncio.run(asgi.get_restrooms({'type': 'http', 'query_string': b'lat=39.95&lon=-75.16', 'headers': []}, None, send))
+            self.assertEqual(sent[-2]['status'], 200)
+            self.assertIn((b'cache-control', f"public, max-age={restrooms.CACHE_MAX_AGE}".encode()), sent[-2]['headers'])
+            self.assertEqual([r['name'] for r in orjson.loads(sent[-1]['body'])['restrooms']], ["City Hall"])
@@ -3,8 +3,10 @@
 
 import os
 from unittest import TestCase
-from sqlalchemy import exc
+from unittest.mock import patch
+from sqlalchemy import exc, event
 from models import db, User, SavedSearch
+import hashing
 
 os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
 
@@ -129,4 +131,46 @@ class UserModelTestCase(TestCase):
     def test_invalid_password(self):
         """Does User.authenticate fail with an incorrect password?"""
 
-        self.assertFalse(User.authenticate(self.u1.username, "wrongpassword"))
\ No newline at end of file
+        self.assertFalse(User.authenticate(self.u1.username, "wrongpassword"))
+
+    def test_authenticate_single_query(self):
+        """Does User.authenticate look the user up in one query?"""
+
+        email = self.u1.email
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            User.authenticate(email, "password")
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(len(statements), 1)
+
+    def test_username_precedence(self):
+        """Does a username match take precedence over another user's email?"""
+
+        User.signup("test2@test.com", "other@test.com", "otherpassword")
+        db.session.commit()
+
+        self.assertEqual(User.authenticate("test2@test.com", "otherpassword").email, "other@test.com")
+        self.assertFalse(User.authenticate("test2@test.com", "password"))
+
+    def test_check_password(self):
+        """Does check_password verify against the user's own hash?"""
+
+        self.assertTrue(self.u1.check_password("password"))
+        self.assertFalse(self.u1.check_password("wrongpassword"))
+
+    def test_rehash_on_login(self):
+        """Is the password rehashed at the configured cost when it changes?"""
+
+        self.assertFalse(hashing.needs_rehash(self.u1.password))
+
+        with patch('hashing.LOG_ROUNDS', 4):
+            user = User.authenticate(self.u1.username, "password")
+            db.session.commit()
+
+        self.assertTrue(user.password.startswith("$2b$04$"))
+        self.assertTrue(user.check_password("password"))
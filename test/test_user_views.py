@@ -2,13 +2,17 @@
 
 
 import os
+import threading
 from unittest import TestCase
-from sqlalchemy import exc
+from unittest.mock import patch
+from sqlalchemy import exc, event
 from models import db, User, SavedSearch
 
 os.environ['DATABASE_URL'] = "postgresql:///flusher-test"
 
-from app import app, CURR_USER_KEY, AUTH_ERROR
+from metrics import query_budget
+from app import app
+from views import CURR_USER_KEY, AUTH_ERROR, BUSY_ERROR, user_cache
 app.config['TESTING'] = True
 app.config['WTF_CSRF_ENABLED'] = False
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
@@ -21,6 +25,7 @@ class UserViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        user_cache.clear()
         User.query.delete()
         SavedSearch.query.delete()
 
@@ -56,7 +61,8 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             
-            resp = c.get('/', follow_redirects=True)
+            with query_budget(db.engine, max_queries=0):
+                resp = c.get('/', follow_redirects=True)
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
@@ -71,7 +77,8 @@ class UserViewTestCase(TestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.u1.id
             
-            resp = c.get('/', follow_redirects=True)
+            with query_budget(db.engine, max_queries=1):
+                resp = c.get('/', follow_redirects=True)
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
@@ -79,6 +86,65 @@ class UserViewTestCase(TestCase):
             self.assertNotIn('<div class="landing-container">', html)
 
 
+##################################################
+# Current User Tests
+
+    def test_session_user_no_query(self):
+        """Is a logged in user recognized from the user cache without querying the users table?"""
+
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+
+            c.get('/search')
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = c.get('/search')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f'href="/users/{self.u1.id}"', resp.get_data(as_text=True))
+            self.assertEqual(statements, [])
+
+    def test_cached_user_deleted(self):
+        """Is a session logged out once its user is deleted, even though the user was cached?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+
+            c.get('/search')
+            self.assertEqual(user_cache.get(self.u1.id), {'id': 123, 'username': "testuser1"})
+
+            c.post(f'/users/{self.u1.id}/delete')
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 123
+
+            resp = c.get('/', follow_redirects=True)
+
+            self.assertIn('<div class="landing-container">', resp.get_data(as_text=True))
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+    def test_session_deleted_user(self):
+        """Is a session for a user that no longer exists logged out?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 999
+
+            with query_budget(db.engine, max_queries=1):
+                resp = c.get('/', follow_redirects=True)
+
+            self.assertIn('<div class="landing-container">', resp.get_data(as_text=True))
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+
 ##################################################
 # User Profile Tests
 
@@ -103,7 +169,8 @@ class UserViewTestCase(TestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.u1.id
             
-            resp = c.get(f'/users/456', follow_redirects=True)
+            with query_budget(db.engine, max_queries=1):
+                resp = c.get(f'/users/456', follow_redirects=True)
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
@@ -111,6 +178,40 @@ class UserViewTestCase(TestCase):
             self.assertNotIn(f"<h1>Hi, {self.u1.username}</h1>", html)  
     
     
+    def test_user_profile_searches(self):
+        """Does the profile list saved searches a page at a time, with the rest available as JSON?"""
+
+        u1_id, u2_id = self.u1.id, self.u2.id
+
+        for i in range(SavedSearch.PAGE_SIZE + 2):
+            db.session.add(SavedSearch(user_id=u1_id, name=f"search-{i:03}"))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u1_id
+
+            with query_budget(db.engine, max_queries=2):
+                html = c.get(f'/users/{u1_id}').get_data(as_text=True)
+
+            self.assertIn("search-000", html)
+            self.assertNotIn(f"search-{SavedSearch.PAGE_SIZE:03}", html)
+            self.assertIn('id="load-more-searches"', html)
+
+            with query_budget(db.engine, max_queries=1):
+                first = c.get(f'/users/{u1_id}/searches').json
+            with query_budget(db.engine, max_queries=1):
+                rest = c.get(f'/users/{u1_id}/searches?after={first["next_after"]}').json
+
+            self.assertEqual(len(first['searches']), SavedSearch.PAGE_SIZE)
+            self.assertEqual([s['name'] for s in rest['searches']], [f"search-{SavedSearch.PAGE_SIZE:03}", f"search-{SavedSearch.PAGE_SIZE + 1:03}"])
+            self.assertIsNone(rest['next_after'])
+
+            with query_budget(db.engine, max_queries=0):
+                resp = c.get(f'/users/{u2_id}/searches')
+            self.assertEqual(resp.status_code, 403)
+
+
     def test_edit_page(self):
         """Does edit profile page render?"""
 
@@ -177,7 +278,8 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             
-            resp = c.get('/signup')
+            with query_budget(db.engine, max_queries=0):
+                resp = c.get('/signup')
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
@@ -191,7 +293,8 @@ class UserViewTestCase(TestCase):
         with self.client as c:
             
             form_data = {"username":"new-user", "email":"new-user@email.com","password":"new-password"}
-            resp = c.post("/signup", data=form_data, follow_redirects=True)
+            with query_budget(db.engine, max_queries=1):
+                resp = c.post("/signup", data=form_data, follow_redirects=True)
             html = resp.get_data(as_text=True)
 
             # Is user redirected to search page?
@@ -210,7 +313,8 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             
-            resp = c.get('/login')
+            with query_budget(db.engine, max_queries=0):
+                resp = c.get('/login')
             html = resp.get_data(as_text=True)
 
             # Does login form render?
@@ -225,7 +329,8 @@ class UserViewTestCase(TestCase):
         with self.client as c:
 
             form_data = {"identifier":"test1@test.com","password":"password"}
-            resp = c.post("/login", data=form_data, follow_redirects=True)
+            with query_budget(db.engine, max_queries=1):
+                resp = c.post("/login", data=form_data, follow_redirects=True)
             html = resp.get_data(as_text=True)
 
             # Is user redirected to search page?
@@ -240,7 +345,8 @@ class UserViewTestCase(TestCase):
         with self.client as c:
             
             form_data = {"identifier":"testuser1","password":"password"}
-            resp = c.post("/login", data=form_data, follow_redirects=True)
+            with query_budget(db.engine, max_queries=1):
+                resp = c.post("/login", data=form_data, follow_redirects=True)
             html = resp.get_data(as_text=True)
 
             # Is user redirected to search page?
@@ -256,10 +362,25 @@ class UserViewTestCase(TestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.u1.id
             
-            resp = c.get('/logout', follow_redirects=True)
+            with query_budget(db.engine, max_queries=1):
+                resp = c.get('/logout', follow_redirects=True)
             html = resp.get_data(as_text=True)
 
             # Is user redirected to login?
             self.assertEqual(resp.status_code, 200)
             self.assertIn("<h1>Welcome back</h1>", html)
             self.assertNotIn("testuser1", html)
+
+
+    def test_user_login_busy(self):
+        """Is login turned away quickly when the hashing queue is full?"""
+
+        with self.client as c:
+            with patch('hashing._slots', threading.Semaphore(0)):
+                form_data = {"identifier":"testuser1","password":"password"}
+                with query_budget(db.engine, max_queries=1):
+                    resp = c.post("/login", data=form_data)
+                html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 503)
+            self.assertIn(BUSY_ERROR.replace("'", "&#39;"), html)
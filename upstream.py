@@ -0,0 +1,96 @@
+"""Shared HTTP session for calls to upstream APIs (Mapbox, Refuge Restrooms).
+
+One pooled session per process keeps connections alive between requests instead of paying a TCP and TLS handshake on every call. The async entry point (asgi.py) uses a shared httpx.AsyncClient instead, created on first use so sync workers never import httpx.
+"""
+
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+TIMEOUT = (3.05, 10)  # seconds to connect, seconds to read
+POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 10))
+ASYNC_POOL_SIZE = int(os.environ.get('UPSTREAM_ASYNC_POOL_SIZE', 500))
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+
+
+def get(service, url, **kwargs):
+    """GET url through the shared session, with the default timeout unless one is given.
+
+    The call's duration is recorded under service ('mapbox', 'refuge') in the upstream latency metrics.
+    """
+
+    kwargs.setdefault('timeout', TIMEOUT)
+    start = time.perf_counter()
+    try:
+        return session.get(url, **kwargs)
+    finally:
+        metrics.observe_upstream(service, time.perf_counter() - start)
+
+
+_async_client = None
+
+
+def async_client():
+    """Shared httpx.AsyncClient holding up to ASYNC_POOL_SIZE connections."""
+
+    global _async_client
+
+    if _async_client is None:
+        import httpx
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=ASYNC_POOL_SIZE, max_keepalive_connections=ASYNC_POOL_SIZE),
+        )
+
+    return _async_client
+
+
+async def get_async(service, url, **kwargs):
+    """GET url through the shared async client, recording its duration like get()."""
+
+    start = time.perf_counter()
+    try:
+        return await async_client().get(url, **kwargs)
+    finally:
+        metrics.observe_upstream(service, time.perf_counter() - start)
+
+
+async def close_async_client():
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+class RateLimiter:
+    """Token bucket allowing on average `rate` calls per second, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token if one is available. Returns False if the call should be skipped."""
+
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            return True
@@ -0,0 +1,676 @@
+"""The app's routes, registered by create_app (see app.py)."""
+
+from datetime import timezone
+from flask import Blueprint, render_template, request, flash, redirect, session, g, jsonify, Response, stream_with_context
+from sqlalchemy.exc import IntegrityError
+from werkzeug.http import http_date
+from sqlalchemy.orm import undefer
+from forms import RegisterForm, UserEditForm, LoginForm, SavedSearchEditForm
+from models import db, User, SavedSearch
+from hashing import HashingBusy
+from cache import make_cache
+import encoding
+import export
+import geocode
+import metrics
+import restrooms
+import snapshots
+import requests
+import hashlib
+import os
+
+bp = Blueprint('views', __name__)
+
+CURR_USER_KEY = "curr_user"
+AUTH_ERROR = "Authorization Error: You are not authorized to access this page."
+BUSY_ERROR = "We're handling a lot of logins right now. Please try again in a moment."
+
+
+##################################################
+# User signup/login/logout
+
+class CurrentUser:
+    """Logged in user, from the id and username in user_cache.
+
+    Reading id or username costs nothing. Any other attribute loads the full User from the database, once per request.
+    """
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+        self._user = None
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def load(self):
+        """Return the full User model."""
+
+        if self._user is None:
+            self._user = User.query.get_or_404(self.id)
+        return self._user
+
+
+# Logged in users' ids and usernames, so requests needn't query the database to find who's logged in. Logging in or editing a profile refreshes a user's entry and deleting the user drops it; other processes may see the old entry for up to USER_CACHE_TTL seconds.
+user_cache = make_cache(
+    'users',
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('USER_CACHE_TTL', 300)),
+)
+
+
+def load_principal(user_id):
+    """The id and username of the user with user_id, or None if there's no such user."""
+
+    row = db.session.query(User.id, User.username).filter_by(id=user_id).first()
+    return {'id': row.id, 'username': row.username} if row else None
+
+
+@bp.before_app_request
+def add_user_to_g():
+    """If we're logged in, add curr user to Flask global."""
+
+    if CURR_USER_KEY not in session:
+        g.user = None
+        return
+
+    user_id = session[CURR_USER_KEY]
+    principal = user_cache.get_or_load(user_id, lambda: load_principal(user_id))
+
+    if principal is None:
+        # The user was deleted. Don't remember the miss, in case a user with this id is restored
+        user_cache.delete(user_id)
+        do_logout()
+        g.user = None
+        return
+
+    g.user = CurrentUser(principal['id'], principal['username'])
+
+
+def do_login(user):
+    """Log in user."""
+
+    session[CURR_USER_KEY] = user.id
+    user_cache.set(user.id, {'id': user.id, 'username': user.username})
+
+
+def do_logout():
+    """Logout user."""
+
+    session.pop(CURR_USER_KEY, None)
+
+
+@bp.route('/signup', methods=["GET", "POST"])
+def signup():
+    """Handle user signup.
+
+    Create new user and add to DB. Redirect to home page.
+
+    If form not valid, present form.
+
+    If the there already is a user with that email: flash message
+    and re-present form.
+    """
+
+    form = RegisterForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.signup(
+                username=form.username.data,
+                email=form.email.data,
+                password=form.password.data,
+            )
+            # Flush for the new id so logging in doesn't reload the user after commit
+            db.session.flush()
+            do_login(user)
+            db.session.commit()
+
+        except IntegrityError:
+            flash("Email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+        except HashingBusy:
+            flash(BUSY_ERROR, 'danger')
+            return (render_template('users/signup.html', form=form), 503)
+
+        return redirect("/")
+
+    else:
+        return render_template('users/signup.html', form=form)
+
+
+@bp.route('/login', methods=["GET", "POST"])
+def login():
+    """Handle user login."""
+
+    form = LoginForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.authenticate(form.identifier.data, form.password.data)
+        except HashingBusy:
+            flash(BUSY_ERROR, 'danger')
+            return (render_template('users/login.html', form=form), 503)
+
+        if user:
+            do_login(user)
+            flash(f"Hello, {user.username}!", "success")
+            # Saves the password hash if authenticate upgraded its cost
+            db.session.commit()
+            return redirect("/")
+
+        flash("Invalid credentials.", 'danger')
+
+    return render_template('users/login.html', form=form)
+
+
+@bp.route('/logout')
+def logout():
+    """Handle user logout."""
+
+    do_logout()
+    flash("Goodbye!", "success")
+    return redirect("/login")
+
+
+##################################################
+# User profile routes
+
+@bp.route('/users/<int:user_id>')
+def show_user(user_id):
+    """Show user profile."""
+    
+    if not g.user or not g.user.id == user_id:
+        flash(AUTH_ERROR, "danger")
+        return redirect("/")
+
+    searches, next_after = SavedSearch.page_for_user(user_id)
+
+    return render_template('users/show.html', user=g.user, searches=searches, next_after=next_after)
+
+
+@bp.route('/users/<int:user_id>/searches')
+def list_saved_searches(user_id):
+    """Page of user's saved searches, returned jsonified. Pass ?after=<next_after> from the previous page for the next one."""
+
+    if not g.user or not g.user.id == user_id:
+        return (jsonify(detail=AUTH_ERROR), 403)
+
+    after_id = request.args.get('after', type=int)
+    searches, next_after = SavedSearch.page_for_user(user_id, after_id)
+
+    # The page changes only if a search is added, removed or edited
+    version = repr([(id, updated_at.isoformat()) for id, _, updated_at in searches] + [next_after])
+    etag = hashlib.md5(version.encode()).hexdigest()
+    headers = cache_headers(etag, PRIVATE_CACHE_CONTROL)
+    if is_fresh(etag):
+        return ("", 304, headers)
+
+    return (jsonify(searches=[{'id': id, 'name': name} for id, name, _ in searches], next_after=next_after), 200, headers)
+
+
+@bp.route('/users/<int:user_id>/export')
+def export_user(user_id):
+    """Download user's account details and saved searches, streamed as ?format=ndjson (default), csv or geojson. See export.py."""
+
+    if not g.user or not g.user.id == user_id:
+        return (jsonify(detail=AUTH_ERROR), 403)
+
+    name = request.args.get('format', 'ndjson')
+    account = {'id': g.user.id, 'username': g.user.username, 'email': g.user.email}
+
+    try:
+        body = export.export(name, SavedSearch.user_id == user_id, account=account)
+    except ValueError as e:
+        return (jsonify(detail=str(e)), 400)
+
+    _, mimetype, extension = export.FORMATS[name]
+    headers = {'Content-Disposition': f'attachment; filename="flusher-export.{extension}"', 'Cache-Control': "private, no-store"}
+
+    # Keep the request's database session open while the rows stream out
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+
+@bp.route('/users/<int:user_id>/edit', methods=["GET", "POST"])
+def edit_profile(user_id):
+    """Update profile for current user."""
+
+    if not g.user or not g.user.id == user_id:
+        flash(AUTH_ERROR, "danger")
+        return redirect("/")
+    
+    user = g.user.load()
+    form = UserEditForm(obj=user)
+
+    if form.validate_on_submit():
+        try:
+            confirmed = user.check_password(form.password.data)
+        except HashingBusy:
+            flash(BUSY_ERROR, 'danger')
+            return (render_template('users/edit.html', form=form, user_id=user.id), 503)
+
+        if confirmed:
+            user.username = form.username.data
+            user.email = form.email.data
+
+            db.session.commit()
+            do_login(user)
+            flash("Changed saved.", 'success')
+            return redirect(f"/users/{user.id}")
+
+        flash("Incorrect password. Please try again.", 'danger')
+
+    return render_template('users/edit.html', form=form, user_id=user.id)
+
+
+@bp.route('/users/<int:user_id>/delete', methods=["POST"])
+def delete_user(user_id):
+    """Delete user."""
+
+    if not g.user or not g.user.id == user_id:
+        flash(AUTH_ERROR, "danger")
+        return redirect("/")
+
+    user = g.user.load()
+    do_logout()
+
+    db.session.delete(user)
+    db.session.commit()
+    user_cache.delete(user_id)
+
+    flash("Profile deleted.", 'danger')
+    return redirect("/signup")
+
+
+##################################################
+# Saved Search routes
+
+
+@bp.route('/search/<int:search_id>')
+def populate_search(search_id):
+    """Individual saved search, returned jsonified to populate search parameters"""
+
+    # The snapshot stays deferred, so a 304 never loads it
+    saved_search = SavedSearch.query.get_or_404(search_id)
+    
+    if not g.user.id == saved_search.user_id:
+        flash(AUTH_ERROR, "danger")
+        return redirect("/login")
+
+    # Any change to the row, snapshot refreshes included, moves updated_at. Only the snapshot expiring changes with time alone.
+    snapshot_at = saved_search.snapshot_at.timestamp() if saved_search.snapshot_at else ''
+    expired = snapshots.is_expired(saved_search)
+    etag = f"{saved_search.id}-{saved_search.updated_at.timestamp()}-{snapshot_at}-{int(expired)}"
+    # An expired snapshot is shown as stale from the moment it expired
+    last_modified = max(saved_search.updated_at, snapshots.expires_at(saved_search)) if expired else saved_search.updated_at
+    headers = cache_headers(etag, PRIVATE_CACHE_CONTROL, last_modified)
+    if is_fresh(etag, last_modified):
+        return ("", 304, headers)
+
+    return (jsonify(saved_search=saved_search.serialize(), snapshot=snapshots.serialize(saved_search)), 200, headers)
+
+
+@bp.route('/search/<int:search_id>/results')
+def refresh_search_results(search_id):
+    """Refresh saved search's restroom results if its snapshot is stale, returned jsonified.
+
+    Returns changed: false alone if the snapshot the client already has is still current, so only a changed result set is sent.
+    """
+
+    saved_search = SavedSearch.query.options(undefer(SavedSearch.snapshot)).get_or_404(search_id)
+
+    if not g.user or not g.user.id == saved_search.user_id:
+        return (jsonify(detail=AUTH_ERROR), 403)
+
+    if saved_search.lat is None or saved_search.lon is None or not snapshots.is_stale(saved_search):
+        return (jsonify(changed=False), 200)
+
+    try:
+        changed = snapshots.refresh(saved_search)
+    except requests.RequestException as e:
+        print(e)
+        return (jsonify(changed=False), 502)
+
+    # Serialize before committing expires the saved search
+    snapshot = snapshots.serialize(saved_search) if changed else None
+    db.session.commit()
+
+    if not changed:
+        return (jsonify(changed=False), 200)
+
+    return (jsonify(changed=True, snapshot=snapshot), 200)
+
+
+@bp.route('/search/add', methods=["POST"])
+def add_saved_search():
+    """Add Saved Search"""
+    
+    if not g.user:
+        return redirect(f"/login")
+
+    user_id = g.user.id
+    name = request.json['name']
+    query_string = request.json['query_string']
+    lon = request.json['lon']
+    lat = request.json['lat']
+    accessible = request.json['accessible']
+    unisex = request.json['unisex']
+    changing_table = request.json['changing_table']
+
+
+    saved_search = SavedSearch(
+        user_id=user_id,
+        name=name, 
+        query_string=query_string,
+        lon=lon, 
+        lat=lat,
+        accessible=accessible, 
+        unisex=unisex,
+        changing_table=changing_table
+    )
+    db.session.add(saved_search)
+    db.session.commit()
+    
+    return (jsonify(saved_search=saved_search.serialize()), 201)
+
+
+@bp.route('/search/<int:search_id>/edit', methods=["GET", "POST"])
+def edit_saved_search(search_id):
+    """Edit saved search"""
+    
+    saved_search = SavedSearch.query.get_or_404(search_id)
+    
+    if not g.user.id == saved_search.user_id:
+        flash(AUTH_ERROR, "danger")
+        return redirect("/login")
+    
+    form = SavedSearchEditForm(obj=saved_search)
+
+    if form.validate_on_submit():
+        saved_search.name = form.name.data
+
+        db.session.commit()
+
+        return redirect(f"/users/{saved_search.user_id}")
+
+    return render_template('saved_searches/edit.html', form=form, saved_search=saved_search)
+
+
+@bp.route('/search/<int:search_id>/delete', methods=["GET","POST"])
+def delete_saved_search(search_id):
+    """Delete saved search"""
+
+    saved_search = SavedSearch.query.get_or_404(search_id)
+    
+    if not g.user.id == saved_search.user_id:
+        flash(AUTH_ERROR, "danger")
+        return redirect("/login")
+
+    db.session.delete(saved_search)
+    db.session.commit()
+
+    return redirect(f"/users/{saved_search.user_id}")
+
+
+##################################################
+# Batch Saved Search routes
+#
+# Each accepts an array, runs it in one transaction with one or two
+# statements, and returns a result per item in the same order.
+
+MAX_BATCH = 1000
+
+
+def get_batch(key):
+    """Return the array under key in the request json. Raises ValueError if the body isn't an object, or the array is missing or too long."""
+
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+
+    items = body.get(key)
+
+    if not isinstance(items, list):
+        raise ValueError(f"{key} must be an array")
+    if len(items) > MAX_BATCH:
+        raise ValueError(f"at most {MAX_BATCH} {key} per request")
+
+    return items
+
+
+@bp.route('/search/batch')
+def fetch_saved_searches():
+    """Saved searches by id, e.g. /search/batch?ids=1,2,3"""
+
+    if not g.user:
+        return (jsonify(detail=AUTH_ERROR), 401)
+
+    try:
+        ids = [int(id) for id in request.args.get('ids', '').split(',') if id]
+    except ValueError:
+        return (jsonify(detail="ids must be integers"), 400)
+    if len(ids) > MAX_BATCH:
+        return (jsonify(detail=f"at most {MAX_BATCH} ids per request"), 400)
+
+    found = SavedSearch.fetch_many(g.user.id, ids)
+    results = [
+        {'status': 200, 'saved_search': found[id]} if id in found else {'status': 404, 'id': id}
+        for id in ids
+    ]
+
+    return (jsonify(results=results), 200)
+
+
+@bp.route('/search/batch/add', methods=["POST"])
+def add_saved_searches():
+    """Add saved searches from {"saved_searches": [...]}"""
+
+    if not g.user:
+        return (jsonify(detail=AUTH_ERROR), 401)
+
+    try:
+        items = get_batch('saved_searches')
+    except ValueError as e:
+        return (jsonify(detail=str(e)), 400)
+
+    results = []
+    rows = []
+    for item in items:
+        try:
+            rows.append(SavedSearch.clean(item))
+            results.append(None)
+        except ValueError as e:
+            results.append({'status': 400, 'error': str(e)})
+
+    created = iter(SavedSearch.insert_many(g.user.id, rows))
+    db.session.commit()
+
+    results = [result or {'status': 201, 'saved_search': next(created)} for result in results]
+
+    return (jsonify(results=results), 200)
+
+
+@bp.route('/search/batch/edit', methods=["POST"])
+def edit_saved_searches():
+    """Update saved searches from {"saved_searches": [{"id": ..., <fields to change>}, ...]}"""
+
+    if not g.user:
+        return (jsonify(detail=AUTH_ERROR), 401)
+
+    try:
+        items = get_batch('saved_searches')
+    except ValueError as e:
+        return (jsonify(detail=str(e)), 400)
+
+    errors = {}
+    changes = {}
+    for i, item in enumerate(items):
+        try:
+            # bool is an int subclass, but true isn't an id
+            if not isinstance(item, dict) or type(item.get('id')) is not int:
+                raise ValueError("id is required")
+            changes.setdefault(item['id'], {}).update(SavedSearch.clean(item, partial=True))
+        except ValueError as e:
+            errors[i] = str(e)
+
+    updated = SavedSearch.update_many(g.user.id, changes)
+    db.session.commit()
+
+    results = []
+    for i, item in enumerate(items):
+        if i in errors:
+            results.append({'status': 400, 'error': errors[i]})
+        elif item['id'] in updated:
+            results.append({'status': 200, 'saved_search': updated[item['id']]})
+        else:
+            results.append({'status': 404, 'id': item['id']})
+
+    return (jsonify(results=results), 200)
+
+
+@bp.route('/search/batch/delete', methods=["POST"])
+def delete_saved_searches():
+    """Delete saved searches from {"ids": [...]}"""
+
+    if not g.user:
+        return (jsonify(detail=AUTH_ERROR), 401)
+
+    try:
+        ids = get_batch('ids')
+    except ValueError as e:
+        return (jsonify(detail=str(e)), 400)
+    if not all(type(id) is int for id in ids):
+        return (jsonify(detail="ids must be integers"), 400)
+
+    deleted = SavedSearch.delete_many(g.user.id, ids)
+    db.session.commit()
+
+    results = [{'status': 200 if id in deleted else 404, 'id': id} for id in ids]
+
+    return (jsonify(results=results), 200)
+
+
+##################################################
+# Homepage, Search Page, and error pages
+
+
+@bp.route('/')
+def root():
+    """Homepage. If user is logged in redirect to search page, otherwise show landing page."""
+
+    if g.user:
+        return redirect("/search")
+
+    return render_template('landing.html')
+
+
+@bp.route('/search')
+def show_search_page():
+    """Show search page, including search form and results"""
+
+    return render_template("search.html", mapboxToken=os.environ['MAPBOX_TOKEN'])
+
+
+@bp.app_errorhandler(404)
+def page_not_found(e):
+    """404 Page Not Found"""
+
+    return render_template('404.html'), 404
+
+
+##################################################
+# HTTP caching
+
+# Browsers keep user-specific responses but check with us before reusing them
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def cache_headers(etag, cache_control, last_modified=None):
+    """ETag, Cache-Control and optionally Last-Modified response headers."""
+
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified.replace(tzinfo=timezone.utc))
+
+    return headers
+
+
+def is_fresh(etag, last_modified=None):
+    """Does the client already have this version, going by If-None-Match, or else If-Modified-Since?"""
+
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if last_modified is None or request.if_modified_since is None:
+        return False
+
+    # HTTP dates have whole seconds
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+
+
+##################################################
+# API routes
+
+
+@bp.route("/api/reverse-geocode", methods=["POST"])
+def get_reverse_geocode():
+    """Show top result through mapbox using coordinates"""
+
+    try:
+        lon, lat = geocode.parse_coordinates(request.get_json(silent=True))
+    except ValueError as e:
+        return (jsonify(detail=str(e)), 400)
+
+    try:
+        result = geocode.reverse_geocode(lon, lat)
+    except (geocode.RateLimited, requests.RequestException) as e:
+        print(repr(e))
+        result = None
+
+    # Return empty object if no results
+    if not result:
+        return (jsonify(detail={}), 200)
+
+    return (jsonify(result=result), 200)
+
+
+@bp.route("/api/restrooms")
+def get_restrooms():
+    """Restrooms near lat/lon matching the filters, closest first. Send format=columns for encoding.to_columns format."""
+
+    try:
+        search_args = restrooms.parse_args(request.args)
+        result_format = encoding.result_format(request.args)
+    except ValueError as e:
+        return (jsonify(detail=str(e)), 400)
+
+    try:
+        results = restrooms.search(**search_args)
+    except requests.RequestException as e:
+        print(e)
+        return (jsonify(restrooms=result_format([])), 502)
+
+    # Results depend only on the query string, so shared caches may keep them too
+    response = jsonify(restrooms=result_format(results))
+    response.add_etag()
+    response.headers['Cache-Control'] = f"public, max-age={restrooms.CACHE_MAX_AGE}"
+
+    return response.make_conditional(request)
+
+
+##################################################
+# Metrics
+
+
+@bp.route("/metrics")
+def show_metrics():
+    """Performance metrics in Prometheus text format. If METRICS_TOKEN is set, it must be sent as a bearer token."""
+
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return ("", 401)
+
+    return Response(metrics.render(db.engine), mimetype='text/plain; version=0.0.4')
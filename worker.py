@@ -0,0 +1,61 @@
+"""Run background jobs from the jobs table (see jobs.py).
+
+Start as many workers, in as many processes, as the queue needs. Each serves its own job metrics on --metrics-port, if given.
+
+    $ python worker.py [--threads 1] [--batch 1] [--metrics-port 9200]
+"""
+
+import argparse
+import signal
+import threading
+from wsgiref.simple_server import make_server
+import jobs
+import metrics
+from models import db
+from app import create_app
+
+
+def serve_metrics(app, port):
+    """Serve this process's metrics in Prometheus text format on a daemon thread."""
+
+    def metrics_app(environ, start_response):
+        with app.app_context():
+            body = metrics.render(db.engine).encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4')])
+        return [body]
+
+    server = make_server('', port, metrics_app)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=1, help="workers in this process")
+    parser.add_argument('--batch', type=int, default=1, help="jobs each worker claims at a time")
+    parser.add_argument('--metrics-port', type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(views=False)
+    db.create_all()
+
+    if args.metrics_port:
+        serve_metrics(app, args.metrics_port)
+
+    # Finish the jobs in hand, then stop
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    def target():
+        with app.app_context():
+            jobs.work(stop, args.batch)
+
+    threads = [threading.Thread(target=target, name=f"jobs-{i}") for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()